@@ -55,23 +55,34 @@ TEXT_TO_START_CONVERSATION = {
 
 CONVERSATION_RESET_TEXT = '会話をリセットする'
 
+# 検索結果の続きを表示するクイックリプライの文言
+MORE_RESULTS_TEXT = 'もっと見る'
+
 ERROR_TEXT = {
     'EXCEPTION_ERROR_MESSAGE': '予期せぬエラーが発生しました。リッチメニューから会話をリセットしてください。',
     'SELECT_FROM_RICH_MENU': 'リッチメニューから選択してください。',
     'SELECT_FROM_QUICK_REPLY': '選択肢の中から選んでください。',
     'NO_CONVERSATION_DATA': '会話記録がありません。',
-    'NOT_SUPPORTED_TYPE_MESSAGE': '送信いただいたメッセージタイプはサポートしていません。'
+    'NOT_SUPPORTED_TYPE_MESSAGE': '送信いただいたメッセージタイプはサポートしていません。',
+    'ALREADY_ANSWERED': 'この質問には既に回答済みです。',
+    'INVALID_QUICK_REPLY': 'この選択肢は使用できません。リッチメニューから検索をやり直してください。',
+    'SEARCH_BUSY': '只今検索が混み合っています。少し時間をおいてから、もう一度お試しください。',
+    'SEARCH_UNAVAILABLE': '申し訳ありません。只今お店の検索を利用できません。しばらくしてから、もう一度お試しください。'
 }
 
 MAX_STARS = 5
 STAR_NAMES = {
     'FULL_STAR': 'star-solid.svg',
-    'HARF_STAR': 'star-half-stroke-solid.svg',
+    'HALF_STAR': 'star-half-stroke-solid.svg',
     'EMPTY_STAR': 'star-regular.svg'
 }
 
 INFORM_TEXT = {
-    'RESET_CONVERSATION': '会話履歴をリセットしました。'
+    'RESET_CONVERSATION': '会話履歴をリセットしました。',
+    'NO_RESULTS': '条件に合うお店が見つかりませんでした。',
+    'NO_MORE_RESULTS': 'これ以上の検索結果はありません。',
+    'SEARCHING': '検索中…結果がまとまり次第お送りします。',
+    'STALE_RESULTS': '只今検索が混み合っているため、少し前の近くでの検索結果を表示しています。営業状況が変わっている可能性があります。'
 }
 
 ASK_LOCATION_QUESTION = '現在地を選択してください'
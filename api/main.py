@@ -1,12 +1,22 @@
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from api.routers import line
+from fastapi.responses import PlainTextResponse
+from api.routers import (
+    images,
+    line,
+    photos
+)
+from api.utils.metrics import REGISTRY
 
 app = FastAPI()
 app.include_router(line.router)
-
-app.mount("/images", StaticFiles(directory="images"), name="images")
+app.include_router(photos.router)
+app.include_router(images.router)
 
 @app.get("/hello")
 async def hello():
     return {"message": "hello world!"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,254 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from firebase_admin import firestore
+
+# 会話記録の取得時に読み込むフィールド。会話の進行にはこれ以外のフィールドを使用しない
+CONVERSATION_FIELDS = ('type', 'current_status', 'answer')
+# 検索結果のページ送りで読み込むフィールド
+RESULT_FIELDS = ('type', 'answer', 'location', 'candidates', 'next_page_token')
+
+
+def project_conversation_fields(data: dict, fields: Tuple[str, ...] = CONVERSATION_FIELDS) -> dict:
+    """
+    会話記録から指定したフィールドだけを取り出す
+
+    Firestoreのフィールドマスクと同じく、存在しないフィールドは含めない
+
+    Parameters
+    ----------
+    data - dict
+        会話記録
+    fields - Tuple[str, ...]
+        取り出すフィールド。省略した場合はCONVERSATION_FIELDS
+
+    Returns
+    -------
+    dict
+        指定したフィールドだけを持つdict
+    """
+    return {field: data[field] for field in fields if field in data}
+
+
+def can_record_answer(data: Optional[dict], expected_status: int, property: str) -> bool:
+    """
+    会話記録が回答を記録できる状態か判定する
+
+    最後の質問ではcurrent_statusが進まないため、質問のステータスに加えて回答が未記録であることも確認する
+
+    Parameters
+    ----------
+    data - Optional[dict]
+        current_statusとanswerを含む会話記録。存在しない場合はNone
+    expected_status - int
+        回答する質問のステータスナンバー
+    property - str
+        回答を保存するanswerのキー
+
+    Returns
+    -------
+    bool
+        会話記録があり、質問が進んでおらず、回答がまだ記録されていない場合True
+    """
+    if data is None or data.get('current_status') != expected_status:
+        return False
+    return property not in (data.get('answer') or {})
+
+
+def create_answer_update(property: str, value: str, next_status: Optional[int]) -> dict:
+    """
+    回答の記録と次の質問への移行を表す更新内容を作成する
+
+    Parameters
+    ----------
+    property - str
+        回答を保存するanswerのキー
+    value - str
+        回答内容
+    next_status - Optional[int]
+        次の質問のステータスナンバー。最後の質問の場合はNoneでcurrent_statusを変更しない
+
+    Returns
+    -------
+    dict
+        ドット区切りのフィールドパスを含む更新内容
+    """
+    data = {'answer.' + property: value, 'updated_at': firestore.SERVER_TIMESTAMP}
+    if next_status is not None:
+        data['current_status'] = next_status
+    return data
+
+
+class AsyncConversationRepository(ABC):
+    """
+    会話記録のDB操作を非同期で行う実装クラスのインターフェース
+
+    ConversationRepositoryと同じCRUDの基本的なDB操作をコルーチンとして定義
+    イベントループをブロックせずにDBへアクセスするため、ConversationManagerServiceはこちらを利用する
+    """
+    @abstractmethod
+    async def store(self, data: dict) -> None:
+        """
+        会話データを新規で保存
+
+        Parameters
+        ----------
+        data - dict
+            保存するデータの内容
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def update(self, user_id: str, data: dict) -> None:
+        """
+        会話データの更新
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        data - dict
+            更新したい内容
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def delete(self, user_id: str) -> None:
+        """
+        会話データを削除
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def get_conversation_info_by_user_id(self, user_id: str) -> Optional[dict]:
+        """
+        特定ユーザーの会話記録を取得
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+
+        Returns
+        -------
+        Optional[dict]
+            会話記録。存在しない場合はNone
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def get_result_candidates(self, user_id: str) -> Optional[dict]:
+        """
+        特定ユーザーの検索結果の続きを取得
+
+        読み込むのはRESULT_FIELDSのフィールドのみ
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+
+        Returns
+        -------
+        Optional[dict]
+            表示していない検索結果の候補などを含む会話記録。存在しない場合はNone
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def record_answer(self, user_id: str, expected_status: int, property: str, value: str, next_status: Optional[int]) -> bool:
+        """
+        回答を記録し次の質問へ進める
+
+        can_record_answer(会話記録のcurrent_statusがexpected_statusで、回答が未記録)の場合に限り、create_answer_updateの内容で更新する
+        確認と更新は1つのトランザクションで行うため、同じユーザーのメッセージが同時に処理されても
+        同じ質問に対する回答が二重に記録されることはない
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        expected_status - int
+            回答する質問のステータスナンバー
+        property - str
+            回答を保存するanswerのキー
+        value - str
+            回答内容
+        next_status - Optional[int]
+            次の質問のステータスナンバー。最後の質問の場合はNone
+
+        Returns
+        -------
+        bool
+            更新した場合True。会話記録がない・既に別の質問に進んでいた・既に回答済みの場合False
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def fetch_answers_and_delete(self, user_id: str, is_complete: Callable[[dict], bool]) -> Optional[dict]:
+        """
+        会話記録を取得し、回答が揃っていれば削除する
+
+        取得と削除は1つのトランザクションで行い、読み込むのはCONVERSATION_FIELDSのフィールドのみ
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        is_complete - Callable[[dict], bool]
+            取得した会話記録を受け取り、削除する場合にTrueを返す関数
+
+        Returns
+        -------
+        Optional[dict]
+            削除したかどうかに関わらず取得した会話記録。存在しない場合はNone
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def find_idle(self, updated_before: datetime, limit: int) -> List[str]:
+        """
+        最後の更新から一定時間が経過した会話記録のユーザーIDを取得する
+
+        updated_atを持たない会話記録は対象外
+
+        Parameters
+        ----------
+        updated_before - datetime
+            この時刻より前に最後に更新された会話記録を対象とする
+        limit - int
+            取得する最大件数
+
+        Returns
+        -------
+        List[str]
+            LINEユーザーのユニークIDのリスト
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def delete_idle(self, user_ids: List[str], updated_before: datetime) -> int:
+        """
+        指定したユーザーの会話記録のうち、現在もupdated_before以降に更新されていないものをまとめて削除する
+
+        確認と削除は1つのトランザクションで行うため、find_idleの後に会話が再開された記録は削除しない
+
+        Parameters
+        ----------
+        user_ids - List[str]
+            LINEユーザーのユニークIDのリスト
+        updated_before - datetime
+            この時刻より前に最後に更新された会話記録を削除する
+
+        Returns
+        -------
+        int
+            削除した件数
+        """
+        raise NotImplementedError()
@@ -0,0 +1,228 @@
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from google.cloud.firestore_v1.async_transaction import async_transactional
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from api.repository.async_conversation_repository import (
+    CONVERSATION_FIELDS,
+    RESULT_FIELDS,
+    AsyncConversationRepository,
+    can_record_answer,
+    create_answer_update
+)
+from api.utils.firebase_manager import FirebaseManager
+
+
+class AsyncFirebaseConversationRepository(AsyncConversationRepository):
+    """
+    FirestoreのAsyncClientで会話記録のDB管理をするクラス
+
+    AsyncConversationRepository(interface)を継承しCRUDの基本的なDB操作について定義
+    DBへのアクセス中もイベントループをブロックしないため、他ユーザーの処理が待たされない
+
+    Attributes
+        client - AsyncClient
+            トランザクションの開始に使用するFirestoreのクライアント
+        db - AsyncCollectionReference
+            Firebaseのconversationsコレクションとの非同期接続を司る
+    """
+
+    def __init__(self):
+        self.client = FirebaseManager.get_instance().async_db
+        self.db = self.client.collection('conversations')
+
+    async def store(self, data: dict) -> None:
+        """
+        会話データを新規で保存
+
+        Parameters
+        ----------
+        data - dict
+            保存するデータの内容
+        """
+        await self.db.document(data['user_id']).set(data)
+
+    async def update(self, user_id: str, data: dict) -> None:
+        """
+        会話データの更新
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        data - dict
+            更新したい内容
+        """
+        await self.db.document(user_id).update(data)
+
+    async def delete(self, user_id: str) -> None:
+        """
+        会話データを削除
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        """
+        await self.db.document(user_id).delete()
+
+    async def get_conversation_info_by_user_id(self, user_id: str) -> Optional[dict]:
+        """
+        特定ユーザーの会話記録を取得
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+
+        Returns
+        -------
+        Optional[dict]
+            会話記録。存在しない場合はNone
+        """
+        result = await self.db.document(user_id).get(field_paths=CONVERSATION_FIELDS)
+        if not result.exists:
+            return None
+        return result.to_dict()
+
+    async def get_result_candidates(self, user_id: str) -> Optional[dict]:
+        """
+        特定ユーザーの検索結果の続きを取得
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+
+        Returns
+        -------
+        Optional[dict]
+            表示していない検索結果の候補などを含む会話記録。存在しない場合はNone
+        """
+        result = await self.db.document(user_id).get(field_paths=RESULT_FIELDS)
+        if not result.exists:
+            return None
+        return result.to_dict()
+
+    async def record_answer(self, user_id: str, expected_status: int, property: str, value: str, next_status: Optional[int]) -> bool:
+        """
+        回答を記録し次の質問へ進める
+
+        トランザクション内でcurrent_statusと回答するanswerのキーのみを読み込み、
+        expected_statusと一致し回答が未記録の場合に更新する
+        同時に他の更新が行われた場合、トランザクションは読み込みからやり直される
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        expected_status - int
+            回答する質問のステータスナンバー
+        property - str
+            回答を保存するanswerのキー
+        value - str
+            回答内容
+        next_status - Optional[int]
+            次の質問のステータスナンバー。最後の質問の場合はNone
+
+        Returns
+        -------
+        bool
+            更新した場合True。会話記録がない・既に別の質問に進んでいた・既に回答済みの場合False
+        """
+        reference = self.db.document(user_id)
+
+        @async_transactional
+        async def apply(transaction) -> bool:
+            snapshot = await reference.get(field_paths=['current_status', 'answer.' + property], transaction=transaction)
+            if not snapshot.exists or not can_record_answer(snapshot.to_dict(), expected_status, property):
+                return False
+            transaction.update(reference, create_answer_update(property, value, next_status))
+            return True
+
+        return await apply(self.client.transaction())
+
+    async def fetch_answers_and_delete(self, user_id: str, is_complete: Callable[[dict], bool]) -> Optional[dict]:
+        """
+        会話記録を取得し、回答が揃っていれば削除する
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        is_complete - Callable[[dict], bool]
+            取得した会話記録を受け取り、削除する場合にTrueを返す関数
+
+        Returns
+        -------
+        Optional[dict]
+            削除したかどうかに関わらず取得した会話記録。存在しない場合はNone
+        """
+        reference = self.db.document(user_id)
+
+        @async_transactional
+        async def apply(transaction) -> Optional[dict]:
+            snapshot = await reference.get(field_paths=CONVERSATION_FIELDS, transaction=transaction)
+            if not snapshot.exists:
+                return None
+            data = snapshot.to_dict()
+            if is_complete(data):
+                transaction.delete(reference)
+            return data
+
+        return await apply(self.client.transaction())
+
+    async def find_idle(self, updated_before: datetime, limit: int) -> List[str]:
+        """
+        最後の更新から一定時間が経過した会話記録のユーザーIDを取得する
+
+        ドキュメントIDだけが必要なため、フィールドは読み込まない
+
+        Parameters
+        ----------
+        updated_before - datetime
+            この時刻より前に最後に更新された会話記録を対象とする
+        limit - int
+            取得する最大件数
+
+        Returns
+        -------
+        List[str]
+            LINEユーザーのユニークIDのリスト
+        """
+        query = self.db.where(filter=FieldFilter('updated_at', '<', updated_before)).select([]).limit(limit)
+        return [snapshot.id for snapshot in await query.get()]
+
+    async def delete_idle(self, user_ids: List[str], updated_before: datetime) -> int:
+        """
+        指定したユーザーの会話記録のうち、現在もupdated_before以降に更新されていないものをまとめて削除する
+
+        トランザクション内でupdated_atのみを読み込み、削除は1回のコミットでまとめて書き込む
+        1回のコミットで書き込める件数の上限(500件)を超えないよう、user_idsの件数は呼び出し側で制限すること
+
+        Parameters
+        ----------
+        user_ids - List[str]
+            LINEユーザーのユニークIDのリスト
+        updated_before - datetime
+            この時刻より前に最後に更新された会話記録を削除する
+
+        Returns
+        -------
+        int
+            削除した件数
+        """
+        references = [self.db.document(user_id) for user_id in user_ids]
+
+        @async_transactional
+        async def apply(transaction) -> int:
+            deleted = 0
+            async for snapshot in self.client.get_all(references, field_paths=['updated_at'], transaction=transaction):
+                updated_at = snapshot.to_dict().get('updated_at') if snapshot.exists else None
+                if updated_at is not None and updated_at < updated_before:
+                    transaction.delete(snapshot.reference)
+                    deleted += 1
+            return deleted
+
+        return await apply(self.client.transaction())
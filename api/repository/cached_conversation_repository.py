@@ -0,0 +1,306 @@
+import copy
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from api.repository.async_conversation_repository import (
+    RESULT_FIELDS,
+    AsyncConversationRepository,
+    create_answer_update,
+    project_conversation_fields
+)
+from api.utils.helper import apply_field_updates
+
+
+class CachedConversationRepository(AsyncConversationRepository):
+    """
+    会話記録をメモリ上にキャッシュするライトスルーキャッシュ
+
+    任意のAsyncConversationRepositoryをラップし、直近の会話記録をLRU + TTLで保持する
+    - store / update はラップしたリポジトリへ書き込んだ上でキャッシュも更新する
+    - record_answer はラップしたリポジトリで更新できた場合にキャッシュにも反映し、できなかった場合はキャッシュを無効化する
+    - delete / fetch_answers_and_delete / delete_idle はキャッシュを無効化した上でラップしたリポジトリで処理する
+    - get_conversation_info_by_user_id はキャッシュにあればDBへアクセスせずに返却する
+    キャッシュするのはCONVERSATION_FIELDSのフィールドのみ
+
+    キャッシュはプロセス内にしか存在しないため、複数プロセスで同じユーザーを処理する構成では
+    TTLを短く設定すること。
+
+    Parameters
+    ----------
+    repository : AsyncConversationRepository
+        実際に読み書きを行うリポジトリ
+    maxsize : int
+        キャッシュする会話記録の最大件数。超えた場合は最も使われていないものから破棄する
+    ttl : float
+        キャッシュの有効秒数
+
+    Attributes
+    ----------
+    hits : int
+        キャッシュから返却した回数
+    misses : int
+        キャッシュになくリポジトリから取得した回数
+    evictions : int
+        件数上限またはTTL切れで破棄した回数
+    """
+
+    def __init__(self, repository: AsyncConversationRepository, maxsize: int = 10000, ttl: float = 300.0):
+        self.repository = repository
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def store(self, data: dict) -> None:
+        """
+        会話データを新規で保存し、キャッシュにも保持する
+
+        Parameters
+        ----------
+        data - dict
+            保存するデータの内容
+        """
+        await self.repository.store(data)
+        self._set(data['user_id'], copy.deepcopy(project_conversation_fields(data)))
+
+    async def update(self, user_id: str, data: dict) -> None:
+        """
+        会話データを更新し、キャッシュ済みであればキャッシュにも反映する
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        data - dict
+            更新したい内容
+        """
+        try:
+            await self.repository.update(user_id, data)
+        except Exception:
+            self._entries.pop(user_id, None)
+            raise
+
+        cached = self._get(user_id)
+        if cached is not None:
+            apply_field_updates(cached, copy.deepcopy(data))
+            self._set(user_id, project_conversation_fields(cached))
+
+    async def delete(self, user_id: str) -> None:
+        """
+        会話データを削除し、キャッシュを無効化する
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        """
+        self._entries.pop(user_id, None)
+        await self.repository.delete(user_id)
+
+    async def get_conversation_info_by_user_id(self, user_id: str) -> Optional[dict]:
+        """
+        特定ユーザーの会話記録を取得
+
+        キャッシュにあればそのコピーを、なければリポジトリから取得した内容をキャッシュして返却する
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+
+        Returns
+        -------
+        Optional[dict]
+            会話記録。存在しない場合はNone
+        """
+        cached = self._get(user_id)
+        if cached is not None:
+            self.hits += 1
+            return copy.deepcopy(cached)
+
+        self.misses += 1
+        data = await self.repository.get_conversation_info_by_user_id(user_id)
+        if data is not None:
+            self._set(user_id, copy.deepcopy(data))
+        return data
+
+    async def get_result_candidates(self, user_id: str) -> Optional[dict]:
+        """
+        特定ユーザーの検索結果の続きを取得
+
+        候補はキャッシュしないため、常にラップしたリポジトリから取得する
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+
+        Returns
+        -------
+        Optional[dict]
+            表示していない検索結果の候補などを含む会話記録。存在しない場合はNone
+        """
+        return await self.repository.get_result_candidates(user_id)
+
+    async def record_answer(self, user_id: str, expected_status: int, property: str, value: str, next_status: Optional[int]) -> bool:
+        """
+        回答を記録し次の質問へ進め、キャッシュ済みであればキャッシュにも反映する
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        expected_status - int
+            回答する質問のステータスナンバー
+        property - str
+            回答を保存するanswerのキー
+        value - str
+            回答内容
+        next_status - Optional[int]
+            次の質問のステータスナンバー。最後の質問の場合はNone
+
+        Returns
+        -------
+        bool
+            更新した場合True。会話記録がない・既に別の質問に進んでいた・既に回答済みの場合False
+        """
+        try:
+            applied = await self.repository.record_answer(user_id, expected_status, property, value, next_status)
+        except Exception:
+            self._entries.pop(user_id, None)
+            raise
+
+        if not applied:
+            # 他のプロセスで更新された可能性があるため、次回はリポジトリから読み込む
+            self._entries.pop(user_id, None)
+            return False
+
+        cached = self._get(user_id)
+        if cached is not None:
+            apply_field_updates(cached, create_answer_update(property, value, next_status))
+            self._set(user_id, project_conversation_fields(cached))
+        return True
+
+    async def fetch_answers_and_delete(self, user_id: str, is_complete: Callable[[dict], bool]) -> Optional[dict]:
+        """
+        キャッシュを無効化した上で、会話記録を取得し回答が揃っていれば削除する
+
+        削除の判定はリポジトリのトランザクション内で行う必要があるため、キャッシュは使用しない
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        is_complete - Callable[[dict], bool]
+            取得した会話記録を受け取り、削除する場合にTrueを返す関数
+
+        Returns
+        -------
+        Optional[dict]
+            削除したかどうかに関わらず取得した会話記録。存在しない場合はNone
+        """
+        self._entries.pop(user_id, None)
+        return await self.repository.fetch_answers_and_delete(user_id, is_complete)
+
+    async def find_idle(self, updated_before: datetime, limit: int) -> List[str]:
+        """
+        最後の更新から一定時間が経過した会話記録のユーザーIDを取得する
+
+        Parameters
+        ----------
+        updated_before - datetime
+            この時刻より前に最後に更新された会話記録を対象とする
+        limit - int
+            取得する最大件数
+
+        Returns
+        -------
+        List[str]
+            LINEユーザーのユニークIDのリスト
+        """
+        return await self.repository.find_idle(updated_before, limit)
+
+    async def delete_idle(self, user_ids: List[str], updated_before: datetime) -> int:
+        """
+        キャッシュを無効化した上で、放置された会話記録をまとめて削除する
+
+        Parameters
+        ----------
+        user_ids - List[str]
+            LINEユーザーのユニークIDのリスト
+        updated_before - datetime
+            この時刻より前に最後に更新された会話記録を削除する
+
+        Returns
+        -------
+        int
+            削除した件数
+        """
+        for user_id in user_ids:
+            self._entries.pop(user_id, None)
+        return await self.repository.delete_idle(user_ids, updated_before)
+
+    def get_stats(self) -> dict:
+        """
+        キャッシュのヒット数・ミス数などを返却する
+
+        Returns
+        -------
+        dict
+            キャッシュの統計情報
+        """
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _get(self, user_id: str) -> Optional[dict]:
+        """
+        有効期限内のキャッシュを取得し、最近使われたものとして末尾に移動する
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+
+        Returns
+        -------
+        Optional[dict]
+            キャッシュ済みの会話記録。ない場合や期限切れの場合はNone
+        """
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+
+        expires_at, data = entry
+        if expires_at < time.monotonic():
+            del self._entries[user_id]
+            self.evictions += 1
+            return None
+
+        self._entries.move_to_end(user_id)
+        return data
+
+    def _set(self, user_id: str, data: dict) -> None:
+        """
+        会話記録をキャッシュし、件数上限を超えた分を古いものから破棄する
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        data - dict
+            キャッシュする会話記録
+        """
+        self._entries[user_id] = (time.monotonic() + self.ttl, data)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
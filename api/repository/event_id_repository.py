@@ -0,0 +1,42 @@
+from abc import ABC, abstractmethod
+
+
+class EventIdRepository(ABC):
+    """
+    処理済みのWebhookイベントID(webhookEventId)を記録する実装クラスのインターフェース
+
+    再送(isRedelivery)されたイベントを重複して処理しないために使用する
+    記録したIDは一定時間で失効する
+    """
+    @abstractmethod
+    async def add_if_absent(self, event_id: str) -> bool:
+        """
+        イベントIDが未記録であれば記録する
+
+        確認と記録は不可分に行い、同じIDを同時に記録しようとした場合も1件だけがTrueになる
+
+        Parameters
+        ----------
+        event_id - str
+            WebhookイベントのwebhookEventId
+
+        Returns
+        -------
+        bool
+            新たに記録した場合True、有効期限内に記録済みだった場合False
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def discard(self, event_id: str) -> None:
+        """
+        記録したイベントIDを削除する
+
+        イベントを受け付けられなかった場合に、再送されたイベントを処理できるようにするために使用する
+
+        Parameters
+        ----------
+        event_id - str
+            WebhookイベントのwebhookEventId
+        """
+        raise NotImplementedError()
@@ -0,0 +1,215 @@
+import copy
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from api.repository.async_conversation_repository import (
+    RESULT_FIELDS,
+    AsyncConversationRepository,
+    can_record_answer,
+    create_answer_update,
+    project_conversation_fields
+)
+from api.utils.helper import (
+    apply_field_updates,
+    resolve_server_timestamps
+)
+
+
+class MemoryConversationRepository(AsyncConversationRepository):
+    """
+    会話記録をプロセス内のメモリで管理するクラス
+
+    AsyncConversationRepository(interface)を継承しCRUDの基本的なDB操作について定義
+    Firestoreと同じく、updateのドット区切りのフィールドパスはネストしたフィールドを更新し、
+    SERVER_TIMESTAMPは保存時の時刻に置き換える
+    プロセスの再起動で記録は失われ、プロセス間でも共有されないため、単一プロセスでの運用やベンチマークで使用する
+    各操作は途中でイベントループに制御を戻さないため、読み込みと書き込みを組み合わせた操作もそのままアトミックになる
+    """
+
+    def __init__(self):
+        self._documents = {}
+
+    async def store(self, data: dict) -> None:
+        """
+        会話データを新規で保存
+
+        Parameters
+        ----------
+        data - dict
+            保存するデータの内容
+        """
+        self._documents[data['user_id']] = copy.deepcopy(resolve_server_timestamps(data))
+
+    async def update(self, user_id: str, data: dict) -> None:
+        """
+        会話データの更新
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        data - dict
+            更新したい内容
+
+        Raises
+        ------
+        KeyError
+            会話データが存在しない場合
+        """
+        if user_id not in self._documents:
+            raise KeyError(f'No conversation to update: {user_id}')
+        apply_field_updates(self._documents[user_id], copy.deepcopy(resolve_server_timestamps(data)))
+
+    async def delete(self, user_id: str) -> None:
+        """
+        会話データを削除
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        """
+        self._documents.pop(user_id, None)
+
+    async def get_conversation_info_by_user_id(self, user_id: str) -> Optional[dict]:
+        """
+        特定ユーザーの会話記録を取得
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+
+        Returns
+        -------
+        Optional[dict]
+            会話記録。存在しない場合はNone
+        """
+        data = self._documents.get(user_id)
+        if data is None:
+            return None
+        return copy.deepcopy(project_conversation_fields(data))
+
+    async def get_result_candidates(self, user_id: str) -> Optional[dict]:
+        """
+        特定ユーザーの検索結果の続きを取得
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+
+        Returns
+        -------
+        Optional[dict]
+            表示していない検索結果の候補などを含む会話記録。存在しない場合はNone
+        """
+        data = self._documents.get(user_id)
+        if data is None:
+            return None
+        return copy.deepcopy(project_conversation_fields(data, RESULT_FIELDS))
+
+    async def record_answer(self, user_id: str, expected_status: int, property: str, value: str, next_status: Optional[int]) -> bool:
+        """
+        回答を記録し次の質問へ進める
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        expected_status - int
+            回答する質問のステータスナンバー
+        property - str
+            回答を保存するanswerのキー
+        value - str
+            回答内容
+        next_status - Optional[int]
+            次の質問のステータスナンバー。最後の質問の場合はNone
+
+        Returns
+        -------
+        bool
+            更新した場合True。会話記録がない・既に別の質問に進んでいた・既に回答済みの場合False
+        """
+        data = self._documents.get(user_id)
+        if not can_record_answer(data, expected_status, property):
+            return False
+        apply_field_updates(data, resolve_server_timestamps(create_answer_update(property, value, next_status)))
+        return True
+
+    async def fetch_answers_and_delete(self, user_id: str, is_complete: Callable[[dict], bool]) -> Optional[dict]:
+        """
+        会話記録を取得し、回答が揃っていれば削除する
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        is_complete - Callable[[dict], bool]
+            取得した会話記録を受け取り、削除する場合にTrueを返す関数
+
+        Returns
+        -------
+        Optional[dict]
+            削除したかどうかに関わらず取得した会話記録。存在しない場合はNone
+        """
+        data = self._documents.get(user_id)
+        if data is None:
+            return None
+        data = copy.deepcopy(project_conversation_fields(data))
+        if is_complete(data):
+            del self._documents[user_id]
+        return data
+
+    async def find_idle(self, updated_before: datetime, limit: int) -> List[str]:
+        """
+        最後の更新から一定時間が経過した会話記録のユーザーIDを取得する
+
+        Parameters
+        ----------
+        updated_before - datetime
+            この時刻より前に最後に更新された会話記録を対象とする
+        limit - int
+            取得する最大件数
+
+        Returns
+        -------
+        List[str]
+            LINEユーザーのユニークIDのリスト
+        """
+        user_ids = []
+        for user_id, data in self._documents.items():
+            if len(user_ids) >= limit:
+                break
+            if self._is_idle(data, updated_before):
+                user_ids.append(user_id)
+        return user_ids
+
+    async def delete_idle(self, user_ids: List[str], updated_before: datetime) -> int:
+        """
+        指定したユーザーの会話記録のうち、現在もupdated_before以降に更新されていないものをまとめて削除する
+
+        Parameters
+        ----------
+        user_ids - List[str]
+            LINEユーザーのユニークIDのリスト
+        updated_before - datetime
+            この時刻より前に最後に更新された会話記録を削除する
+
+        Returns
+        -------
+        int
+            削除した件数
+        """
+        deleted = 0
+        for user_id in user_ids:
+            data = self._documents.get(user_id)
+            if data is not None and self._is_idle(data, updated_before):
+                del self._documents[user_id]
+                deleted += 1
+        return deleted
+
+    @staticmethod
+    def _is_idle(data: dict, updated_before: datetime) -> bool:
+        updated_at = data.get('updated_at')
+        return isinstance(updated_at, datetime) and updated_at < updated_before
@@ -0,0 +1,73 @@
+import time
+from collections import OrderedDict
+
+from api.repository.event_id_repository import EventIdRepository
+
+
+class MemoryEventIdRepository(EventIdRepository):
+    """
+    処理済みのWebhookイベントIDをプロセス内のメモリで記録するクラス
+
+    記録はTTLで失効し、件数の上限を超えた場合は古いものから破棄する
+    プロセス間では共有されないため、複数プロセスで動かす場合はSqliteEventIdRepositoryを使用する
+
+    Parameters
+    ----------
+    ttl : float
+        イベントIDを記録しておく秒数
+    maxsize : int
+        記録するイベントIDの最大件数
+    """
+
+    def __init__(self, ttl: float = 3600.0, maxsize: int = 100000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._expires_at = OrderedDict()
+
+    async def add_if_absent(self, event_id: str) -> bool:
+        """
+        イベントIDが未記録であれば記録する
+
+        Parameters
+        ----------
+        event_id - str
+            WebhookイベントのwebhookEventId
+
+        Returns
+        -------
+        bool
+            新たに記録した場合True、有効期限内に記録済みだった場合False
+        """
+        now = time.monotonic()
+        self._purge_expired(now)
+
+        if event_id in self._expires_at:
+            return False
+
+        self._expires_at[event_id] = now + self.ttl
+        while len(self._expires_at) > self.maxsize:
+            self._expires_at.popitem(last=False)
+        return True
+
+    async def discard(self, event_id: str) -> None:
+        """
+        記録したイベントIDを削除する
+
+        Parameters
+        ----------
+        event_id - str
+            WebhookイベントのwebhookEventId
+        """
+        self._expires_at.pop(event_id, None)
+
+    def _purge_expired(self, now: float) -> None:
+        """
+        有効期限の切れた記録を古いものから削除する
+
+        記録は追加順に並んでおり有効期限も追加順になるため、先頭から期限切れでないものまで削除すればよい
+        """
+        while self._expires_at:
+            event_id, expires_at = next(iter(self._expires_at.items()))
+            if expires_at > now:
+                break
+            del self._expires_at[event_id]
@@ -0,0 +1,315 @@
+import asyncio
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from api.repository.async_conversation_repository import (
+    CONVERSATION_FIELDS,
+    RESULT_FIELDS,
+    AsyncConversationRepository,
+    can_record_answer,
+    create_answer_update,
+    project_conversation_fields
+)
+from api.utils.helper import (
+    apply_field_updates,
+    resolve_server_timestamps
+)
+
+# JSONに保存したdatetimeを読み込み時に復元するための目印
+_DATETIME_KEY = '__datetime__'
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {_DATETIME_KEY: value.isoformat()}
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _decode(value: dict):
+    if len(value) == 1 and _DATETIME_KEY in value:
+        return datetime.fromisoformat(value[_DATETIME_KEY])
+    return value
+
+
+def _get_updated_at(document: dict) -> Optional[float]:
+    updated_at = document.get('updated_at')
+    return updated_at.timestamp() if isinstance(updated_at, datetime) else None
+
+
+class SqliteConversationRepository(AsyncConversationRepository):
+    """
+    会話記録をSQLiteのファイルで管理するクラス
+
+    AsyncConversationRepository(interface)を継承しCRUDの基本的なDB操作について定義
+    会話記録はuser_idを主キーとする行にJSONで保存する
+    放置された会話記録を検索できるよう、updated_atはインデックス付きの列にも保存する
+    Firestoreと同じく、updateのドット区切りのフィールドパスはネストしたフィールドを更新し、
+    SERVER_TIMESTAMPは保存時の時刻に置き換える
+    SQLiteへのアクセスはイベントループをブロックしないよう別スレッドで行う
+
+    Parameters
+    ----------
+    path : str
+        SQLiteのデータベースファイルのパス
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # 接続は別スレッドから使い回すため、ロックで排他する
+        # 同じSQL文はsqlite3モジュールの文キャッシュでコンパイル済みのものが再利用される
+        self._conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS conversations ('
+            ' user_id TEXT PRIMARY KEY,'
+            ' data TEXT NOT NULL,'
+            ' updated_at REAL'
+            ')'
+        )
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(conversations)')]
+        if 'updated_at' not in columns:
+            self._conn.execute('ALTER TABLE conversations ADD COLUMN updated_at REAL')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS conversations_updated_at ON conversations (updated_at)')
+        self._lock = threading.Lock()
+
+    async def store(self, data: dict) -> None:
+        """
+        会話データを新規で保存
+
+        Parameters
+        ----------
+        data - dict
+            保存するデータの内容
+        """
+        await asyncio.to_thread(self._store, resolve_server_timestamps(data))
+
+    async def update(self, user_id: str, data: dict) -> None:
+        """
+        会話データの更新
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        data - dict
+            更新したい内容
+
+        Raises
+        ------
+        KeyError
+            会話データが存在しない場合
+        """
+        await asyncio.to_thread(self._update, user_id, resolve_server_timestamps(data))
+
+    async def delete(self, user_id: str) -> None:
+        """
+        会話データを削除
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        """
+        await asyncio.to_thread(self._delete, user_id)
+
+    async def get_conversation_info_by_user_id(self, user_id: str) -> Optional[dict]:
+        """
+        特定ユーザーの会話記録を取得
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+
+        Returns
+        -------
+        Optional[dict]
+            会話記録。存在しない場合はNone
+        """
+        return await asyncio.to_thread(self._get, user_id)
+
+    async def get_result_candidates(self, user_id: str) -> Optional[dict]:
+        """
+        特定ユーザーの検索結果の続きを取得
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+
+        Returns
+        -------
+        Optional[dict]
+            表示していない検索結果の候補などを含む会話記録。存在しない場合はNone
+        """
+        return await asyncio.to_thread(self._get, user_id, RESULT_FIELDS)
+
+    async def record_answer(self, user_id: str, expected_status: int, property: str, value: str, next_status: Optional[int]) -> bool:
+        """
+        回答を記録し次の質問へ進める
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        expected_status - int
+            回答する質問のステータスナンバー
+        property - str
+            回答を保存するanswerのキー
+        value - str
+            回答内容
+        next_status - Optional[int]
+            次の質問のステータスナンバー。最後の質問の場合はNone
+
+        Returns
+        -------
+        bool
+            更新した場合True。会話記録がない・既に別の質問に進んでいた・既に回答済みの場合False
+        """
+        update = resolve_server_timestamps(create_answer_update(property, value, next_status))
+        return await asyncio.to_thread(self._record_answer, user_id, expected_status, property, update)
+
+    async def fetch_answers_and_delete(self, user_id: str, is_complete: Callable[[dict], bool]) -> Optional[dict]:
+        """
+        会話記録を取得し、回答が揃っていれば削除する
+
+        Parameters
+        ----------
+        user_id - str
+            LINEユーザーのユニークID
+        is_complete - Callable[[dict], bool]
+            取得した会話記録を受け取り、削除する場合にTrueを返す関数
+
+        Returns
+        -------
+        Optional[dict]
+            削除したかどうかに関わらず取得した会話記録。存在しない場合はNone
+        """
+        return await asyncio.to_thread(self._fetch_answers_and_delete, user_id, is_complete)
+
+    async def find_idle(self, updated_before: datetime, limit: int) -> List[str]:
+        """
+        最後の更新から一定時間が経過した会話記録のユーザーIDを取得する
+
+        Parameters
+        ----------
+        updated_before - datetime
+            この時刻より前に最後に更新された会話記録を対象とする
+        limit - int
+            取得する最大件数
+
+        Returns
+        -------
+        List[str]
+            LINEユーザーのユニークIDのリスト
+        """
+        return await asyncio.to_thread(self._find_idle, updated_before.timestamp(), limit)
+
+    async def delete_idle(self, user_ids: List[str], updated_before: datetime) -> int:
+        """
+        指定したユーザーの会話記録のうち、現在もupdated_before以降に更新されていないものをまとめて削除する
+
+        Parameters
+        ----------
+        user_ids - List[str]
+            LINEユーザーのユニークIDのリスト
+        updated_before - datetime
+            この時刻より前に最後に更新された会話記録を削除する
+
+        Returns
+        -------
+        int
+            削除した件数
+        """
+        return await asyncio.to_thread(self._delete_idle, user_ids, updated_before.timestamp())
+
+    def _store(self, data: dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO conversations (user_id, data, updated_at) VALUES (?, ?, ?)',
+                (data['user_id'], json.dumps(data, ensure_ascii=False, default=_encode), _get_updated_at(data)),
+            )
+
+    def _update(self, user_id: str, data: dict) -> None:
+        with self._lock, self._transaction():
+            document = self._select(user_id)
+            if document is None:
+                raise KeyError(f'No conversation to update: {user_id}')
+            self._write(user_id, apply_field_updates(document, data))
+
+    def _record_answer(self, user_id: str, expected_status: int, property: str, data: dict) -> bool:
+        with self._lock, self._transaction():
+            document = self._select(user_id)
+            if not can_record_answer(document, expected_status, property):
+                return False
+            self._write(user_id, apply_field_updates(document, data))
+            return True
+
+    def _fetch_answers_and_delete(self, user_id: str, is_complete: Callable[[dict], bool]) -> Optional[dict]:
+        with self._lock, self._transaction():
+            document = self._select(user_id)
+            if document is None:
+                return None
+            data = project_conversation_fields(document)
+            if is_complete(data):
+                self._conn.execute('DELETE FROM conversations WHERE user_id = ?', (user_id,))
+            return data
+
+    @contextmanager
+    def _transaction(self):
+        """
+        読み込みから書き込みまでを1つのトランザクションで行い、他プロセスの更新と競合しないようにする
+        """
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._conn.execute('COMMIT')
+
+    def _select(self, user_id: str) -> Optional[dict]:
+        row = self._conn.execute('SELECT data FROM conversations WHERE user_id = ?', (user_id,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0], object_hook=_decode)
+
+    def _write(self, user_id: str, document: dict) -> None:
+        self._conn.execute(
+            'UPDATE conversations SET data = ?, updated_at = ? WHERE user_id = ?',
+            (json.dumps(document, ensure_ascii=False, default=_encode), _get_updated_at(document), user_id),
+        )
+
+    def _find_idle(self, updated_before: float, limit: int) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT user_id FROM conversations WHERE updated_at < ? LIMIT ?',
+                (updated_before, limit),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def _delete_idle(self, user_ids: List[str], updated_before: float) -> int:
+        with self._lock, self._transaction():
+            return sum(
+                self._conn.execute(
+                    'DELETE FROM conversations WHERE user_id = ? AND updated_at < ?',
+                    (user_id, updated_before),
+                ).rowcount
+                for user_id in user_ids
+            )
+
+    def _delete(self, user_id: str) -> None:
+        with self._lock:
+            self._conn.execute('DELETE FROM conversations WHERE user_id = ?', (user_id,))
+
+    def _get(self, user_id: str, fields: Tuple[str, ...] = CONVERSATION_FIELDS) -> Optional[dict]:
+        with self._lock:
+            document = self._select(user_id)
+        if document is None:
+            return None
+        return project_conversation_fields(document, fields)
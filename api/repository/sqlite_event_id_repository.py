@@ -0,0 +1,91 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+from api.repository.event_id_repository import EventIdRepository
+
+
+class SqliteEventIdRepository(EventIdRepository):
+    """
+    処理済みのWebhookイベントIDをSQLiteのファイルに記録するクラス
+
+    同じホスト上の複数のワーカープロセスで同じファイルを指定することで、記録を共有できる
+    記録はTTLで失効し、一定回数の記録ごとに期限切れの行を削除する
+    SQLiteへのアクセスはイベントループをブロックしないよう別スレッドで行う
+
+    Parameters
+    ----------
+    path : str
+        SQLiteのデータベースファイルのパス
+    ttl : float
+        イベントIDを記録しておく秒数
+    purge_interval : int
+        期限切れの行を削除する間隔(記録回数)
+    """
+
+    def __init__(self, path: str, ttl: float = 3600.0, purge_interval: int = 1000):
+        self.path = path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._add_count = 0
+        # 接続は別スレッドから使い回すため、ロックで排他する
+        self._conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS webhook_events ('
+            ' event_id TEXT PRIMARY KEY,'
+            ' expires_at REAL NOT NULL'
+            ')'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS webhook_events_expires_at ON webhook_events (expires_at)')
+        self._lock = threading.Lock()
+
+    async def add_if_absent(self, event_id: str) -> bool:
+        """
+        イベントIDが未記録であれば記録する
+
+        Parameters
+        ----------
+        event_id - str
+            WebhookイベントのwebhookEventId
+
+        Returns
+        -------
+        bool
+            新たに記録した場合True、有効期限内に記録済みだった場合False
+        """
+        return await asyncio.to_thread(self._add_if_absent, event_id)
+
+    async def discard(self, event_id: str) -> None:
+        """
+        記録したイベントIDを削除する
+
+        Parameters
+        ----------
+        event_id - str
+            WebhookイベントのwebhookEventId
+        """
+        await asyncio.to_thread(self._discard, event_id)
+
+    def _add_if_absent(self, event_id: str) -> bool:
+        now = time.time()
+        with self._lock:
+            # 期限切れの行は上書きし、期限内の行があれば何もしない
+            cursor = self._conn.execute(
+                'INSERT INTO webhook_events (event_id, expires_at) VALUES (?, ?)'
+                ' ON CONFLICT (event_id) DO UPDATE SET expires_at = excluded.expires_at'
+                ' WHERE webhook_events.expires_at <= ?',
+                (event_id, now + self.ttl, now),
+            )
+            added = cursor.rowcount == 1
+
+            self._add_count += 1
+            if self._add_count % self.purge_interval == 0:
+                self._conn.execute('DELETE FROM webhook_events WHERE expires_at <= ?', (now,))
+        return added
+
+    def _discard(self, event_id: str) -> None:
+        with self._lock:
+            self._conn.execute('DELETE FROM webhook_events WHERE event_id = ?', (event_id,))
@@ -0,0 +1,48 @@
+from fastapi import (
+    APIRouter,
+    Header,
+    Response
+)
+from starlette.exceptions import HTTPException
+
+from api.utils.helper import (
+    accepts_gzip,
+    matches_etag
+)
+from api.utils.static_assets import STATIC_ASSETS
+
+
+router = APIRouter()
+
+# ハッシュ付きのURLは内容が変わらないため、クライアントやCDNに永続的にキャッシュさせる
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# ハッシュなしのURLは内容が変わる可能性があるため、ETagで更新を確認させる
+REVALIDATE_CACHE_CONTROL = 'public, max-age=3600, must-revalidate'
+
+
+@router.get(
+    '/images/{filename}',
+    summary='静的な画像',
+    description='評価の星アイコンなどの静的な画像を返却します。ハッシュ付きのファイル名の画像は永続的にキャッシュできます。',
+)
+async def get_image(filename: str, if_none_match=Header(None), accept_encoding=Header(None)):
+    asset = STATIC_ASSETS.get(filename)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not found")
+
+    # gzipの版と元の版は内容が異なるため、強いETagも別の値にする
+    is_gzip = asset.gzip_content is not None and accepts_gzip(accept_encoding)
+    etag = asset.etag[:-1] + '-gz"' if is_gzip else asset.etag
+    headers = {
+        'ETag': etag,
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if STATIC_ASSETS.is_hashed(filename) else REVALIDATE_CACHE_CONTROL,
+    }
+    if asset.gzip_content is not None:
+        headers['Vary'] = 'Accept-Encoding'
+    if if_none_match is not None and matches_etag(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    if is_gzip:
+        headers['Content-Encoding'] = 'gzip'
+        return Response(content=asset.gzip_content, media_type=asset.media_type, headers=headers)
+    return Response(content=asset.content, media_type=asset.media_type, headers=headers)
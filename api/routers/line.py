@@ -1,5 +1,7 @@
+import asyncio
 import os
 import sys
+import time
 from dotenv import load_dotenv
 
 from fastapi import (
@@ -9,25 +11,56 @@ from fastapi import (
 )
 
 from starlette.exceptions import HTTPException
-from linebot.v3 import WebhookHandler
 from linebot.v3.exceptions import InvalidSignatureError
 from linebot.v3.messaging import (
     AsyncApiClient,
-    AsyncMessagingApi,
     Configuration,
-    ReplyMessageRequest,
-    TextMessage,
 )
 from linebot.v3.webhooks import (
     LocationMessageContent,
     MessageEvent,
+    PostbackEvent,
     TextMessageContent
 )
 
-from api.const import ERROR_TEXT
-from api.repository.firebase_conversation_repository import FirebaseConversationRepository
+from api.const import (
+    ERROR_TEXT,
+    INFORM_TEXT
+)
+from api.repository.async_firebase_conversation_repository import AsyncFirebaseConversationRepository
+from api.repository.cached_conversation_repository import CachedConversationRepository
+from api.repository.memory_conversation_repository import MemoryConversationRepository
+from api.repository.memory_event_id_repository import MemoryEventIdRepository
+from api.repository.sqlite_conversation_repository import SqliteConversationRepository
+from api.repository.sqlite_event_id_repository import SqliteEventIdRepository
 from api.services.conversation_manager_service import ConversationManagerService
+from api.services.conversation_sweeper_service import ConversationSweeperService
+from api.services.event_deduplication_service import EventDeduplicationService
+from api.services.event_worker_service import EventWorkerService
+from api.services.user_event_dispatcher_service import (
+    EVENT_RECEIVED_AT,
+    UserEventDispatcherService
+)
+from api.utils.async_webhook_handler import AsyncWebhookHandler
+from api.utils.cached_places_client import CachedPlacesClient
+from api.utils.circuit_breaker import CircuitBreaker
+from api.utils.circuit_breaker_places_client import CircuitBreakerPlacesClient
+from api.utils.coalescing_places_client import CoalescingPlacesClient
+from api.utils.conversation_state_codec import ConversationStateCodec
+from api.utils.conversation_state_machine import CONVERSATION_STATE_MACHINE
+from api.utils.indexed_places_client import IndexedPlacesClient
+from api.utils.line_reply_client import LineReplyClient
 from api.utils.logger import Logger
+from api.utils.metrics import (
+    DEFERRED_REPLIES,
+    EVENTS,
+    REGISTRY,
+    StageTimer
+)
+from api.utils.places_client import PlacesClient
+from api.utils.places_index import PlacesIndex
+from api.utils.reply_templates import REPLY_TEMPLATES
+from api.utils.result_ranker import ResultRanker
 
 
 load_dotenv()
@@ -46,10 +79,122 @@ if channel_access_token is None:
     sys.exit(1)
 
 
-handler = WebhookHandler(channel_secret)
+# trueの場合、コールバックは署名検証とキューへの登録のみ行い、イベントはバックグラウンドのワーカーで処理する
+webhook_async_mode = os.environ.get('WEBHOOK_ASYNC_MODE', 'false').lower() == 'true'
+webhook_worker_count = int(os.environ.get('WEBHOOK_WORKER_COUNT', 4))
+webhook_queue_maxsize = int(os.environ.get('WEBHOOK_QUEUE_MAXSIZE', 1000))
+webhook_drain_timeout = float(os.environ.get('WEBHOOK_DRAIN_TIMEOUT', 10))
+# 全ユーザー合計で同時に処理するイベント数の上限(同じユーザーのイベントは常に1件ずつ順番に処理する)
+event_dispatch_max_concurrency = int(os.environ.get('EVENT_DISPATCH_MAX_CONCURRENCY', 16))
+
+# 再送イベントの重複排除に使う記録先(memory / sqlite / none)。複数プロセスで共有する場合はsqliteを指定する
+event_dedup_backend = os.environ.get('EVENT_DEDUP_BACKEND', 'memory').lower()
+event_dedup_ttl = float(os.environ.get('EVENT_DEDUP_TTL', 3600))
+event_dedup_maxsize = int(os.environ.get('EVENT_DEDUP_MAXSIZE', 100000))
+event_dedup_sqlite_path = os.environ.get('EVENT_DEDUP_SQLITE_PATH', 'api/webhook_events.sqlite3')
+
+# 会話記録の保存先(firestore / sqlite / memory)。memoryはプロセスの再起動で記録が失われる
+conversation_repository_backend = os.environ.get('CONVERSATION_REPOSITORY_BACKEND', 'firestore').lower()
+conversation_sqlite_path = os.environ.get('CONVERSATION_SQLITE_PATH', 'api/conversations.sqlite3')
+
+# trueの場合、最後の更新からCONVERSATION_IDLE_TTL秒以上経過した会話記録を定期的に削除する
+conversation_sweeper_enabled = os.environ.get('CONVERSATION_SWEEPER_ENABLED', 'false').lower() == 'true'
+conversation_idle_ttl = float(os.environ.get('CONVERSATION_IDLE_TTL', 86400))
+conversation_sweeper_interval = float(os.environ.get('CONVERSATION_SWEEPER_INTERVAL', 600))
+# Firestoreの1回のコミットで書き込める上限が500件のため、それ以下にする
+conversation_sweeper_batch_size = int(os.environ.get('CONVERSATION_SWEEPER_BATCH_SIZE', 200))
+conversation_sweeper_max_concurrency = int(os.environ.get('CONVERSATION_SWEEPER_MAX_CONCURRENCY', 2))
+conversation_sweeper_max_deletes_per_second = float(os.environ.get('CONVERSATION_SWEEPER_MAX_DELETES_PER_SECOND', 100))
+
+# trueの場合、会話の状態を署名付きのポストバックで受け渡し、最後の質問に回答するまでDBを読み書きしない
+conversation_stateless_mode = os.environ.get('CONVERSATION_STATELESS_MODE', 'false').lower() == 'true'
+conversation_state_secret = os.environ.get('CONVERSATION_STATE_SECRET') or channel_secret
+conversation_state_ttl = float(os.environ.get('CONVERSATION_STATE_TTL', 86400))
+
+# trueの場合、会話記録をプロセス内にキャッシュしDBの読み込みを減らす
+conversation_cache_enabled = os.environ.get('CONVERSATION_CACHE_ENABLED', 'false').lower() == 'true'
+conversation_cache_maxsize = int(os.environ.get('CONVERSATION_CACHE_MAXSIZE', 10000))
+conversation_cache_ttl = float(os.environ.get('CONVERSATION_CACHE_TTL', 300))
+
+# trueの場合、Places APIの検索結果をgeohashのセル単位でキャッシュする
+places_cache_enabled = os.environ.get('PLACES_CACHE_ENABLED', 'false').lower() == 'true'
+places_cache_geohash_precision = int(os.environ.get('PLACES_CACHE_GEOHASH_PRECISION', 7))
+places_cache_ttl = float(os.environ.get('PLACES_CACHE_TTL', 600))
+places_cache_max_bytes = int(os.environ.get('PLACES_CACHE_MAX_BYTES', 50 * 1024 * 1024))
+
+# trueの場合、Places APIの検索結果をファイルの空間インデックスに記録し、最近検索した範囲に含まれる検索はAPIを使わずに答える
+places_index_enabled = os.environ.get('PLACES_INDEX_ENABLED', 'false').lower() == 'true'
+places_index_path = os.environ.get('PLACES_INDEX_PATH', 'api/places_index.bin')
+# 営業中かどうかは記録時点のものなので、長くしすぎない
+places_index_ttl = float(os.environ.get('PLACES_INDEX_TTL', 1800))
+places_index_max_bytes = int(os.environ.get('PLACES_INDEX_MAX_BYTES', 64 * 1024 * 1024))
+places_index_min_results = int(os.environ.get('PLACES_INDEX_MIN_RESULTS', 3))
+
+# trueの場合、Places APIのエラーや遅延が続いたらリクエストを止め、近くで保持した検索結果かお詫びを返す
+places_circuit_breaker_enabled = os.environ.get('PLACES_CIRCUIT_BREAKER_ENABLED', 'false').lower() == 'true'
+places_circuit_failure_rate = float(os.environ.get('PLACES_CIRCUIT_FAILURE_RATE', 0.5))
+places_circuit_slow_call_rate = float(os.environ.get('PLACES_CIRCUIT_SLOW_CALL_RATE', 0.5))
+places_circuit_slow_call_duration = float(os.environ.get('PLACES_CIRCUIT_SLOW_CALL_DURATION', 3))
+places_circuit_window_size = int(os.environ.get('PLACES_CIRCUIT_WINDOW_SIZE', 20))
+places_circuit_min_calls = int(os.environ.get('PLACES_CIRCUIT_MIN_CALLS', 10))
+places_circuit_open_duration = float(os.environ.get('PLACES_CIRCUIT_OPEN_DURATION', 30))
+places_circuit_half_open_probes = int(os.environ.get('PLACES_CIRCUIT_HALF_OPEN_PROBES', 3))
+places_fallback_geohash_precision = int(os.environ.get('PLACES_FALLBACK_GEOHASH_PRECISION', 6))
+places_fallback_ttl = float(os.environ.get('PLACES_FALLBACK_TTL', 3600))
+places_fallback_max_distance = float(os.environ.get('PLACES_FALLBACK_MAX_DISTANCE', 1000))
+places_fallback_max_entries = int(os.environ.get('PLACES_FALLBACK_MAX_ENTRIES', 1000))
+
+# trueの場合、同時に届いた同じ検索(type・検索条件・geohashのセルが同じ)を1回のPlaces APIへのリクエストにまとめる
+# まとめた検索には最初の検索の位置の結果を返すため、セルの大きさ(PLACES_COALESCE_GEOHASH_PRECISION)の誤差を許容できる場合に有効にする
+places_coalesce_enabled = os.environ.get('PLACES_COALESCE_ENABLED', 'false').lower() == 'true'
+places_coalesce_geohash_precision = int(os.environ.get('PLACES_COALESCE_GEOHASH_PRECISION', 7))
+
+# trueの場合、位置情報への検索結果がイベントの受信(WEBHOOK_ASYNC_MODEではキューへの登録)からREPLY_DEADLINE秒以内に用意できなければ「検索中…」を返信し、結果はプッシュメッセージで送る
+# プッシュメッセージは送信数の上限に数えられるため、返信トークンの期限切れが問題になる場合に有効にする
+reply_deadline_enabled = os.environ.get('REPLY_DEADLINE_ENABLED', 'false').lower() == 'true'
+reply_deadline = float(os.environ.get('REPLY_DEADLINE', 3))
+
+
+handler = AsyncWebhookHandler(channel_secret)
 configuration = Configuration(access_token=channel_access_token)
 async_api_client = AsyncApiClient(configuration)
-line_bot_api = AsyncMessagingApi(async_api_client)
+line_reply_client = LineReplyClient(async_api_client)
+
+event_deduplicator = None
+if event_dedup_backend == 'sqlite':
+    event_deduplicator = EventDeduplicationService(SqliteEventIdRepository(event_dedup_sqlite_path, ttl=event_dedup_ttl))
+elif event_dedup_backend == 'memory':
+    event_deduplicator = EventDeduplicationService(MemoryEventIdRepository(ttl=event_dedup_ttl, maxsize=event_dedup_maxsize))
+event_dispatcher = UserEventDispatcherService(
+    handler.dispatch,
+    max_concurrency=event_dispatch_max_concurrency,
+)
+event_worker = EventWorkerService(
+    event_dispatcher.submit,
+    worker_count=webhook_worker_count,
+    queue_maxsize=webhook_queue_maxsize,
+    drain_timeout=webhook_drain_timeout,
+)
+
+
+@router.on_event('startup')
+async def start_event_worker():
+    if webhook_async_mode:
+        await event_worker.start()
+    if conversation_sweeper_enabled:
+        await conversation_sweeper.start()
+
+
+@router.on_event('shutdown')
+async def stop_event_worker():
+    if conversation_sweeper_enabled:
+        await conversation_sweeper.stop()
+    if webhook_async_mode:
+        await event_worker.stop()
+        # 期限内に処理しきれなかったイベントを中断する
+        await event_dispatcher.close()
+    await places_client.close()
+    await async_api_client.close()
 
 
 @router.post(
@@ -59,21 +204,120 @@ line_bot_api = AsyncMessagingApi(async_api_client)
 )
 async def callback(request: Request, x_line_signature=Header(None)):
     body = await request.body()
+    events = []
     try:
-        handler.handle(body.decode("utf-8"), x_line_signature)
+        with StageTimer('verify_signature', event_kind='webhook'):
+            payload = handler.parse(body.decode("utf-8"), x_line_signature)
+        events = payload.events
+        if event_deduplicator is not None:
+            events = await event_deduplicator.filter(events)
+
+        if webhook_async_mode:
+            event_worker.enqueue(events, payload.destination)
+        else:
+            await event_dispatcher.dispatch_all(events, payload.destination)
 
     except InvalidSignatureError:
         log.error('webhookエラー発生')
         raise HTTPException(status_code=400, detail="InvalidSignatureError")
+
+    except asyncio.QueueFull:
+        log.error('イベントキューに空きがないためwebhookを受け付けられませんでした')
+        # 再送されたイベントを処理できるよう、受け付けられなかったイベントの記録を削除する
+        if event_deduplicator is not None:
+            await event_deduplicator.forget(events)
+        raise HTTPException(status_code=503, detail="Service unavailable")
     
     except Exception as e:
         log.error(f'webhookエラー発生: {str(e)}')
+        # エラーを返すとLINEがWebhookを再送するため、再送されたイベントを処理できるよう記録を削除する
+        if event_deduplicator is not None and events:
+            await event_deduplicator.forget(events)
         raise HTTPException(status_code=500, detail="Internal server error")
 
     return "OK"
 
 
-conversation_repository = FirebaseConversationRepository()
+if conversation_repository_backend == 'sqlite':
+    conversation_repository = SqliteConversationRepository(conversation_sqlite_path)
+elif conversation_repository_backend == 'memory':
+    conversation_repository = MemoryConversationRepository()
+else:
+    conversation_repository = AsyncFirebaseConversationRepository()
+if conversation_cache_enabled:
+    conversation_repository = CachedConversationRepository(
+        conversation_repository,
+        maxsize=conversation_cache_maxsize,
+        ttl=conversation_cache_ttl,
+    )
+conversation_sweeper = ConversationSweeperService(
+    conversation_repository,
+    ttl=conversation_idle_ttl,
+    interval=conversation_sweeper_interval,
+    batch_size=conversation_sweeper_batch_size,
+    max_concurrency=conversation_sweeper_max_concurrency,
+    max_deletes_per_second=conversation_sweeper_max_deletes_per_second,
+)
+state_codec = None
+if conversation_stateless_mode:
+    state_codec = ConversationStateCodec(conversation_state_secret, CONVERSATION_STATE_MACHINE, ttl=conversation_state_ttl)
+places_client = places_api_client = PlacesClient.from_env()
+if places_circuit_breaker_enabled:
+    # キャッシュやインデックスから答えた検索を判定に含めないよう、Places APIへのリクエストだけを保護する
+    places_client = places_breaker_client = CircuitBreakerPlacesClient(
+        places_client,
+        CircuitBreaker(
+            failure_rate=places_circuit_failure_rate,
+            slow_call_rate=places_circuit_slow_call_rate,
+            slow_call_duration=places_circuit_slow_call_duration,
+            window_size=places_circuit_window_size,
+            min_calls=places_circuit_min_calls,
+            open_duration=places_circuit_open_duration,
+            half_open_probes=places_circuit_half_open_probes,
+        ),
+        precision=places_fallback_geohash_precision,
+        ttl=places_fallback_ttl,
+        max_distance=places_fallback_max_distance,
+        max_entries=places_fallback_max_entries,
+    )
+if places_index_enabled:
+    places_client = places_index_client = IndexedPlacesClient(
+        places_client,
+        PlacesIndex(places_index_path, ttl=places_index_ttl, max_bytes=places_index_max_bytes),
+        min_results=places_index_min_results,
+    )
+if places_cache_enabled:
+    places_client = places_cache_client = CachedPlacesClient(
+        places_client,
+        precision=places_cache_geohash_precision,
+        ttl=places_cache_ttl,
+        max_bytes=places_cache_max_bytes,
+    )
+if places_coalesce_enabled:
+    places_client = places_coalescing_client = CoalescingPlacesClient(
+        places_client,
+        precision=places_coalesce_geohash_precision,
+    )
+result_ranker = ResultRanker.from_env()
+
+REGISTRY.register_collector('linebot_event_worker', 'Background event queue and workers', event_worker.get_metrics)
+REGISTRY.register_collector('linebot_event_dispatcher', 'Per-user ordered event dispatcher', event_dispatcher.get_metrics)
+if event_deduplicator is not None:
+    REGISTRY.register_collector('linebot_event_dedup', 'Webhook redelivery deduplication', event_deduplicator.get_metrics)
+if conversation_cache_enabled:
+    REGISTRY.register_collector('linebot_conversation_cache', 'Conversation state cache', conversation_repository.get_stats)
+if conversation_sweeper_enabled:
+    REGISTRY.register_collector('linebot_conversation_sweeper', 'Idle conversation sweeper', conversation_sweeper.get_metrics)
+if places_cache_enabled:
+    REGISTRY.register_collector('linebot_places_cache', 'Places search result cache', places_cache_client.get_stats)
+if places_index_enabled:
+    REGISTRY.register_collector('linebot_places_index', 'Local spatial index of Places results', places_index_client.get_stats)
+if places_circuit_breaker_enabled:
+    REGISTRY.register_collector('linebot_places_circuit', 'Places API circuit breaker and stale fallback', places_breaker_client.get_stats)
+if places_coalesce_enabled:
+    REGISTRY.register_collector('linebot_places_coalesce', 'Coalesced identical Places searches', places_coalescing_client.get_stats)
+if places_api_client.rate_limiter is not None:
+    REGISTRY.register_collector('linebot_places_rate_limit', 'Places API rate limit and daily quota', places_api_client.rate_limiter.get_stats)
 
 """
 Summary
@@ -85,24 +329,17 @@ Description
 検索会話の開始・回答・会話リセット時に発火するイベントに対する処理を行う。
 """
 @handler.add(MessageEvent, message=TextMessageContent)
-def handle_message(event: MessageEvent):
+async def handle_message(event: MessageEvent):
+    EVENTS.inc(event_kind='text')
     try:
-        conversation_manager = ConversationManagerService(event.source.user_id, event.reply_token, conversation_repository)
-        reply_content = conversation_manager.handle_recive_text(event.message.text)
-        line_bot_api.reply_message(reply_content)
+        conversation_manager = ConversationManagerService(event.source.user_id, event.reply_token, conversation_repository, places_client, state_codec, result_ranker)
+        reply_content = await conversation_manager.handle_recive_text(event.message.text)
+        with StageTimer('reply', conversation_manager.conversation_type, 'text'):
+            await line_reply_client.reply(reply_content)
 
     except Exception as e:
         log.error(str(e))
-        line_bot_api.reply_message(
-            ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[
-                    TextMessage(
-                        text=ERROR_TEXT['EXCEPTION_ERROR_MESSAGE'],
-                    )
-                ]
-            )
-        )
+        await line_reply_client.reply(REPLY_TEMPLATES.text(ERROR_TEXT['EXCEPTION_ERROR_MESSAGE']).render(event.reply_token))
 
 """
 Summary
@@ -112,48 +349,81 @@ Summary
 Description
 -----------
 結果返却前の位置情報メッセージイベントの処理を担当。
+REPLY_DEADLINE_ENABLEDの場合、期限内に結果が揃わなければ「検索中…」を返信し、結果は後からプッシュメッセージで送る。
 """
 @handler.add(MessageEvent, message=LocationMessageContent)
-def handle_location(event: MessageEvent):
+async def handle_location(event: MessageEvent):
+    EVENTS.inc(event_kind='location')
+    # キューでの待ち時間も含めて返信の期限を計算する。ディスパッチャーを経由しない場合は現在時刻から数える
+    received_at = EVENT_RECEIVED_AT.get() or time.monotonic()
+    # 返信トークンを「検索中…」に使い、結果をプッシュメッセージで送る場合True
+    is_deferred = False
     try:
-        conversation_manager = ConversationManagerService(event.source.user_id, event.reply_token, conversation_repository)
+        conversation_manager = ConversationManagerService(event.source.user_id, event.reply_token, conversation_repository, places_client, state_codec, result_ranker)
         latitude = str(event.message.latitude)
         longitude = str(event.message.longitude)
-        reply_result_content = conversation_manager.get_result(latitude, longitude)
-        line_bot_api.reply_message(reply_result_content)
+        result = asyncio.ensure_future(conversation_manager.get_result(latitude, longitude))
+        if reply_deadline_enabled:
+            # 期限を過ぎても検索は中断せず、返信トークンだけ先に使う
+            remaining = reply_deadline - (time.monotonic() - received_at)
+            if remaining > 0:
+                await asyncio.wait({result}, timeout=remaining)
+            if not result.done():
+                is_deferred = True
+                DEFERRED_REPLIES.inc(event_kind='location')
+                try:
+                    await line_reply_client.reply(REPLY_TEMPLATES.text(INFORM_TEXT['SEARCHING']).render(event.reply_token))
+                except Exception as e:
+                    # 返信トークンが使われたか分からないため、検索の完了を待って結果はプッシュメッセージで送る
+                    log.error(f'検索中の返信でエラー発生: {str(e)}')
+        reply_result_content = await result
+        with StageTimer('reply', conversation_manager.conversation_type, 'location'):
+            if is_deferred:
+                await line_reply_client.push(event.source.user_id, reply_result_content['messages'])
+            else:
+                await line_reply_client.reply(reply_result_content)
+
+    except Exception as e:
+        log.error(str(e))
+        error_content = REPLY_TEMPLATES.text(ERROR_TEXT['EXCEPTION_ERROR_MESSAGE']).render(event.reply_token)
+        if is_deferred:
+            await line_reply_client.push(event.source.user_id, error_content['messages'])
+        else:
+            await line_reply_client.reply(error_content)
+
+"""
+Summary
+-------
+ポストバックイベントの処理を記載
+
+Description
+-----------
+ステートレスモードで質問の選択肢が選ばれた際の処理を担当。
+"""
+@handler.add(PostbackEvent)
+async def handle_postback(event: PostbackEvent):
+    EVENTS.inc(event_kind='postback')
+    try:
+        conversation_manager = ConversationManagerService(event.source.user_id, event.reply_token, conversation_repository, places_client, state_codec, result_ranker)
+        reply_content = await conversation_manager.handle_postback(event.postback.data)
+        with StageTimer('reply', conversation_manager.conversation_type, 'postback'):
+            await line_reply_client.reply(reply_content)
 
     except Exception as e:
         log.error(str(e))
-        line_bot_api.reply_message(
-            ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[
-                    TextMessage(
-                        text=ERROR_TEXT['EXCEPTION_ERROR_MESSAGE'],
-                    )
-                ]
-            )
-        )
+        await line_reply_client.reply(REPLY_TEMPLATES.text(ERROR_TEXT['EXCEPTION_ERROR_MESSAGE']).render(event.reply_token))
 
 """
 Summary
 -------
-テキストメッセージと位置情報メッセージ以外を処理する
+テキストメッセージと位置情報メッセージ、ポストバック以外を処理する
 
 Description
 -----------
-今回のアプリケーションにはテキストメッセージと位置情報メッセージ以外を使用する処理は存在しない
+今回のアプリケーションにはテキストメッセージと位置情報メッセージ、ポストバック以外を使用する処理は存在しない
 そのためその他のイベントに対してはエラーメッセージを返却する。
 """
 @handler.default()
-def default(event):
-    line_bot_api.reply_message(
-        ReplyMessageRequest(
-            reply_token=event.reply_token,
-            messages=[
-                TextMessage(
-                    text=ERROR_TEXT['NOT_SUPPORTED_TYPE_MESSAGE'],
-                )
-            ]
-        )
-    )
+async def default(event):
+    EVENTS.inc(event_kind='other')
+    await line_reply_client.reply(REPLY_TEMPLATES.text(ERROR_TEXT['NOT_SUPPORTED_TYPE_MESSAGE']).render(event.reply_token))
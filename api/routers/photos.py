@@ -0,0 +1,93 @@
+import os
+import re
+from dotenv import load_dotenv
+
+from fastapi import (
+    APIRouter,
+    Header,
+    Query,
+    Response
+)
+from starlette.exceptions import HTTPException
+
+from api.routers.line import places_api_client
+from api.services.photo_proxy_service import PhotoProxyService
+from api.utils.helper import (
+    matches_etag,
+    places_photo_proxy_enabled,
+    verify_photo_signature
+)
+from api.utils.logger import Logger
+from api.utils.metrics import REGISTRY
+from api.utils.photo_cache import PhotoCache
+from api.utils.places_client import (
+    PlacesApiError,
+    PlacesPhotoNotFoundError,
+    PlacesRateLimitError
+)
+from api.utils.rate_limiter import TokenBucket
+
+
+load_dotenv()
+log = Logger().get()
+router = APIRouter()
+
+# Place Photoで縮小する画像の最大の幅(px)
+places_photo_max_width = int(os.environ.get('PLACES_PHOTO_MAX_WIDTH', 400))
+places_photo_cache_dir = os.environ.get('PLACES_PHOTO_CACHE_DIR', 'api/photo_cache')
+places_photo_cache_max_bytes = int(os.environ.get('PLACES_PHOTO_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+# 同じphoto_referenceの画像は変わらないため、LINEのクライアントやCDNに長期間キャッシュさせる
+places_photo_max_age = int(os.environ.get('PLACES_PHOTO_MAX_AGE', 30 * 24 * 60 * 60))
+# キャッシュにない画像をPlace Photoから取得する1秒あたりの数。超えた分は待たずに503を返却する
+places_photo_miss_rate = float(os.environ.get('PLACES_PHOTO_MISS_RATE', 5))
+places_photo_miss_burst = int(os.environ.get('PLACES_PHOTO_MISS_BURST', 20))
+
+# photo_referenceとして受け付ける形式。ファイルパスやURLとして解釈される文字は含まない
+PHOTO_REFERENCE_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,1024}$')
+
+# 同時リクエスト数やAPIキーのレート制限・1日の上限を検索と共有するため、line.pyのクライアントを使う
+# コネクションプールはline.pyの終了時に閉じる
+photo_proxy = PhotoProxyService(
+    places_api_client,
+    PhotoCache(places_photo_cache_dir, max_bytes=places_photo_cache_max_bytes),
+    max_width=places_photo_max_width,
+    rate_limiter=TokenBucket(rate=places_photo_miss_rate, burst=places_photo_miss_burst, max_wait=0) if places_photo_miss_rate > 0 else None,
+)
+
+REGISTRY.register_collector('linebot_places_photo', 'Places photo proxy and disk cache', photo_proxy.get_stats)
+
+
+@router.get(
+    '/photos/{photo_reference}',
+    summary='施設の画像',
+    description='Places APIのphoto_referenceに対応する画像を返却します。署名(sig)のないURLは受け付けません。一度取得した画像はサーバーにキャッシュされます。',
+)
+async def get_photo(photo_reference: str, sig: str = Query(None), if_none_match=Header(None)):
+    if not places_photo_proxy_enabled or not PHOTO_REFERENCE_PATTERN.match(photo_reference):
+        raise HTTPException(status_code=404, detail="Not found")
+    # Place Photoへのリクエストは料金が発生するため、検索結果として発行したURL以外は取得しない
+    if not verify_photo_signature(photo_reference, sig):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    try:
+        content, etag, content_type = await photo_proxy.get_photo(photo_reference)
+
+    except PlacesPhotoNotFoundError:
+        raise HTTPException(status_code=404, detail="Not found")
+
+    except PlacesRateLimitError as e:
+        log.error(f'画像の取得を制限しました: {str(e)}')
+        raise HTTPException(status_code=503, detail="Service unavailable")
+
+    except PlacesApiError as e:
+        log.error(f'画像の取得でエラー発生: {str(e)}')
+        raise HTTPException(status_code=502, detail="Bad gateway")
+
+    headers = {
+        'ETag': etag,
+        'Cache-Control': f'public, max-age={places_photo_max_age}, immutable',
+    }
+    if if_none_match is not None and matches_etag(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type=content_type, headers=headers)
+
@@ -1,32 +1,18 @@
-import os
-import random
-import requests
-from typing import List, Union
-from urllib.parse import urlencode
+from typing import List, Optional, Tuple, Union
 from dotenv import load_dotenv
 
 from firebase_admin import firestore
 
 from linebot.v3.messaging import (
     FlexCarousel,
-    FlexMessage,
     FlexBubble,
     FlexImage,
     FlexBox,
     FlexText,
     FlexIcon,
     FlexButton,
-    MessageAction,
-    ReplyMessageRequest,
-    TextMessage,
     URIAction
 )
-from linebot.v3.messaging.models import (
-    LocationAction,
-    MessageAction,
-    QuickReply,
-    QuickReplyItem
-)
 
 from api.const import (
     ASK_LOCATION_QUESTION,
@@ -34,20 +20,32 @@ from api.const import (
     ERROR_TEXT,
     INFORM_TEXT,
     MAX_STARS,
-    QUESTION_SETTINGS,
+    MORE_RESULTS_TEXT,
     STAR_NAMES,
-    TEXT_TO_START_CONVERSATION,
 )
+from api.utils.conversation_state_codec import ConversationStateCodec
+from api.utils.conversation_state_machine import CONVERSATION_STATE_MACHINE
+from api.utils.flex_renderer import render_flex_message
 from api.utils.helper import (
-    get_keys_from_value,
-    get_image_file_url
+    get_image_file_url,
+    get_photo_url
 )
 from api.utils.logger import Logger
-from api.repository.firebase_conversation_repository import ConversationRepository
+from api.utils.metrics import StageTimer
+from api.utils.places_client import (
+    PlacesCircuitOpenError,
+    PlacesClient,
+    PlacesRateLimitError
+)
+from api.utils.reply_templates import REPLY_TEMPLATES
+from api.utils.result_ranker import ResultRanker
+from api.repository.async_conversation_repository import AsyncConversationRepository
 
 log = Logger().get()
 load_dotenv()
 
+DEFAULT_RESULT_RANKER = ResultRanker()
+
 class ConversationManagerService():
     """
     ユーザーとの会話全般の管理を行います
@@ -57,14 +55,27 @@ class ConversationManagerService():
     - ユーザーの回答内容をDBに保存
     - 意図しないメッセージが来た場合にvalidationを実行
 
+    返答内容はReplyMessageRequestをシリアライズしたものと同じ形式のdictで返却する
+    質問や固定文言はREPLY_TEMPLATESで事前にシリアライズしたものにreply_tokenを差し込んで生成する
+
+    state_codecを渡した場合はステートレスモードで動作する
+    - 質問の選択肢をポストバックにし、そのデータに署名付きで会話の状態を持たせる
+    - 会話の開始と途中の質問への回答ではDBを読み書きせず、最後の質問に回答した時点で会話記録を1度だけ保存する
+
     Parameters
     ----------
     user_id : str
         メッセージ取得時に渡ってくるLINEユーザーのユニークID
     reply_token : str
         メッセージ取得時に、そのメッセージに返答を行うために必要なtoken
-    conversation_repository : ConversationRepository
+    conversation_repository : AsyncConversationRepository
         会話のデータを保存・取得・削除するためのリポジトリ
+    places_client : PlacesClient
+        検索結果を取得するためのPlaces APIクライアント
+    state_codec : Optional[ConversationStateCodec]
+        ステートレスモードで会話の状態をポストバックのデータに変換する。Noneの場合は会話の状態を毎回DBに保存する
+    result_ranker : Optional[ResultRanker]
+        検索結果を並び替え、1ページ分を選ぶ。Noneの場合は既定の重みを使用する
 
     Attributes
     ---------
@@ -72,28 +83,42 @@ class ConversationManagerService():
         メッセージ取得時に渡ってくるLINEユーザーのユニークID
     reply_token : str
         メッセージ取得時に、そのメッセージに返答を行うために必要なtoken
-    conversation_repository : ConversationRepository
+    conversation_repository : AsyncConversationRepository
         会話のデータを保存・取得・削除するためのリポジトリ
+    places_client : PlacesClient
+        検索結果を取得するためのPlaces APIクライアント
+    state_codec : Optional[ConversationStateCodec]
+        ステートレスモードで会話の状態をポストバックのデータに変換する
+    result_ranker : ResultRanker
+        検索結果を並び替え、1ページ分を選ぶ
+    conversation_type : Optional[str]
+        会話記録から判明した検索のtype。メトリクスのラベルに使用する
     """
 
-    def __init__(self, user_id: str, reply_token: str, conversation_repository: ConversationRepository):
+    def __init__(self, user_id: str, reply_token: str, conversation_repository: AsyncConversationRepository, places_client: PlacesClient, state_codec: Optional[ConversationStateCodec] = None, result_ranker: Optional[ResultRanker] = None):
         self.user_id = user_id
         self.reply_token = reply_token
         self.repository = conversation_repository
+        self.places_client = places_client
+        self.state_codec = state_codec
+        self.result_ranker = result_ranker or DEFAULT_RESULT_RANKER
+        self.conversation_type = None
 
 
-    def handle_recive_text(self, receive_text: str) -> 'ReplyMessageRequest':
+    async def handle_recive_text(self, receive_text: str) -> dict:
         """
         ユーザーの入力に対してて適切な回答を生成し返却
 
         ユーザーの入力に対しての次のアクションを、ユーザーの会話履歴等に基づいて振り分ける
         - 送信してきたユーザーに会話履歴があるかを確認
             - 会話リセットの場合 - 会話リセット用関数を呼び出す
-            - ある場合
+            - 検索結果の続きの要求の場合 - 続きを表示する関数を呼び出す
+            - 質問の途中の会話履歴がある場合
                 - ユーザーの回答ということになるので、answerを処理する関数を呼び出す
-            - ない場合
+            - ない場合(検索結果の続きだけを持つ会話履歴を含む)
                 - 会話スタートのテキストだった場合は会話スタート用のメソッドを呼び出す
                 - 上記に当てはまらない場合は不正なリクエストなのでエラー文言を出すメソッドを呼び出す
+        ステートレスモードで会話スタートのテキストを受け取った場合は、会話履歴を確認せず会話を開始する
 
         Parameters
         ----------
@@ -102,26 +127,32 @@ class ConversationManagerService():
 
         Returns
         -------
-        ReplyMessageRequest
+        dict
             割り当てた関数内で生成されたcontentを返却
         """
+        if self.state_codec is not None and CONVERSATION_STATE_MACHINE.is_start_text(receive_text):
+            return await self.start_conversation(receive_text)
+        if receive_text == MORE_RESULTS_TEXT:
+            return await self.show_more_results()
 
-        conversation_data = self.repository.get_conversation_info_by_user_id(self.user_id).to_dict()
+        with StageTimer('repository_read', event_kind='text') as stage:
+            conversation_data = await self.repository.get_conversation_info_by_user_id(self.user_id)
+            stage.conversation_type = self.conversation_type = conversation_data['type'] if conversation_data else None
 
         content = ''
         if receive_text == CONVERSATION_RESET_TEXT:
-            content = self.reset_conversation()
-        elif conversation_data:
-            content = self.handle_answer(receive_text, conversation_data)
-        elif receive_text in list(TEXT_TO_START_CONVERSATION.values()):
-            content = self.start_conversation(receive_text)
+            content = await self.reset_conversation()
+        elif conversation_data and 'current_status' in conversation_data:
+            content = await self.handle_answer(receive_text, conversation_data)
+        elif CONVERSATION_STATE_MACHINE.is_start_text(receive_text):
+            content = await self.start_conversation(receive_text)
         else:
-            content = self._get_next_question_content(ERROR_TEXT['SELECT_FROM_RICH_MENU'])
+            content = self._get_text_reply_content(ERROR_TEXT['SELECT_FROM_RICH_MENU'])
 
         return content
 
 
-    def reset_conversation(self) -> 'ReplyMessageRequest':
+    async def reset_conversation(self) -> dict:
         """
         会話履歴のリセット関連処理を行う
 
@@ -130,20 +161,20 @@ class ConversationManagerService():
 
         Returns
         -------
-        ReplyMessageRequest
+        dict
             リセット後の返答メッセージコンテンツ
         """
-        self.repository.delete(self.user_id)
+        await self.repository.delete(self.user_id)
         content = self._get_text_reply_content(INFORM_TEXT['RESET_CONVERSATION'])
         return content
 
 
-    def start_conversation(self, receive_text: str) -> 'ReplyMessageRequest':
+    async def start_conversation(self, receive_text: str) -> dict:
         """
         会話を開始する処理を行う
 
         - 受け取ったメッセージからなんのタイプの検索をするかを判定
-        - それに基づいて、ユーザー用の会話履歴を保存
+        - それに基づいて、ユーザー用の会話履歴を保存(ステートレスモードでは保存しない)
         - 最初の質問内容を返却する
 
         Paramenters
@@ -153,11 +184,14 @@ class ConversationManagerService():
         
         Returns
         -------
-        ReplyMessageRequest
+        dict
             次の質問に関する返答メッセージコンテンツ
         """
-        type = get_keys_from_value(TEXT_TO_START_CONVERSATION, receive_text)
-        current_status = QUESTION_SETTINGS[type]['order'][0]
+        type = self.conversation_type = CONVERSATION_STATE_MACHINE.get_type_by_start_text(receive_text)
+        current_status = CONVERSATION_STATE_MACHINE.get_first_status(type)
+        if self.state_codec is not None:
+            return self._get_next_question_content(type, current_status, ())
+
         store_data = {
             'user_id': self.user_id,
             'type': type,
@@ -165,12 +199,12 @@ class ConversationManagerService():
             'created_at': firestore.SERVER_TIMESTAMP,
             'updated_at': firestore.SERVER_TIMESTAMP
         }
-        self.repository.store(store_data)
+        await self.repository.store(store_data)
         content = self._get_next_question_content(type, current_status)
         return content
 
 
-    def handle_answer(self, receive_text: str, conversation_data: dict) -> 'ReplyMessageRequest':
+    async def handle_answer(self, receive_text: str, conversation_data: dict) -> dict:
         """
         会話履歴のあるユーザー対して、回答メッセージに基づきデータの保存と次の質問メッセージコンテンツ等を返却
 
@@ -180,6 +214,7 @@ class ConversationManagerService():
                     - 回答の保存と次の質問に関するコンテンツ(位置情報入力を求めるメッセージ)を返却
                 - それ以外
                     回答の保存と次の質問に関するコンテンツを返却
+                - 同時に届いた別のメッセージで既に質問が進んでいた場合 - 回答済みのメッセージコンテンツを返却
             - ない場合 - エラーメッセージコンテンツを返却
 
         Parameters
@@ -191,48 +226,89 @@ class ConversationManagerService():
 
         Returns
         -------
-        ReplyMessageRequest
+        dict
             次の質問に関する返答メッセージコンテンツまたは位置情報コンテンツ
         """
-        current_status = conversation_data['current_status']
         type = conversation_data['type']
-        questions_info = QUESTION_SETTINGS[type]
+        question = CONVERSATION_STATE_MACHINE.get_question(type, conversation_data['current_status'])
 
-        if receive_text in questions_info['questions'][current_status]['options']:
+        if receive_text in question.option_set:
 
-            # 最後の質問に対する回答の場合は、回答を保存して現在地の質問を返却
-            # 途中の質問に対する回答の場合は、回答を保存して次の質問内容を返却
-            if current_status == questions_info['order'][-1]:
-                update_data = {
-                    'answer.' + questions_info['questions'][current_status]['property']: receive_text
-                }
+            # 回答の記録と次の質問への移行は、質問が進んでいないことを確認した上で1つのトランザクションで行う
+            # 同じ質問への回答が先に記録されていた場合は、既に回答済みであることを返却
+            applied = await self.repository.record_answer(
+                self.user_id, question.id, question.property, receive_text, question.next_status
+            )
+            if not applied:
+                content = self._get_text_reply_content(ERROR_TEXT['ALREADY_ANSWERED'])
+                return content
 
-                self.repository.update(self.user_id, update_data)
+            # 最後の質問に対する回答の場合は現在地の質問を、途中の質問に対する回答の場合は次の質問内容を返却
+            if question.is_last:
                 content = self._get_location_content(ASK_LOCATION_QUESTION)
                 return content
             else:
-                index_of_current = questions_info['order'].index(current_status)
-                next_status = questions_info['order'][index_of_current + 1]
-                update_data = {
-                    'current_status': next_status,
-                    'answer.' + questions_info['questions'][current_status]['property']: receive_text
-                }
-
-                self.repository.update(self.user_id, update_data)
-                content = self._get_next_question_content(type, next_status)
+                content = self._get_next_question_content(type, question.next_status)
                 return content
         else:
             content = self._get_text_reply_content(ERROR_TEXT['SELECT_FROM_QUICK_REPLY'])
             return content
 
 
-    def get_result(self, latitude: str, longitude: str) -> 'ReplyMessageRequest':
+    async def handle_postback(self, data: str) -> dict:
+        """
+        ステートレスモードで選択肢のポストバックを受け取り、次の質問内容等を返却
+
+        - ポストバックのデータから会話の状態を復元
+            - 復元できない場合(改ざん・有効期限切れ・ステートレスモードでない) - エラーメッセージコンテンツを返却
+            - 最後の質問に対する回答
+                - 回答を含む会話記録を保存し、位置情報入力を求めるメッセージを返却
+            - それ以外
+                - DBにはアクセスせず、次の質問に関するコンテンツを返却
+
+        Parameters
+        ----------
+        data : str
+            ポストバックのデータ
+
+        Returns
+        -------
+        dict
+            次の質問に関する返答メッセージコンテンツまたは位置情報コンテンツ
+        """
+        state = self.state_codec.decode(self.user_id, data) if self.state_codec is not None else None
+        if state is None:
+            return self._get_text_reply_content(ERROR_TEXT['INVALID_QUICK_REPLY'])
+
+        type = self.conversation_type = state.type
+        question = CONVERSATION_STATE_MACHINE.get_question(type, state.status)
+        if not question.is_last:
+            return self._get_next_question_content(type, question.next_status, state.option_indexes)
+
+        store_data = {
+            'user_id': self.user_id,
+            'type': type,
+            'current_status': state.status,
+            'answer': state.answers,
+            'created_at': firestore.SERVER_TIMESTAMP,
+            'updated_at': firestore.SERVER_TIMESTAMP
+        }
+        await self.repository.store(store_data)
+        return self._get_location_content(ASK_LOCATION_QUESTION)
+
+
+    async def get_result(self, latitude: str, longitude: str) -> dict:
         """
         検索の結果を返却する
 
-        - DBにある会話の記録を元にPlaces APIにリクエスト
-        - 結果の中からランダムで3つの情報を取得しFlex Messageを作りユーザーに送信
-        - 会話履歴は削除する
+        - DBにある会話の記録を取得し、回答が揃っていれば同時に削除する
+        - 会話の記録を元にPlaces APIにリクエスト(失敗した場合は会話の記録を戻す)
+        - レート制限でリクエストできなかった場合は、位置情報の送り直しを促すメッセージを返却
+        - サーキットブレーカーが開いている場合は、古い可能性がある近くの検索結果を注意書きを付けて表示するか、お詫びのメッセージを返却
+        - 結果を評価値・レビュー数・距離のスコアで並べ、上位のページ分でFlex Messageを作りユーザーに送信
+        - 表示していない結果や次のページがある場合は会話記録に保存し、「もっと見る」のクイックリプライを付ける
+
+        検索結果を表示した後の会話記録にも回答が残っているため、位置情報を送り直すと同じ条件で検索し直す
 
         Parameters
             latitude : str
@@ -241,36 +317,43 @@ class ConversationManagerService():
                 位置情報メッセージイベントで取得した軽度の情報
         
         Returns
-            ReplyMessageRequest
+            dict
                 結果を格納したメッセージコンテンツ
         """
-        conversation_data = self.repository.get_conversation_info_by_user_id(self.user_id).to_dict()
+        # 回答が揃っていれば、会話記録の取得と削除を1つのトランザクションで行う
+        with StageTimer('repository_read', event_kind='location') as stage:
+            conversation_data = await self.repository.fetch_answers_and_delete(self.user_id, self._is_answerd_last_question)
+            stage.conversation_type = self.conversation_type = conversation_data['type'] if conversation_data else None
 
         if conversation_data:
             if self._is_answerd_last_question(conversation_data):
-                base_url = os.environ.get('GOOGLE_MAP_API_URL')
-                query = conversation_data['answer']
-                query['location'] = latitude+','+longitude
-                query['key'] = os.environ.get('GOOGLE_MAP_API_KEY')
-                query['type'] = conversation_data['type']
-
-                endpoint = base_url + '?' + urlencode(query) + '&opennow'
-                response = requests.get(endpoint)
-                data = response.json()
-                result = random.shuffle(data['results'])
-                result = result[:3]
-                self.repository.delete(self.user_id)
-                carousel = self._get_flex_message(result)
-
-                return  ReplyMessageRequest(
-                            reply_token=self.reply_token,
-                            messages=[
-                                FlexMessage(
-                                    alt_text="出力結果一覧",
-                                    contents=carousel
-                                )
-                            ]
+                location = latitude+','+longitude
+                try:
+                    with StageTimer('places_search', self.conversation_type, 'location'):
+                        data = await self.places_client.nearby_search(
+                            location=location,
+                            type=conversation_data['type'],
+                            **conversation_data['answer']
                         )
+                except Exception as e:
+                    # 位置情報を送り直せば検索をやり直せるよう、削除した会話記録を戻す
+                    await self.repository.store({
+                        **conversation_data,
+                        'user_id': self.user_id,
+                        'created_at': firestore.SERVER_TIMESTAMP,
+                        'updated_at': firestore.SERVER_TIMESTAMP
+                    })
+                    if isinstance(e, PlacesRateLimitError):
+                        return self._get_text_reply_content(ERROR_TEXT['SEARCH_BUSY'])
+                    if isinstance(e, PlacesCircuitOpenError):
+                        return self._get_text_reply_content(ERROR_TEXT['SEARCH_UNAVAILABLE'])
+                    raise
+                candidates = self._score_results(data['results'], location, conversation_data['answer'])
+                return await self._reply_result_page(
+                    conversation_data, location, candidates, data.get('next_page_token'),
+                    is_stored=False, empty_text=INFORM_TEXT['NO_RESULTS'], event_kind='location',
+                    notice=INFORM_TEXT['STALE_RESULTS'] if data.get('stale') else None
+                )
             else:
                 content = self._get_text_reply_content('質問が最後まで終わっていません。')
                 return content
@@ -279,13 +362,60 @@ class ConversationManagerService():
             return content
 
 
-    def _get_next_question_content(self, type: str, status: int) -> 'ReplyMessageRequest':
+    async def show_more_results(self) -> dict:
+        """
+        前回表示した検索結果の続きを返却する
+
+        - 会話記録に保存した、表示していない検索結果の候補を取得
+        - 候補が1ページ分に満たず次のページがある場合は、Places APIから次のページを取得して候補に加える
+        - 上位のページ分でFlex Messageを作り、残りの候補を会話記録に保存する
+        - レート制限やサーキットブレーカーで次のページを取得できなかった場合は、会話記録を変更せずにメッセージを返却
+
+        Returns
+        -------
+        dict
+            結果を格納したメッセージコンテンツ
+        """
+        with StageTimer('repository_read', event_kind='text') as stage:
+            conversation_data = await self.repository.get_result_candidates(self.user_id)
+            stage.conversation_type = self.conversation_type = conversation_data['type'] if conversation_data else None
+
+        if not conversation_data or 'location' not in conversation_data:
+            return self._get_text_reply_content(INFORM_TEXT['NO_MORE_RESULTS'])
+
+        location = conversation_data['location']
+        candidates = list(conversation_data.get('candidates', []))
+        next_page_token = conversation_data.get('next_page_token')
+        if len(candidates) < self.result_ranker.page_size and next_page_token:
+            # next_page_tokenを指定した場合、Places APIはそれ以外の検索条件を無視する
+            try:
+                with StageTimer('places_search', self.conversation_type, 'text'):
+                    data = await self.places_client.nearby_search(
+                        location=location,
+                        type=conversation_data['type'],
+                        pagetoken=next_page_token
+                    )
+            except PlacesRateLimitError:
+                return self._get_text_reply_content(ERROR_TEXT['SEARCH_BUSY'])
+            except PlacesCircuitOpenError:
+                return self._get_text_reply_content(ERROR_TEXT['SEARCH_UNAVAILABLE'])
+            candidates.extend(self._score_results(data['results'], location, conversation_data.get('answer', {})))
+            next_page_token = data.get('next_page_token')
+
+        return await self._reply_result_page(
+            conversation_data, location, candidates, next_page_token,
+            is_stored=True, empty_text=INFORM_TEXT['NO_MORE_RESULTS'], event_kind='text'
+        )
+
+
+    def _get_next_question_content(self, type: str, status: int, option_indexes: Optional[Tuple[int, ...]] = None) -> dict:
         """
         次の質問に関するコンテンツを作成
 
         検索のtypeとステータスナンバーから次の質問に関するコンテンツを作成
         - 質問の回答選択肢をクイックリプライで作成
         - 質問分をテキストで返却
+        ステートレスモードでoption_indexesを渡した場合は、選択肢を会話の状態を持つポストバックにする
 
         Paramenters
         -----------
@@ -293,32 +423,21 @@ class ConversationManagerService():
             検索のtype(restaurant)などの文字列
         status : int
             検索における何問目の質問かという情報
+        option_indexes : Optional[Tuple[int, ...]]
+            これまでの質問で選んだ選択肢の番号(質問順)
 
         Returns
         -------
-        ReplyMessageRequest
+        dict
             質問内容テキストと選択肢のクイックリプライコンテンツを生成し返却
         """
-
-        question_info = QUESTION_SETTINGS[type]['questions'][status]
-        reply_text = question_info['text']
-        options = question_info['options']
-        items = []
-        for option in options:
-            items.append(QuickReplyItem(action=MessageAction(label=option, text=option)))
-
-        return  ReplyMessageRequest(
-                    reply_token=self.reply_token,
-                    messages=[
-                        TextMessage(
-                            text=reply_text,
-                            quick_reply=QuickReply(items=items)
-                        )
-                    ]
-                )
+        if self.state_codec is not None and option_indexes is not None:
+            data = self.state_codec.encode_options(self.user_id, type, status, option_indexes)
+            return REPLY_TEMPLATES.postback_question(type, status).render_postback(self.reply_token, data)
+        return REPLY_TEMPLATES.question(type, status).render(self.reply_token)
 
 
-    def _get_text_reply_content(self, reply_text: str) -> 'ReplyMessageRequest':
+    def _get_text_reply_content(self, reply_text: str) -> dict:
         """
         引数で受けた文字列を元に返信コンテンツを生成して返却
 
@@ -327,20 +446,13 @@ class ConversationManagerService():
             返信で使用するメッセージ内容
 
         Returns
-        ReplyMessageRequest
+        dict
             reply_textを元に生成した返信コンテンツ
         """
-        return  ReplyMessageRequest(
-                    reply_token=self.reply_token,
-                    messages=[
-                        TextMessage(
-                            text=reply_text,
-                        )
-                    ]
-                )
+        return REPLY_TEMPLATES.text(reply_text).render(self.reply_token)
 
 
-    def _get_location_content(self, reply_text: str) -> 'ReplyMessageRequest':
+    def _get_location_content(self, reply_text: str) -> dict:
         """
         引数で受けたメッセージと位置情報を選択してもらうクイックリプライのコンテンツを生成して返却
 
@@ -349,20 +461,10 @@ class ConversationManagerService():
             返信で使用するメッセージ内容
 
         Returns
-        ReplyMessageRequest
+        dict
             reply_textで受けた返信メッセージと、クイックリプライでlocationを入力するメッセージコンテンツ
         """
-        return  ReplyMessageRequest(
-                    reply_token=self.reply_token,
-                    messages=[
-                        TextMessage(
-                            text=reply_text,
-                            quick_reply=QuickReply(
-                                items=[QuickReplyItem(action=LocationAction(label="location", text="location"))]
-                            )
-                        )
-                    ]
-                )
+        return REPLY_TEMPLATES.location(reply_text).render(self.reply_token)
 
 
     def _get_flex_message(self, data: list) -> 'FlexCarousel':
@@ -370,6 +472,8 @@ class ConversationManagerService():
         Flex Messageコンテンツを作成する
 
         渡ってきたデータを元に３つのFlex Messageコンテンツを作成しFlexCarouselでまとめる
+        返信にはモデルを組み立てないapi.utils.flex_renderer.render_flex_messageを使用しており、
+        こちらはその出力が一致することを確認するための基準として残している
         
         
         Parameters
@@ -455,6 +559,92 @@ class ConversationManagerService():
         return bubbles
 
 
+    def _score_results(self, results: List[dict], location: str, answer: dict) -> List[dict]:
+        """
+        検索結果にスコアを付けた候補を作成する
+
+        Parameters
+        ----------
+        results : List[dict]
+            Places APIの検索結果
+        location : str
+            '緯度,経度'形式の送信された位置
+        answer : dict
+            会話記録の回答内容。radiusがあれば距離のスコアの基準にする
+
+        Returns
+        -------
+        List[dict]
+            スコアを付けた候補
+        """
+        latitude, longitude = location.split(',')
+        radius = answer.get('radius')
+        return self.result_ranker.score(results, float(latitude), float(longitude), float(radius) if radius else None)
+
+
+    async def _reply_result_page(self, conversation_data: dict, location: str, candidates: List[dict], next_page_token: Optional[str], is_stored: bool, empty_text: str, event_kind: str, notice: Optional[str] = None) -> dict:
+        """
+        候補から1ページ分の検索結果のメッセージコンテンツを作成し、続きを会話記録に保存する
+
+        - 続きがある場合は、残りの候補と次のページのtokenを会話記録に保存し、「もっと見る」のクイックリプライを付ける
+        - 続きがない場合は、残っている会話記録を削除する
+
+        Parameters
+        ----------
+        conversation_data : dict
+            検索条件(type, answer)を含む会話記録
+        location : str
+            '緯度,経度'形式の送信された位置
+        candidates : List[dict]
+            表示していない候補
+        next_page_token : Optional[str]
+            Places APIの次のページのtoken
+        is_stored : bool
+            会話記録がDBに残っている場合True
+        empty_text : str
+            表示する候補がない場合の返信内容
+        event_kind : str
+            メトリクスのラベルに使用するイベントの種類
+        notice : Optional[str]
+            検索結果の前に送る注意書き。Noneの場合は送らない
+
+        Returns
+        -------
+        dict
+            結果を格納したメッセージコンテンツ
+        """
+        page, remaining = self.result_ranker.take_page(candidates)
+        has_more = bool(remaining) or bool(next_page_token)
+        if has_more:
+            # 質問の途中と区別するため、current_statusは保存しない
+            await self.repository.store({
+                'user_id': self.user_id,
+                'type': conversation_data['type'],
+                'answer': conversation_data.get('answer', {}),
+                'location': location,
+                'candidates': remaining,
+                'next_page_token': next_page_token,
+                'created_at': firestore.SERVER_TIMESTAMP,
+                'updated_at': firestore.SERVER_TIMESTAMP
+            })
+        elif is_stored:
+            await self.repository.delete(self.user_id)
+
+        if not page:
+            return self._get_text_reply_content(empty_text)
+
+        with StageTimer('render_flex', self.conversation_type, event_kind):
+            message = render_flex_message(page, '出力結果一覧')
+        if has_more:
+            message['quickReply'] = REPLY_TEMPLATES.more_results()
+        # クイックリプライを表示するため、検索結果を最後のメッセージにする
+        messages = [*REPLY_TEMPLATES.text(notice).messages, message] if notice else [message]
+        return  {
+                    'replyToken': self.reply_token,
+                    'messages': messages
+                }
+
+
     def _get_photo_url(self, photo_reference: str) -> str:
         """
         photo_reference(Places APIから取得できるお店の画像に関する文字列情報)を元に画像linkを作成
@@ -469,8 +659,7 @@ class ConversationManagerService():
         str
             生成した画像リンクが返却される
         """
-        link = 'https://maps.googleapis.com/maps/api/place/photo?maxwidth=400&photoreference='+photo_reference+'&key='+os.environ.get('GOOGLE_MAP_API_KEY')
-        return link
+        return get_photo_url(photo_reference)
 
 
     def _create_stars(self, rating: float) -> List[Union[FlexIcon, FlexText]]:
@@ -526,7 +715,5 @@ class ConversationManagerService():
             最後の質問が回答済みならTrueを返す
 
         """
-        last_question_index = QUESTION_SETTINGS[conversation_data['type']]['order'][-1]
-        last_question_property = QUESTION_SETTINGS[conversation_data['type']][last_question_index]['property']
-        return last_question_property in conversation_data['answer']
+        return CONVERSATION_STATE_MACHINE.is_answered_last_question(conversation_data)
 
@@ -0,0 +1,177 @@
+import asyncio
+import time
+from datetime import (
+    datetime,
+    timedelta,
+    timezone
+)
+from typing import List, Optional
+
+from api.repository.async_conversation_repository import AsyncConversationRepository
+from api.utils.logger import Logger
+
+log = Logger().get()
+
+
+class ConversationSweeperService():
+    """
+    放置された会話記録を定期的に削除する
+
+    主な役割
+    - interval秒ごとに、最後の更新からttl秒以上経過した会話記録を検索する
+    - 見つかった会話記録をbatch_size件ずつまとめて削除する
+    - 同時に実行する削除の数と、1秒あたりに削除する件数を制限し、DBへの負荷を抑える
+    - 実行ごとの削除件数などのメトリクスを提供する
+
+    削除の直前に会話が再開された記録は、リポジトリのdelete_idleが削除の対象から外す。
+    複数プロセスで同時に実行しても、同じ記録を二重に削除することはない。
+
+    Parameters
+    ----------
+    repository : AsyncConversationRepository
+        会話記録のリポジトリ
+    ttl : float
+        最後の更新から削除するまでの秒数
+    interval : float
+        実行する間隔(秒)
+    batch_size : int
+        1回の削除でまとめて削除する最大件数
+    max_concurrency : int
+        同時に実行する削除の最大数
+    max_deletes_per_second : float
+        1秒あたりに削除する最大件数
+    """
+
+    def __init__(
+        self,
+        repository: AsyncConversationRepository,
+        ttl: float = 86400.0,
+        interval: float = 600.0,
+        batch_size: int = 200,
+        max_concurrency: int = 2,
+        max_deletes_per_second: float = 100.0,
+    ):
+        self.repository = repository
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_deletes_per_second = max_deletes_per_second
+        self._task: Optional[asyncio.Task] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._next_delete_at = 0.0
+
+        self._runs_total = 0
+        self._failed_runs_total = 0
+        self._deleted_total = 0
+        self._last_run_deleted = 0
+        self._last_run_seconds = 0.0
+
+    async def start(self) -> None:
+        """
+        定期実行のタスクを起動する
+
+        タスクはイベントループに紐づくため、起動中のループ上(アプリのstartup時)で呼び出す。
+        """
+        if self._task is not None:
+            return
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._task = asyncio.create_task(self._run_periodically(), name='conversation-sweeper')
+        log.info(f'会話記録の掃除を{self.interval}秒間隔で開始しました')
+
+    async def stop(self) -> None:
+        """
+        定期実行のタスクを停止する
+
+        実行中の削除は中断される。削除はバッチ単位でトランザクションになっているため、途中まで削除された状態にはならない。
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        log.info('会話記録の掃除を停止しました')
+
+    async def run_once(self) -> int:
+        """
+        放置された会話記録を一通り削除する
+
+        Returns
+        -------
+        int
+            削除した件数
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        started_at = time.monotonic()
+        updated_before = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        limit = self.batch_size * self.max_concurrency
+        deleted = 0
+        try:
+            while True:
+                user_ids = await self.repository.find_idle(updated_before, limit)
+                if not user_ids:
+                    break
+                batches = [user_ids[i:i + self.batch_size] for i in range(0, len(user_ids), self.batch_size)]
+                counts = await asyncio.gather(*[self._delete_batch(batch, updated_before) for batch in batches])
+                deleted += sum(counts)
+                # 見つかった記録が全て会話を再開していた場合は、同じ記録を検索し続けないよう終了する
+                if len(user_ids) < limit or sum(counts) == 0:
+                    break
+        except Exception:
+            self._failed_runs_total += 1
+            raise
+        finally:
+            self._runs_total += 1
+            self._deleted_total += deleted
+            self._last_run_deleted = deleted
+            self._last_run_seconds = time.monotonic() - started_at
+
+        log.info(f'放置された会話記録を{deleted}件削除しました({self._last_run_seconds:.1f}秒)')
+        return deleted
+
+    def get_metrics(self) -> dict:
+        """
+        実行回数や削除件数などを返却する
+
+        Returns
+        -------
+        dict
+            実行回数・失敗回数・削除件数の累計と、直近の実行の削除件数・所要時間
+        """
+        return {
+            'runs_total': self._runs_total,
+            'failed_runs_total': self._failed_runs_total,
+            'deleted_total': self._deleted_total,
+            'last_run_deleted': self._last_run_deleted,
+            'last_run_seconds': self._last_run_seconds,
+        }
+
+    async def _run_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                log.error(f'会話記録の掃除でエラー発生: {str(e)}')
+
+    async def _delete_batch(self, user_ids: List[str], updated_before: datetime) -> int:
+        async with self._semaphore:
+            await self._throttle(len(user_ids))
+            return await self.repository.delete_idle(user_ids, updated_before)
+
+    async def _throttle(self, count: int) -> None:
+        """
+        1秒あたりの削除件数がmax_deletes_per_secondを超えないよう、削除の開始を待つ
+
+        削除する件数分の時間枠を先に予約してから待つため、並行に呼び出されても枠が重ならない
+        """
+        now = time.monotonic()
+        start_at = max(now, self._next_delete_at)
+        self._next_delete_at = start_at + count / self.max_deletes_per_second
+        if start_at > now:
+            await asyncio.sleep(start_at - now)
@@ -0,0 +1,95 @@
+from typing import List
+
+from linebot.v3.webhooks import Event
+
+from api.repository.event_id_repository import EventIdRepository
+from api.utils.logger import Logger
+
+log = Logger().get()
+
+
+class EventDeduplicationService():
+    """
+    再送されたWebhookイベントを処理前に取り除く
+
+    LINEプラットフォームは応答が遅い場合などにイベントを再送する(deliveryContext.isRedelivery)
+    webhookEventIdを一定時間記録し、記録済みのイベントは会話の処理に渡さずに破棄することで、
+    DBの読み込みやPlaces APIへのリクエスト、使用済みのreply_tokenでの返信が重複しないようにする
+
+    Parameters
+    ----------
+    repository : EventIdRepository
+        処理済みのイベントIDを記録するリポジトリ
+
+    Attributes
+    ----------
+    duplicates : int
+        重複として破棄したイベント数
+    redeliveries : int
+        受信した再送イベントの数(重複でなかったものを含む)
+    """
+
+    def __init__(self, repository: EventIdRepository):
+        self.repository = repository
+        self.duplicates = 0
+        self.redeliveries = 0
+
+    async def filter(self, events: List['Event']) -> List['Event']:
+        """
+        処理済みのイベントを取り除き、未処理のイベントのIDを記録する
+
+        webhookEventIdのないイベントはそのまま返却する。
+
+        Parameters
+        ----------
+        events : List[Event]
+            Webhookに含まれるイベント一覧
+
+        Returns
+        -------
+        List[Event]
+            未処理のイベント一覧
+        """
+        new_events = []
+        for event in events:
+            delivery_context = getattr(event, 'delivery_context', None)
+            if delivery_context is not None and delivery_context.is_redelivery:
+                self.redeliveries += 1
+
+            event_id = getattr(event, 'webhook_event_id', None)
+            if event_id is None or await self.repository.add_if_absent(event_id):
+                new_events.append(event)
+            else:
+                self.duplicates += 1
+                log.info(f'処理済みのイベントを破棄しました: {event_id}')
+        return new_events
+
+    async def forget(self, events: List['Event']) -> None:
+        """
+        イベントIDの記録を削除する
+
+        キューに空きがない等でイベントを受け付けられなかった場合に呼び出し、再送時に処理されるようにする
+
+        Parameters
+        ----------
+        events : List[Event]
+            受け付けられなかったイベント一覧
+        """
+        for event in events:
+            event_id = getattr(event, 'webhook_event_id', None)
+            if event_id is not None:
+                await self.repository.discard(event_id)
+
+    def get_metrics(self) -> dict:
+        """
+        破棄した重複イベント数などを返却する
+
+        Returns
+        -------
+        dict
+            重複イベント数と再送イベント数
+        """
+        return {
+            'duplicate_events_total': self.duplicates,
+            'redelivered_events_total': self.redeliveries,
+        }
@@ -0,0 +1,198 @@
+import asyncio
+import time
+from typing import (
+    Awaitable,
+    Callable,
+    List,
+    Optional
+)
+
+from linebot.v3.webhooks import Event
+
+from api.utils.logger import Logger
+
+log = Logger().get()
+
+
+class EventWorkerService():
+    """
+    Webhookイベントをキューに積み、バックグラウンドのワーカーで処理する
+
+    主な役割
+    - コールバックのリクエストからイベントを受け取り、上限付きのキューに積む
+    - 設定された数のワーカーでキューからイベントを取り出し、処理に回す
+      ワーカーは処理の完了を待たずに次のイベントを取り出すため、1人のユーザーの連続したイベントが全ワーカーを塞がない
+    - シャットダウン時にキューに残ったイベントを処理しきってから停止する
+    - キューの深さや処理件数などのメトリクスを提供する
+
+    Parameters
+    ----------
+    submit : Callable[[Event, Optional[str], float], Awaitable[asyncio.Future]]
+        イベントとdestination、キューに積んだ時刻を受け取り、イベントを処理に回して処理の完了を通知するFutureを返すコルーチン関数
+        (UserEventDispatcherService.submit)。処理を始められるまで待つことで、キューからの取り出しを抑える
+    worker_count : int
+        キューを処理するワーカーの数
+    queue_maxsize : int
+        キューに積めるイベントの上限数
+    drain_timeout : float
+        シャットダウン時にキューの処理完了を待つ最大秒数
+
+    Attributes
+    ----------
+    queue : asyncio.Queue
+        処理待ちのイベントを格納するキュー
+    workers : List[asyncio.Task]
+        起動中のワーカータスク
+    """
+
+    def __init__(
+        self,
+        submit: Callable[['Event', Optional[str], float], Awaitable[asyncio.Future]],
+        worker_count: int = 4,
+        queue_maxsize: int = 1000,
+        drain_timeout: float = 10.0,
+    ):
+        self.submit = submit
+        self.worker_count = worker_count
+        self.queue_maxsize = queue_maxsize
+        self.drain_timeout = drain_timeout
+        self.queue: Optional[asyncio.Queue] = None
+        self.workers: List[asyncio.Task] = []
+        self._accepting = False
+        # キューから取り出し、処理が終わっていないイベント数
+        self._processing = 0
+
+        self._max_depth = 0
+        self._enqueued_total = 0
+        self._rejected_total = 0
+        self._processed_total = 0
+        self._failed_total = 0
+        self._wait_seconds_total = 0.0
+
+    async def start(self) -> None:
+        """
+        キューを作成しワーカーを起動する
+
+        キューはイベントループに紐づくため、起動中のループ上(アプリのstartup時)で呼び出す。
+        """
+        if self._accepting:
+            return
+        self.queue = asyncio.Queue(maxsize=self.queue_maxsize)
+        self.workers = [
+            asyncio.create_task(self._worker(), name=f'event-worker-{i}')
+            for i in range(self.worker_count)
+        ]
+        self._accepting = True
+        log.info(f'イベントワーカーを{self.worker_count}個起動しました')
+
+    async def stop(self) -> None:
+        """
+        新規イベントの受付を止め、キューを処理しきってからワーカーを停止する
+
+        drain_timeout秒以内に処理しきれなかったイベントは破棄し、その件数をログに出力する。
+        """
+        if not self._accepting:
+            return
+        self._accepting = False
+
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            # キューに残っているイベントに加え、処理の途中で中断するイベントも数える
+            log.error(f'シャットダウン時に{self.queue.qsize() + self._processing}件のイベントを処理できませんでした')
+
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        log.info('イベントワーカーを停止しました')
+
+    def enqueue(self, events: List['Event'], destination: Optional[str] = None) -> None:
+        """
+        1つのWebhookに含まれるイベントをまとめてキューに積む
+
+        一部だけ積まれることがないよう、全イベント分の空きがない場合は1件も積まずに例外を送出する。
+
+        Parameters
+        ----------
+        events : List[Event]
+            Webhookに含まれるイベント一覧
+        destination : str
+            イベントを受信したボットのユーザーID
+
+        Raises
+        ------
+        asyncio.QueueFull
+            ワーカーが停止中、またはキューに空きがない場合
+        """
+        # 処理に回したが終わっていないイベントも、上限の中に数える
+        if not self._accepting or self.queue_maxsize - self.queue.qsize() - self._processing < len(events):
+            self._rejected_total += len(events)
+            raise asyncio.QueueFull()
+
+        enqueued_at = time.monotonic()
+        for event in events:
+            self.queue.put_nowait((event, destination, enqueued_at))
+        self._enqueued_total += len(events)
+        self._max_depth = max(self._max_depth, self.queue.qsize())
+
+    def get_metrics(self) -> dict:
+        """
+        キューとワーカーの状態を返却する
+
+        Returns
+        -------
+        dict
+            キューの深さ・上限・処理件数などの値
+        """
+        depth = self.queue.qsize() if self.queue is not None else 0
+        return {
+            'queue_depth': depth,
+            'queue_maxsize': self.queue_maxsize,
+            'queue_max_depth': self._max_depth,
+            'workers': len(self.workers),
+            'processing': self._processing,
+            'enqueued_total': self._enqueued_total,
+            'rejected_total': self._rejected_total,
+            'processed_total': self._processed_total,
+            'failed_total': self._failed_total,
+            'wait_seconds_total': self._wait_seconds_total,
+        }
+
+    async def _worker(self) -> None:
+        """
+        キューからイベントを取り出して処理に回し続けるワーカー
+
+        処理の完了は_finishで受け取り、処理中の例外はログに出力する。ワーカー自体は停止させない。
+        """
+        while True:
+            event, destination, enqueued_at = await self.queue.get()
+            self._wait_seconds_total += time.monotonic() - enqueued_at
+            self._processing += 1
+            try:
+                # キューでの待ち時間も返信の期限に数えられるよう、キューに積んだ時刻を受信時刻として渡す
+                future = await self.submit(event, destination, enqueued_at)
+            except BaseException as e:
+                self._finish(e)
+                raise
+            future.add_done_callback(
+                lambda future: self._finish(asyncio.CancelledError() if future.cancelled() else future.exception())
+            )
+
+    def _finish(self, error: Optional[BaseException]) -> None:
+        """
+        処理の終わったイベントを数え、キューに処理完了を通知する
+
+        Parameters
+        ----------
+        error : Optional[BaseException]
+            処理中に発生した例外。成功した場合はNone
+        """
+        self._processing -= 1
+        if error is None:
+            self._processed_total += 1
+        else:
+            self._failed_total += 1
+            if isinstance(error, Exception):
+                log.error(f'イベント処理エラー発生: {str(error)}')
+        self.queue.task_done()
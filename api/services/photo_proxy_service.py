@@ -0,0 +1,144 @@
+import asyncio
+from typing import Dict, Optional, Tuple
+
+from api.utils.photo_cache import PhotoCache
+from api.utils.places_client import (
+    PlacesClient,
+    PlacesRateLimitError
+)
+from api.utils.rate_limiter import (
+    RateLimitExceededError,
+    TokenBucket
+)
+
+
+class PhotoProxyService():
+    """
+    施設の画像をPlace Photoから取得し、ディスクにキャッシュして返却する
+
+    主な役割
+    - LINEのクライアントにAPIキーを含むURLを渡さず、画像をこのサーバー経由で配信する
+    - 一度取得した画像はPhotoCacheに保存し、以降はPlace Photoへリクエストしない
+    - キャッシュにない同じ画像への同時のリクエストは、1回のPlace Photoへのリクエストにまとめる
+    - rate_limiterを渡した場合、キャッシュにない画像の取得数を制限する
+
+    Parameters
+    ----------
+    client : PlacesClient
+        Place Photoへリクエストするクライアント
+    cache : PhotoCache
+        画像を保存するディスクキャッシュ
+    max_width : int
+        取得する画像の最大の幅(px)
+    rate_limiter : Optional[TokenBucket]
+        キャッシュにない画像の取得数を制限するトークンバケット。Noneの場合は制限しない
+
+    Attributes
+    ----------
+    hits : int
+        キャッシュから返却した回数
+    misses : int
+        Place Photoへリクエストした回数
+    coalesced : int
+        実行中の他のリクエストの結果を待って返却した回数
+    rate_limited : int
+        制限によりPlace Photoへリクエストしなかった回数
+    """
+
+    def __init__(self, client: PlacesClient, cache: PhotoCache, max_width: int = 400, rate_limiter: Optional[TokenBucket] = None):
+        self.client = client
+        self.cache = cache
+        self.max_width = max_width
+        self.rate_limiter = rate_limiter
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+
+    async def get_photo(self, photo_reference: str) -> Tuple[bytes, str, str]:
+        """
+        画像とETag、Content-Typeを取得する
+
+        Parameters
+        ----------
+        photo_reference : str
+            Places APIから取得できるお店の画像に関する文字列情報
+
+        Returns
+        -------
+        Tuple[bytes, str, str]
+            画像のバイト列、ETag、Place Photoが返したContent-Type
+
+        Raises
+        ------
+        PlacesPhotoNotFoundError
+            photo_referenceに対応する画像が存在しない場合
+        PlacesRateLimitError
+            キャッシュにない画像の取得数が制限を超えた場合
+        PlacesApiError
+            Place Photoからの取得に失敗した場合
+        """
+        inflight = self._inflight.get(photo_reference)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        cached = await asyncio.to_thread(self.cache.get, photo_reference)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        # キャッシュを確認している間に、他のリクエストが取得を始めている場合がある
+        inflight = self._inflight.get(photo_reference)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        if self.rate_limiter is not None:
+            try:
+                await self.rate_limiter.acquire()
+            except RateLimitExceededError as e:
+                self.rate_limited += 1
+                raise PlacesRateLimitError(str(e)) from e
+            # トークンの補充を待っている間に、他のリクエストが取得を始めている場合がある
+            inflight = self._inflight.get(photo_reference)
+            if inflight is not None:
+                self.coalesced += 1
+                return await asyncio.shield(inflight)
+
+        self.misses += 1
+        # 最初にリクエストした接続が切断されても、待っている他のリクエストのために取得は続ける
+        task = asyncio.ensure_future(self._fetch(photo_reference))
+        self._inflight[photo_reference] = task
+        task.add_done_callback(lambda task: self._forget(photo_reference, task))
+        return await asyncio.shield(task)
+
+    def get_stats(self) -> dict:
+        """
+        キャッシュのヒット数・ミス数などを返却する
+
+        Returns
+        -------
+        dict
+            画像の取得とディスクキャッシュの統計情報
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'rate_limited': self.rate_limited,
+            'inflight': len(self._inflight),
+            **self.cache.get_stats(),
+        }
+
+    async def _fetch(self, photo_reference: str) -> Tuple[bytes, str, str]:
+        content, content_type = await self.client.get_photo(photo_reference, self.max_width)
+        etag = await asyncio.to_thread(self.cache.put, photo_reference, content, content_type)
+        return content, etag, content_type
+
+    def _forget(self, photo_reference: str, task: asyncio.Future) -> None:
+        self._inflight.pop(photo_reference, None)
+        # 待っていたリクエストが全て切断された場合でも、例外が未処理として警告されないようにする
+        if not task.cancelled():
+            task.exception()
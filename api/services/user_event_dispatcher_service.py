@@ -0,0 +1,236 @@
+import asyncio
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import (
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple
+)
+
+from linebot.v3.webhooks import Event
+
+from api.utils.logger import Logger
+
+log = Logger().get()
+
+# 処理中のイベントを受信した時刻(time.monotonic())。キューでの待ち時間を含めた経過時間の計算に使う
+EVENT_RECEIVED_AT: ContextVar[Optional[float]] = ContextVar('event_received_at', default=None)
+
+
+class UserEventDispatcherService():
+    """
+    Webhookイベントを送信元ごとに順序を保ったまま並行に処理する
+
+    主な役割
+    - 異なるユーザーのイベントは並行に処理し、遅いユーザーの処理が他のユーザーを待たせないようにする
+    - 同じユーザーのイベントは受け取った順に1件ずつ処理し、会話記録の更新が競合しないようにする
+    - 全体で同時に処理する送信元の数を制限する
+
+    送信元ごとに処理待ちのイベントの列を持ち、その送信元を処理中のタスクが列を順番に処理する。
+    処理中の送信元のイベントは列に加えるだけなので、submitの呼び出し元(ワーカー等)は待たされない。
+    送信元はuser_id、なければgroup_id / room_idで判定し、いずれもないイベントは順序を保証しない。
+
+    Parameters
+    ----------
+    process : Callable[[Event, Optional[str]], Awaitable[None]]
+        イベントとdestinationを受け取りイベントを処理するコルーチン関数
+    max_concurrency : int
+        全体で同時に処理する送信元の最大数
+    """
+
+    def __init__(self, process: Callable[['Event', Optional[str]], Awaitable[None]], max_concurrency: int = 16):
+        self.process = process
+        self.max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # 処理中の送信元ごとの、処理待ちの(イベント, destination, 受信時刻, 完了を通知するFuture)
+        self._pending: Dict[str, Deque[Tuple['Event', Optional[str], float, asyncio.Future]]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._active = 0
+
+    async def submit(self, event: 'Event', destination: Optional[str] = None, received_at: Optional[float] = None) -> asyncio.Future:
+        """
+        イベントを処理に回し、処理の完了を通知するFutureを返却する
+
+        同じ送信元を処理中の場合は、その送信元の処理待ちの列に加えてすぐに返却する。
+        そうでない場合は全体の同時実行数の枠が空くまで待ち、処理を始めてから返却する。
+        同じ送信元のイベントは、このメソッドが呼ばれた順に処理される。
+
+        Parameters
+        ----------
+        event : Event
+            Webhookイベント
+        destination : str
+            イベントを受信したボットのユーザーID
+        received_at : Optional[float]
+            イベントを受信した時刻(time.monotonic())。Noneの場合は現在時刻
+
+        Returns
+        -------
+        asyncio.Future
+            イベントの処理が終わると完了するFuture。処理で発生した例外はこのFutureに設定される
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if received_at is None:
+            received_at = time.monotonic()
+
+        future = asyncio.get_running_loop().create_future()
+        item = (event, destination, received_at, future)
+        key = self._get_source_key(event)
+        if key is not None:
+            pending = self._pending.get(key)
+            if pending is not None:
+                pending.append(item)
+                return future
+            # 枠を待っている間に届いた同じ送信元のイベントも、この後のタスクで順番に処理する
+            self._pending[key] = deque()
+
+        try:
+            await self._semaphore.acquire()
+        except BaseException:
+            if key is not None:
+                self._cancel_pending(key)
+            raise
+        task = asyncio.ensure_future(self._run(key, item))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return future
+
+    async def dispatch(self, event: 'Event', destination: Optional[str] = None, received_at: Optional[float] = None) -> None:
+        """
+        同じ送信元の先行イベントの処理完了を待ってからイベントを処理し、処理の完了を待つ
+
+        Parameters
+        ----------
+        event : Event
+            Webhookイベント
+        destination : str
+            イベントを受信したボットのユーザーID
+        received_at : Optional[float]
+            イベントを受信した時刻(time.monotonic())。Noneの場合は現在時刻
+        """
+        await (await self.submit(event, destination, received_at))
+
+    async def dispatch_all(self, events: List['Event'], destination: Optional[str] = None) -> None:
+        """
+        1つのWebhookに含まれるイベントを並行に処理し、全ての完了を待つ
+
+        Parameters
+        ----------
+        events : List[Event]
+            Webhookに含まれるイベント一覧
+        destination : str
+            イベントを受信したボットのユーザーID
+        """
+        received_at = time.monotonic()
+        results = await asyncio.gather(
+            *[self.dispatch(event, destination, received_at) for event in events],
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                log.error(f'イベント処理エラー発生: {str(result)}')
+
+    async def close(self) -> None:
+        """
+        処理中・処理待ちのイベントを中断する
+
+        ワーカーの停止後など、残りのイベントを処理しない場合に呼び出す。
+        """
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_metrics(self) -> dict:
+        """
+        処理中のイベント数などを返却する
+
+        Returns
+        -------
+        dict
+            処理中のイベント数・送信元数・処理待ちのイベント数・同時実行数の上限
+        """
+        return {
+            'active_events': self._active,
+            'active_sources': len(self._pending),
+            'pending_events': sum(len(pending) for pending in self._pending.values()),
+            'max_concurrency': self.max_concurrency,
+        }
+
+    async def _run(self, key: Optional[str], item: Tuple['Event', Optional[str], float, asyncio.Future]) -> None:
+        """
+        イベントを処理し、同じ送信元の処理待ちの列が空になるまで続けて処理する
+
+        Parameters
+        ----------
+        key : Optional[str]
+            送信元を識別するキー
+        item : Tuple[Event, Optional[str], float, asyncio.Future]
+            最初に処理するイベント
+        """
+        try:
+            while True:
+                await self._process(*item)
+                if key is None:
+                    return
+                pending = self._pending[key]
+                if not pending:
+                    del self._pending[key]
+                    return
+                item = pending.popleft()
+        except asyncio.CancelledError:
+            item[3].cancel()
+            if key is not None:
+                self._cancel_pending(key)
+            raise
+        finally:
+            self._semaphore.release()
+
+    async def _process(self, event: 'Event', destination: Optional[str], received_at: float, future: asyncio.Future) -> None:
+        EVENT_RECEIVED_AT.set(received_at)
+        self._active += 1
+        try:
+            await self.process(event, destination)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(None)
+        finally:
+            self._active -= 1
+
+    def _cancel_pending(self, key: str) -> None:
+        for _, _, _, future in self._pending.pop(key, ()):
+            future.cancel()
+
+    @staticmethod
+    def _get_source_key(event: 'Event') -> Optional[str]:
+        """
+        イベントの送信元を識別するキーを取得する
+
+        Parameters
+        ----------
+        event : Event
+            Webhookイベント
+
+        Returns
+        -------
+        Optional[str]
+            user_id / group_id / room_id のいずれか。取得できない場合はNone
+        """
+        source = getattr(event, 'source', None)
+        if source is None:
+            return None
+        for attribute in ('user_id', 'group_id', 'room_id'):
+            value = getattr(source, attribute, None)
+            if value:
+                return value
+        return None
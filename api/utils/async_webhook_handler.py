@@ -0,0 +1,103 @@
+import inspect
+from typing import Callable, Optional
+
+from linebot.v3 import WebhookHandler
+from linebot.v3.webhook import WebhookPayload
+from linebot.v3.webhooks import (
+    Event,
+    MessageEvent
+)
+
+from api.utils.logger import Logger
+
+log = Logger().get()
+
+
+class AsyncWebhookHandler(WebhookHandler):
+    """
+    コルーチン関数のハンドラーに対応したWebhookHandler
+
+    SDKのWebhookHandler.handleは署名検証・パース・ハンドラー呼び出しを同期的にまとめて行うため、
+    async defで定義したハンドラーはawaitされない。
+    このクラスでは署名検証とパース(parse)と、イベント毎のハンドラー呼び出し(dispatch)を分離し、
+    ワーカー等から個別にイベントを処理できるようにする。
+    ハンドラーの登録方法(add / default)はWebhookHandlerと同じ。
+    """
+
+    def parse(self, body: str, signature: str) -> 'WebhookPayload':
+        """
+        署名を検証しWebhookのリクエストボディをパースする
+
+        Parameters
+        ----------
+        body : str
+            Webhookのリクエストボディ
+        signature : str
+            X-Line-Signatureヘッダーの値
+
+        Returns
+        -------
+        WebhookPayload
+            イベント一覧とdestinationを格納したペイロード
+
+        Raises
+        ------
+        InvalidSignatureError
+            署名が一致しない場合
+        """
+        return self.parser.parse(body, signature, as_payload=True)
+
+    async def dispatch(self, event: 'Event', destination: Optional[str] = None) -> None:
+        """
+        イベントに対応するハンドラーを呼び出す
+
+        ハンドラーがコルーチン関数の場合は完了までawaitする。
+
+        Parameters
+        ----------
+        event : Event
+            Webhookイベント
+        destination : str
+            イベントを受信したボットのユーザーID
+        """
+        func = self._get_handler(event)
+        if func is None:
+            log.info(f'{event.__class__.__name__}に対応するハンドラーがありません')
+            return
+
+        arg_spec = inspect.getfullargspec(func)
+        if arg_spec.varargs is not None or len(arg_spec.args) == 2:
+            result = func(event, destination)
+        elif len(arg_spec.args) == 1:
+            result = func(event)
+        else:
+            result = func()
+
+        if inspect.isawaitable(result):
+            await result
+
+    def _get_handler(self, event: 'Event') -> Optional[Callable]:
+        """
+        イベントの種類(メッセージイベントの場合はメッセージの種類も含む)から登録済みのハンドラーを取得
+
+        Parameters
+        ----------
+        event : Event
+            Webhookイベント
+
+        Returns
+        -------
+        Optional[Callable]
+            対応するハンドラー。見つからない場合はデフォルトハンドラー(未登録ならNone)
+        """
+        func = None
+        if isinstance(event, MessageEvent):
+            func = self._handlers.get(event.__class__.__name__ + '_' + event.message.__class__.__name__)
+
+        if func is None:
+            func = self._handlers.get(event.__class__.__name__)
+
+        if func is None:
+            func = self._default
+
+        return func
@@ -0,0 +1,216 @@
+import json
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from api.utils import geohash
+from api.utils.places_client import PlacesClient
+
+# キャッシュするPlaces APIのステータス。エラーのレスポンスはキャッシュしない
+CACHEABLE_STATUSES = ('OK', 'ZERO_RESULTS')
+
+
+def create_search_key(location: str, type: str, precision: int, **params) -> Tuple:
+    """
+    検索条件から、位置をgeohashで量子化した検索のキーを生成する
+
+    Parameters
+    ----------
+    location : str
+        '緯度,経度'形式の検索の中心地点
+    type : str
+        検索する施設のtype(restaurantなど)
+    precision : int
+        位置を量子化するgeohashの文字数
+    params
+        keyword, radiusなどの追加の検索条件
+
+    Returns
+    -------
+    Tuple
+        (type, 検索条件, geohash)のタプル
+    """
+    latitude, longitude = location.split(',')
+    cell = geohash.encode(float(latitude), float(longitude), precision)
+    return (type, tuple(sorted((k, str(v)) for k, v in params.items())), cell)
+
+
+class CachedPlacesClient():
+    """
+    Places APIの検索結果を位置を量子化したキーでキャッシュするクライアント
+
+    PlacesClientをラップし、同じtype・検索条件(keyword, radius)・geohashセルの検索には
+    Places APIへリクエストせずキャッシュした結果を返却する
+    キャッシュはTTLで失効し、推定メモリ使用量の上限を超えた場合は最も使われていないものから破棄する
+
+    Parameters
+    ----------
+    client : PlacesClient
+        実際にPlaces APIへリクエストするクライアント
+    precision : int
+        位置を量子化するgeohashの文字数
+    ttl : float
+        キャッシュの有効秒数
+    max_bytes : int
+        キャッシュするレスポンスの推定サイズの合計の上限
+
+    Attributes
+    ----------
+    hits : int
+        キャッシュから返却した回数
+    misses : int
+        Places APIへリクエストした回数
+    evictions : int
+        上限またはTTL切れで破棄した回数
+    """
+
+    def __init__(self, client: PlacesClient, precision: int = 7, ttl: float = 600.0, max_bytes: int = 50 * 1024 * 1024):
+        self.client = client
+        self.precision = precision
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def nearby_search(self, location: str, type: str, **params) -> dict:
+        """
+        現在地周辺の営業中の施設を検索する。キャッシュがあればそれを返却する
+
+        返却するdictとresultsのリストはコピーなので並び替え等をしてよいが、
+        resultsの各要素はキャッシュと共有しているため書き換えないこと。
+
+        Parameters
+        ----------
+        location : str
+            '緯度,経度'形式の検索の中心地点
+        type : str
+            検索する施設のtype(restaurantなど)
+        params
+            keyword, radiusなどの追加の検索条件
+
+        Returns
+        -------
+        dict
+            Places APIのレスポンス(results, next_page_tokenなど)
+        """
+        key = self.get_key(location, type, **params)
+        data = self._get(key)
+        if data is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            data = await self.client.nearby_search(location, type, **params)
+            # サーキットブレーカーが返した古い結果はキャッシュしない
+            if data.get('status') in CACHEABLE_STATUSES and not data.get('stale'):
+                self._set(key, data)
+
+        return {**data, 'results': list(data.get('results', []))}
+
+    async def close(self) -> None:
+        """
+        ラップしたクライアントのコネクションプールを閉じる
+        """
+        await self.client.close()
+
+    def get_key(self, location: str, type: str, **params) -> Tuple:
+        """
+        検索条件からキャッシュのキーを生成する
+
+        Parameters
+        ----------
+        location : str
+            '緯度,経度'形式の検索の中心地点
+        type : str
+            検索する施設のtype(restaurantなど)
+        params
+            keyword, radiusなどの追加の検索条件
+
+        Returns
+        -------
+        Tuple
+            (type, 検索条件, geohash)のタプル
+        """
+        return create_search_key(location, type, self.precision, **params)
+
+    def get_stats(self) -> dict:
+        """
+        キャッシュのヒット数・ミス数などを返却する
+
+        Returns
+        -------
+        dict
+            キャッシュの統計情報
+        """
+        return {
+            'size': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _get(self, key: Tuple) -> Optional[dict]:
+        """
+        有効期限内のキャッシュを取得し、最近使われたものとして末尾に移動する
+
+        Parameters
+        ----------
+        key : Tuple
+            キャッシュのキー
+
+        Returns
+        -------
+        Optional[dict]
+            キャッシュ済みのレスポンス。ない場合や期限切れの場合はNone
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, size, data = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return data
+
+    def _set(self, key: Tuple, data: dict) -> None:
+        """
+        レスポンスをキャッシュし、サイズの上限を超えた分を古いものから破棄する
+
+        Parameters
+        ----------
+        key : Tuple
+            キャッシュのキー
+        data : dict
+            Places APIのレスポンス
+        """
+        size = len(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (time.monotonic() + self.ttl, size, data)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def _remove(self, key: Tuple) -> None:
+        """
+        キャッシュを破棄する
+
+        Parameters
+        ----------
+        key : Tuple
+            キャッシュのキー
+        """
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+        self.evictions += 1
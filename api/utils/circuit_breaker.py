@@ -0,0 +1,168 @@
+import time
+from collections import deque
+
+# サーキットブレーカーの状態
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+# メトリクスとして出力する状態の値
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker():
+    """
+    直近の呼び出しのエラー率と遅延から、依存先への呼び出しを止めるサーキットブレーカー
+
+    - closed: 呼び出しを許可し、直近window_size件の結果を記録する。
+      min_calls件以上のうちエラーの割合がfailure_rate以上、
+      またはslow_call_duration秒以上かかった割合がslow_call_rate以上になるとopenにする
+    - open: 呼び出しを許可しない。open_duration秒経過するとhalf_openにする
+    - half_open: half_open_probes件の呼び出しだけを試しに許可する。
+      全て成功すればclosedに戻し、1件でもエラーまたは遅延があればopenに戻す
+
+    Parameters
+    ----------
+    failure_rate : float
+        openにするエラーの割合
+    slow_call_rate : float
+        openにする遅い呼び出しの割合
+    slow_call_duration : float
+        遅い呼び出しとみなす秒数
+    window_size : int
+        割合の計算に使う直近の呼び出しの件数
+    min_calls : int
+        割合を判定するのに必要な最小の呼び出しの件数
+    open_duration : float
+        openにしてからhalf_openにするまでの秒数
+    half_open_probes : int
+        half_openで試しに許可する呼び出しの件数
+
+    Attributes
+    ----------
+    opened : int
+        openにした回数
+    rejected : int
+        openのため許可しなかった呼び出しの数
+    """
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        slow_call_rate: float = 0.5,
+        slow_call_duration: float = 3.0,
+        window_size: int = 20,
+        min_calls: int = 10,
+        open_duration: float = 30.0,
+        half_open_probes: int = 3,
+    ):
+        self.failure_rate = failure_rate
+        self.slow_call_rate = slow_call_rate
+        self.slow_call_duration = slow_call_duration
+        self.min_calls = min(min_calls, window_size)
+        self.open_duration = open_duration
+        self.half_open_probes = max(half_open_probes, 1)
+        # 直近の呼び出しの(エラーか, 遅いか)
+        self._window = deque(maxlen=window_size)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        """
+        現在の状態。openでopen_duration秒経過していればhalf_openにする
+        """
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_duration:
+            self._state = HALF_OPEN
+            self._probes = 0
+            self._probe_successes = 0
+        return self._state
+
+    def allow(self) -> bool:
+        """
+        呼び出しを許可するか判定する
+
+        許可した場合は、呼び出しの後にrecordまたはreleaseを必ず呼ぶこと
+
+        Returns
+        -------
+        bool
+            呼び出してよい場合True
+        """
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self._probes < self.half_open_probes:
+            self._probes += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, duration: float, failed: bool) -> None:
+        """
+        許可した呼び出しの結果を記録し、必要であれば状態を変える
+
+        Parameters
+        ----------
+        duration : float
+            呼び出しにかかった秒数
+        failed : bool
+            呼び出しがエラーになった場合True
+        """
+        slow = duration >= self.slow_call_duration
+        state = self.state
+        if state == HALF_OPEN:
+            if failed or slow:
+                self._open()
+            else:
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self._state = CLOSED
+                    self._window.clear()
+            return
+        if state == OPEN:
+            # openにする前に始まった呼び出しの結果は判定に使わない
+            return
+
+        self._window.append((failed, slow))
+        if len(self._window) < self.min_calls:
+            return
+        failures = sum(1 for failed, _ in self._window if failed)
+        slow_calls = sum(1 for _, slow in self._window if slow)
+        if failures >= self.failure_rate * len(self._window) or slow_calls >= self.slow_call_rate * len(self._window):
+            self._open()
+
+    def release(self) -> None:
+        """
+        許可した呼び出しを、結果を記録せずに終える(呼び出す前に中断した場合など)
+        """
+        if self._state == HALF_OPEN and self._probes > self._probe_successes:
+            self._probes -= 1
+
+    def get_stats(self) -> dict:
+        """
+        状態・直近のエラー率などを返却する
+
+        Returns
+        -------
+        dict
+            サーキットブレーカーの統計情報。stateはclosed=0, half_open=1, open=2
+        """
+        calls = len(self._window)
+        return {
+            'state': STATE_VALUES[self.state],
+            'calls': calls,
+            'failure_rate': sum(1 for failed, _ in self._window if failed) / calls if calls else 0.0,
+            'slow_call_rate': sum(1 for _, slow in self._window if slow) / calls if calls else 0.0,
+            'opened': self.opened,
+            'rejected': self.rejected,
+        }
+
+    def _open(self) -> None:
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._window.clear()
+        self.opened += 1
@@ -0,0 +1,212 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from api.utils import geohash
+from api.utils.circuit_breaker import CircuitBreaker
+from api.utils.places_client import (
+    PlacesCircuitOpenError,
+    PlacesClient,
+    PlacesRateLimitError
+)
+from api.utils.result_ranker import get_distance
+
+# 代わりの結果として保持するPlaces APIのステータス。エラーのレスポンスは保持しない
+FALLBACK_STATUSES = ('OK', 'ZERO_RESULTS')
+
+
+class CircuitBreakerPlacesClient():
+    """
+    Places APIへのリクエストをサーキットブレーカーで保護するクライアント
+
+    PlacesClientをラップし、Places APIのエラーや遅延が続いた場合はリクエストせずに応答する
+    - 成功した検索のレスポンスを、type・検索条件・geohashセルごとに代わりの結果として保持する
+    - ブレーカーが開いている間は、同じtype・検索条件で中心が最も近い(max_distance以内の)保持した結果を
+      'stale': Trueを付けて返却する。該当するものがない場合や次のページの取得はPlacesCircuitOpenErrorを送出する
+    - 代わりの結果は古い可能性があるため、次のページ(next_page_token)は含まない
+
+    Parameters
+    ----------
+    client : PlacesClient
+        実際にPlaces APIへリクエストするクライアント
+    breaker : CircuitBreaker
+        Places APIへのリクエストを許可するか判定するサーキットブレーカー
+    precision : int
+        代わりの結果を保持する単位のgeohashの文字数
+    ttl : float
+        代わりの結果を保持する秒数
+    max_distance : float
+        代わりの結果として使う検索の中心までの最大の距離(m)
+    max_entries : int
+        保持する代わりの結果の最大数。超えた場合は最も古いものから破棄する
+
+    Attributes
+    ----------
+    stale_served : int
+        ブレーカーが開いている間に、保持した結果を返却した回数
+    unavailable : int
+        ブレーカーが開いている間に、保持した結果がなく応答できなかった回数
+    """
+
+    def __init__(
+        self,
+        client: PlacesClient,
+        breaker: CircuitBreaker,
+        precision: int = 6,
+        ttl: float = 3600.0,
+        max_distance: float = 1000.0,
+        max_entries: int = 1000,
+    ):
+        self.client = client
+        self.breaker = breaker
+        self.precision = precision
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        # (type, 検索条件) -> geohash -> (緯度, 経度, 保持した時刻, レスポンス)
+        self._fallbacks: Dict[Tuple, Dict[str, Tuple[float, float, float, dict]]] = {}
+        # 古い順に並べた(type, 検索条件, geohash)
+        self._order = OrderedDict()
+        self.stale_served = 0
+        self.unavailable = 0
+
+    async def nearby_search(self, location: str, type: str, **params) -> dict:
+        """
+        現在地周辺の営業中の施設を検索する。ブレーカーが開いている場合は保持した結果を返却する
+
+        Parameters
+        ----------
+        location : str
+            '緯度,経度'形式の検索の中心地点
+        type : str
+            検索する施設のtype(restaurantなど)
+        params
+            keyword, radiusなどの追加の検索条件
+
+        Returns
+        -------
+        dict
+            Places APIのレスポンス(results, next_page_tokenなど)。保持した結果の場合は'stale': Trueを含む
+
+        Raises
+        ------
+        PlacesCircuitOpenError
+            ブレーカーが開いていて、代わりに返却できる結果がない場合
+        """
+        if not self.breaker.allow():
+            data = None if 'pagetoken' in params else self._get_fallback(location, type, params)
+            if data is None:
+                self.unavailable += 1
+                raise PlacesCircuitOpenError('Places APIのエラーまたは遅延が続いているため、リクエストを停止しています')
+            self.stale_served += 1
+            return data
+
+        started_at = time.monotonic()
+        try:
+            data = await self.client.nearby_search(location, type, **params)
+        except (PlacesRateLimitError, asyncio.CancelledError):
+            # Places APIの状態とは関係なく中断した呼び出しは、判定に使わない
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record(time.monotonic() - started_at, failed=True)
+            raise
+        self.breaker.record(time.monotonic() - started_at, failed=False)
+
+        if 'pagetoken' not in params and data.get('status') in FALLBACK_STATUSES:
+            self._set_fallback(location, type, params, data)
+        return data
+
+    async def close(self) -> None:
+        """
+        ラップしたクライアントのコネクションプールを閉じる
+        """
+        await self.client.close()
+
+    def get_stats(self) -> dict:
+        """
+        ブレーカーの状態や、保持した結果を返却した回数などを返却する
+
+        Returns
+        -------
+        dict
+            サーキットブレーカーと代わりの結果の統計情報
+        """
+        return {
+            **self.breaker.get_stats(),
+            'stale_served': self.stale_served,
+            'unavailable': self.unavailable,
+            'fallback_entries': len(self._order),
+        }
+
+    def _get_fallback(self, location: str, type: str, params: dict) -> Optional[dict]:
+        """
+        同じtype・検索条件で、中心が最も近い有効期限内の保持した結果を取得する
+
+        Parameters
+        ----------
+        location : str
+            '緯度,経度'形式の検索の中心地点
+        type : str
+            検索する施設のtype(restaurantなど)
+        params : dict
+            keyword, radiusなどの追加の検索条件
+
+        Returns
+        -------
+        Optional[dict]
+            'stale': Trueを付けたレスポンス。ない場合はNone
+        """
+        cells = self._fallbacks.get((type, self._get_params_key(params)))
+        if not cells:
+            return None
+
+        latitude, longitude = (float(value) for value in location.split(','))
+        expires_before = time.monotonic() - self.ttl
+        nearest = None
+        nearest_distance = self.max_distance
+        for cell_latitude, cell_longitude, stored_at, data in cells.values():
+            if stored_at < expires_before:
+                continue
+            distance = get_distance(latitude, longitude, cell_latitude, cell_longitude)
+            if distance <= nearest_distance:
+                nearest = data
+                nearest_distance = distance
+        if nearest is None:
+            return None
+
+        data = {key: value for key, value in nearest.items() if key != 'next_page_token'}
+        return {**data, 'results': list(data.get('results', [])), 'stale': True}
+
+    def _set_fallback(self, location: str, type: str, params: dict, data: dict) -> None:
+        """
+        レスポンスを代わりの結果として保持し、上限を超えた分を古いものから破棄する
+
+        Parameters
+        ----------
+        location : str
+            '緯度,経度'形式の検索の中心地点
+        type : str
+            検索する施設のtype(restaurantなど)
+        params : dict
+            keyword, radiusなどの追加の検索条件
+        data : dict
+            Places APIのレスポンス
+        """
+        latitude, longitude = (float(value) for value in location.split(','))
+        key = (type, self._get_params_key(params))
+        cell = geohash.encode(latitude, longitude, self.precision)
+        self._fallbacks.setdefault(key, {})[cell] = (latitude, longitude, time.monotonic(), data)
+        self._order[(key, cell)] = None
+        self._order.move_to_end((key, cell))
+        while len(self._order) > self.max_entries:
+            oldest_key, oldest_cell = self._order.popitem(last=False)[0]
+            cells = self._fallbacks[oldest_key]
+            del cells[oldest_cell]
+            if not cells:
+                del self._fallbacks[oldest_key]
+
+    @staticmethod
+    def _get_params_key(params: dict) -> Tuple:
+        return tuple(sorted((k, str(v)) for k, v in params.items()))
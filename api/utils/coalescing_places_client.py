@@ -0,0 +1,95 @@
+import asyncio
+from typing import Dict, Tuple
+
+from api.utils.cached_places_client import create_search_key
+from api.utils.places_client import PlacesClient
+
+
+class CoalescingPlacesClient():
+    """
+    実行中の同じ検索に相乗りし、同時に届いた同じ検索を1回のPlaces APIへのリクエストにまとめるクライアント
+
+    PlacesClientをラップし、type・検索条件(keyword, radius, pagetoken)・geohashセルが同じ検索が
+    実行中であれば、新たにリクエストせずその結果を待って返却する
+    結果は保持しないため、検索が終わった後の同じ検索は再びリクエストする
+
+    Parameters
+    ----------
+    client : PlacesClient
+        実際にPlaces APIへリクエストするクライアント
+    precision : int
+        位置を量子化するgeohashの文字数
+
+    Attributes
+    ----------
+    requests : int
+        ラップしたクライアントへリクエストした回数
+    coalesced : int
+        実行中の検索の結果を待って返却した回数
+    """
+
+    def __init__(self, client: PlacesClient, precision: int = 7):
+        self.client = client
+        self.precision = precision
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self.requests = 0
+        self.coalesced = 0
+
+    async def nearby_search(self, location: str, type: str, **params) -> dict:
+        """
+        現在地周辺の営業中の施設を検索する。同じ検索が実行中であればその結果を返却する
+
+        Parameters
+        ----------
+        location : str
+            '緯度,経度'形式の検索の中心地点
+        type : str
+            検索する施設のtype(restaurantなど)
+        params
+            keyword, radiusなどの追加の検索条件
+
+        Returns
+        -------
+        dict
+            Places APIのレスポンス(results, next_page_tokenなど)
+        """
+        key = create_search_key(location, type, self.precision, **params)
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.requests += 1
+            # 最初に検索したイベントの処理が中断されても、待っている他のイベントのために検索は続ける
+            task = asyncio.ensure_future(self.client.nearby_search(location, type, **params))
+            self._inflight[key] = task
+            task.add_done_callback(lambda task: self._forget(key, task))
+
+        data = await asyncio.shield(task)
+        return {**data, 'results': list(data.get('results', []))}
+
+    async def close(self) -> None:
+        """
+        ラップしたクライアントのコネクションプールを閉じる
+        """
+        await self.client.close()
+
+    def get_stats(self) -> dict:
+        """
+        リクエスト数・相乗りした回数などを返却する
+
+        Returns
+        -------
+        dict
+            検索の統計情報
+        """
+        return {
+            'requests': self.requests,
+            'coalesced': self.coalesced,
+            'inflight': len(self._inflight),
+        }
+
+    def _forget(self, key: Tuple, task: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        # 待っていたイベントの処理が全て中断された場合でも、例外が未処理として警告されないようにする
+        if not task.cancelled():
+            task.exception()
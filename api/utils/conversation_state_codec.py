@@ -0,0 +1,161 @@
+"""
+Summary
+-------
+会話の状態をポストバックのデータに埋め込むための符号化
+
+Description
+-----------
+ステートレスモードでは、質問の選択肢をPostbackActionにし、そのデータに「この選択肢を選んだ後の会話の状態」を持たせる。
+ポストバックを受け取るだけで会話の状態が復元できるため、質問に回答するたびにDBを読み書きする必要がなくなる。
+
+データの形式は「{type}.{回答した選択肢の番号を-で連結}.{発行時刻(36進数の秒)}.{署名}」
+- 回答は質問順の選択肢の番号だけを持ち、質問のステータスや回答の値は状態遷移から復元する
+- 署名はユーザーIDも含めたHMAC-SHA256で、改ざんや他のユーザーのデータの流用を検出する
+- 発行からttl秒を過ぎたデータは無効とする
+"""
+import base64
+import hashlib
+import hmac
+import time
+from dataclasses import dataclass
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple
+)
+
+from api.utils.conversation_state_machine import ConversationStateMachine
+
+# LINEのポストバックのデータの最大文字数
+MAX_POSTBACK_DATA_LENGTH = 300
+SIGNATURE_LENGTH = 22
+
+
+@dataclass(frozen=True)
+class ConversationState:
+    """
+    ポストバックから復元した会話の状態
+
+    Attributes
+    ----------
+    type : str
+        検索のtype
+    status : int
+        最後に回答した質問のステータスナンバー
+    answers : Dict[str, str]
+        回答内容。キーは質問のproperty
+    option_indexes : Tuple[int, ...]
+        回答した選択肢の番号(質問順)
+    """
+    type: str
+    status: int
+    answers: Dict[str, str]
+    option_indexes: Tuple[int, ...]
+
+
+class ConversationStateCodec():
+    """
+    会話の状態とポストバックのデータを相互に変換する
+
+    Parameters
+    ----------
+    secret : str
+        署名に使用する秘密鍵
+    state_machine : ConversationStateMachine
+        回答の番号から質問と回答内容を復元する状態遷移
+    ttl : float
+        データの有効期限(秒)
+    """
+
+    def __init__(self, secret: str, state_machine: ConversationStateMachine, ttl: float = 86400.0):
+        self._secret = secret.encode('utf-8')
+        self.state_machine = state_machine
+        self.ttl = ttl
+
+    def encode_options(self, user_id: str, type: str, status: int, option_indexes: Tuple[int, ...]) -> List[str]:
+        """
+        質問の各選択肢を選んだ後の状態をポストバックのデータにする
+
+        Parameters
+        ----------
+        user_id : str
+            LINEユーザーのユニークID
+        type : str
+            検索のtype
+        status : int
+            選択肢を表示する質問のステータスナンバー
+        option_indexes : Tuple[int, ...]
+            この質問より前の質問で選んだ選択肢の番号(質問順)
+
+        Returns
+        -------
+        List[str]
+            質問の選択肢の表示順に並べたポストバックのデータ
+        """
+        question = self.state_machine.get_question(type, status)
+        issued_at = self._to_base36(int(time.time()))
+        prefix = '-'.join(str(index) for index in option_indexes)
+        data = []
+        for index in range(len(question.options)):
+            answers = f'{prefix}-{index}' if prefix else str(index)
+            payload = f'{type}.{answers}.{issued_at}'
+            data.append(f'{payload}.{self._sign(user_id, payload)}')
+        return data
+
+    def decode(self, user_id: str, data: str) -> Optional['ConversationState']:
+        """
+        ポストバックのデータから会話の状態を復元する
+
+        Parameters
+        ----------
+        user_id : str
+            ポストバックを送信したLINEユーザーのユニークID
+        data : str
+            ポストバックのデータ
+
+        Returns
+        -------
+        Optional[ConversationState]
+            会話の状態。署名が一致しない・有効期限切れ・形式が不正な場合はNone
+        """
+        if len(data) > MAX_POSTBACK_DATA_LENGTH:
+            return None
+        payload, _, signature = data.rpartition('.')
+        if not hmac.compare_digest(signature.encode('utf-8'), self._sign(user_id, payload).encode('ascii')):
+            return None
+
+        try:
+            type, answers, issued_at = payload.split('.')
+            if time.time() - int(issued_at, 36) > self.ttl:
+                return None
+            option_indexes = [int(index) for index in answers.split('-')]
+            status = self.state_machine.get_first_status(type)
+        except (KeyError, ValueError):
+            return None
+
+        result = {}
+        question = None
+        for index in option_indexes:
+            if status is None:
+                return None
+            question = self.state_machine.get_question(type, status)
+            if not 0 <= index < len(question.options):
+                return None
+            result[question.property] = question.options[index]
+            status = question.next_status
+        return ConversationState(type=type, status=question.id, answers=result, option_indexes=tuple(option_indexes))
+
+    def _sign(self, user_id: str, payload: str) -> str:
+        digest = hmac.new(self._secret, f'{user_id}.{payload}'.encode('utf-8'), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).decode('ascii')[:SIGNATURE_LENGTH]
+
+    @staticmethod
+    def _to_base36(value: int) -> str:
+        digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+        result = ''
+        while True:
+            value, remainder = divmod(value, 36)
+            result = digits[remainder] + result
+            if value == 0:
+                return result
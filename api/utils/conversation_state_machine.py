@@ -0,0 +1,233 @@
+from dataclasses import dataclass
+from typing import (
+    Dict,
+    FrozenSet,
+    Optional,
+    Tuple
+)
+
+from api.const import (
+    QUESTION_SETTINGS,
+    TEXT_TO_START_CONVERSATION
+)
+
+# LINEのクイックリプライに設定できる項目数の上限
+MAX_QUICK_REPLY_ITEMS = 13
+
+
+@dataclass(frozen=True)
+class Question:
+    """
+    QUESTION_SETTINGSの1つの質問を事前計算したもの
+
+    Attributes
+    ----------
+    id : int
+        質問のステータスナンバー
+    text : str
+        質問文
+    property : str
+        回答を保存するanswerのキー
+    options : Tuple[str, ...]
+        クイックリプライに表示する選択肢(表示順)
+    option_set : FrozenSet[str]
+        回答が選択肢に含まれるかを判定するための集合
+    next_status : Optional[int]
+        次の質問のステータスナンバー。最後の質問の場合はNone
+    """
+    id: int
+    text: str
+    property: str
+    options: Tuple[str, ...]
+    option_set: FrozenSet[str]
+    next_status: Optional[int]
+
+    @property
+    def is_last(self) -> bool:
+        return self.next_status is None
+
+
+class ConversationStateMachine():
+    """
+    検索会話の設定(QUESTION_SETTINGS, TEXT_TO_START_CONVERSATION)を事前計算した状態遷移
+
+    メッセージ毎に設定を線形探索しないよう、起動時に一度だけ以下を構築する
+    - 会話開始テキストからtypeへの逆引き
+    - 各質問の選択肢の集合と次のステータス
+    - typeごとの最初のステータスと最後の質問のproperty
+    設定に不備がある場合は構築時にValueErrorを送出し、会話の途中ではなく起動時に失敗させる
+
+    Parameters
+    ----------
+    question_settings : dict
+        QUESTION_SETTINGSと同じ形式の質問設定
+    start_texts : dict
+        TEXT_TO_START_CONVERSATIONと同じ形式のtypeと会話開始テキストの対応
+    """
+
+    def __init__(self, question_settings: dict, start_texts: dict):
+        self._validate(question_settings, start_texts)
+
+        self._type_by_start_text: Dict[str, str] = {text: type for type, text in start_texts.items()}
+        self._first_status: Dict[str, int] = {}
+        self._last_property: Dict[str, str] = {}
+        self._questions: Dict[Tuple[str, int], Question] = {}
+
+        for type, settings in question_settings.items():
+            order = settings['order']
+            self._first_status[type] = order[0]
+            for index, status in enumerate(order):
+                question = settings['questions'][status]
+                self._questions[(type, status)] = Question(
+                    id=status,
+                    text=question['text'],
+                    property=question['property'],
+                    options=tuple(question['options']),
+                    option_set=frozenset(question['options']),
+                    next_status=order[index + 1] if index + 1 < len(order) else None,
+                )
+            self._last_property[type] = settings['questions'][order[-1]]['property']
+
+    @property
+    def questions(self) -> Dict[Tuple[str, int], 'Question']:
+        """
+        (type, ステータスナンバー)をキーとした全ての質問
+        """
+        return self._questions
+
+    def get_type_by_start_text(self, text: str) -> Optional[str]:
+        """
+        会話開始テキストから検索のtypeを取得する
+
+        Parameters
+        ----------
+        text : str
+            ユーザーからのメッセージ
+
+        Returns
+        -------
+        Optional[str]
+            検索のtype。会話開始テキストでない場合はNone
+        """
+        return self._type_by_start_text.get(text)
+
+    def is_start_text(self, text: str) -> bool:
+        """
+        メッセージが会話開始テキストかを判定する
+
+        Parameters
+        ----------
+        text : str
+            ユーザーからのメッセージ
+
+        Returns
+        -------
+        bool
+            会話開始テキストならTrue
+        """
+        return text in self._type_by_start_text
+
+    def get_first_status(self, type: str) -> int:
+        """
+        検索のtypeの最初の質問のステータスナンバーを取得する
+
+        Parameters
+        ----------
+        type : str
+            検索のtype
+
+        Returns
+        -------
+        int
+            最初の質問のステータスナンバー
+        """
+        return self._first_status[type]
+
+    def get_question(self, type: str, status: int) -> 'Question':
+        """
+        検索のtypeとステータスナンバーから質問を取得する
+
+        Parameters
+        ----------
+        type : str
+            検索のtype
+        status : int
+            検索における何問目の質問かという情報
+
+        Returns
+        -------
+        Question
+            事前計算した質問
+        """
+        return self._questions[(type, status)]
+
+    def is_answered_last_question(self, conversation_data: dict) -> bool:
+        """
+        会話記録から最後の質問が回答済みかを判定する
+
+        Parameters
+        ----------
+        conversation_data : dict
+            DBから取得したユーザーの会話記録
+
+        Returns
+        -------
+        bool
+            最後の質問が回答済みならTrue
+        """
+        last_property = self._last_property[conversation_data['type']]
+        return last_property in conversation_data.get('answer', {})
+
+    @staticmethod
+    def _validate(question_settings: dict, start_texts: dict) -> None:
+        """
+        設定の整合性を検証する
+
+        Parameters
+        ----------
+        question_settings : dict
+            QUESTION_SETTINGSと同じ形式の質問設定
+        start_texts : dict
+            TEXT_TO_START_CONVERSATIONと同じ形式のtypeと会話開始テキストの対応
+
+        Raises
+        ------
+        ValueError
+            設定に不備がある場合
+        """
+        if set(start_texts) != set(question_settings):
+            raise ValueError(f'会話開始テキストと質問設定のtypeが一致しません: {sorted(start_texts)} / {sorted(question_settings)}')
+        if len(set(start_texts.values())) != len(start_texts):
+            raise ValueError('会話開始テキストが重複しています')
+
+        for type, settings in question_settings.items():
+            order = settings.get('order')
+            questions = settings.get('questions', {})
+            if not order:
+                raise ValueError(f'{type}: orderが空です')
+            if len(set(order)) != len(order):
+                raise ValueError(f'{type}: orderに重複があります')
+
+            properties = set()
+            for status in order:
+                question = questions.get(status)
+                if question is None:
+                    raise ValueError(f'{type}: ステータス{status}の質問がありません')
+                if question.get('id') != status:
+                    raise ValueError(f'{type}: ステータス{status}の質問のidが一致しません')
+                if not question.get('text') or not question.get('property'):
+                    raise ValueError(f'{type}: ステータス{status}の質問にtextまたはpropertyがありません')
+                if question['property'] in properties:
+                    raise ValueError(f'{type}: property {question["property"]}が重複しています')
+                properties.add(question['property'])
+
+                options = question.get('options')
+                if not options or not all(isinstance(option, str) for option in options):
+                    raise ValueError(f'{type}: ステータス{status}の選択肢は空でない文字列のリストにしてください')
+                if len(set(options)) != len(options):
+                    raise ValueError(f'{type}: ステータス{status}の選択肢が重複しています')
+                if len(options) > MAX_QUICK_REPLY_ITEMS:
+                    raise ValueError(f'{type}: ステータス{status}の選択肢はクイックリプライの上限{MAX_QUICK_REPLY_ITEMS}個以内にしてください')
+
+
+CONVERSATION_STATE_MACHINE = ConversationStateMachine(QUESTION_SETTINGS, TEXT_TO_START_CONVERSATION)
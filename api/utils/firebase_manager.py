@@ -1,7 +1,8 @@
 import firebase_admin
 from firebase_admin import (
     credentials,
-    firestore
+    firestore,
+    firestore_async
 )
 
 class FirebaseManager:
@@ -24,3 +25,4 @@ class FirebaseManager:
         cred = credentials.Certificate(json_path)
         firebase_admin.initialize_app(cred)
         self.db = firestore.client()
+        self.async_db = firestore_async.client()
@@ -0,0 +1,181 @@
+"""
+Summary
+-------
+検索結果のFlex Messageをdictで直接組み立てる
+
+Description
+-----------
+FlexBubble等のpydanticモデルを組み立てて検証・dict化する代わりに、
+FlexCarousel.to_dict()と同じキー・順序のdictを直接生成する。
+星マークの行は評価値の整数部分と半分の星の有無(11通り)ごとに一度だけ生成して使い回す。
+生成結果はConversationManagerService._get_flex_messageの出力をシリアライズしたものと一致する。
+(benchmarks/flex_renderer_benchmark.pyで一致を確認できる)
+"""
+
+from functools import lru_cache
+from typing import List, Tuple
+
+from api.const import (
+    MAX_STARS,
+    STAR_NAMES
+)
+from api.utils.helper import (
+    get_image_file_url,
+    get_photo_url
+)
+
+@lru_cache(maxsize=None)
+def _get_star_icons(full_count: int, has_half: bool) -> Tuple[dict, ...]:
+    """
+    星マークのアイコン行を生成する。同じ形の行は一度だけ生成される
+
+    Parameters
+    ----------
+    full_count : int
+        塗りつぶした星の数
+    has_half : bool
+        半分の星を含むか
+
+    Returns
+    -------
+    Tuple[dict, ...]
+        FlexIconをdict化したもののタプル(共有されるため書き換えないこと)
+    """
+    full_star = {'type': 'icon', 'url': get_image_file_url(STAR_NAMES['FULL_STAR']), 'size': 'sm'}
+    half_star = {'type': 'icon', 'url': get_image_file_url(STAR_NAMES['HALF_STAR']), 'size': 'sm'}
+    empty_star = {'type': 'icon', 'url': get_image_file_url(STAR_NAMES['EMPTY_STAR']), 'size': 'sm'}
+
+    icons = [full_star] * full_count
+    if has_half:
+        icons.append(half_star)
+        full_count += 1
+    icons.extend([empty_star] * (MAX_STARS - full_count))
+    return tuple(icons)
+
+
+def create_star_row(rating: float) -> List[dict]:
+    """
+    ratingの値から星マークの行のコンテンツを取得
+
+    Parameters
+    ----------
+    rating : float
+        星マークを描画するための評価値。0-5のfloat値が渡ってくる
+
+    Returns
+    -------
+    List[dict]
+        星マークのリスト。最後の要素には評価値がテキストとして追加される。
+    """
+    int_part = int(rating)
+    icons = _get_star_icons(int_part, rating - int_part >= 0.5)
+    return [*icons, {'type': 'text', 'flex': 0, 'text': str(rating), 'size': 'sm', 'color': '#999999', 'margin': 'md'}]
+
+
+def render_bubble(item: dict) -> dict:
+    """
+    Places APIの検索結果1件からFlexBubbleのdictを作成
+
+    Parameters
+    ----------
+    item : dict
+        Places APIから取得した検索結果1件
+
+    Returns
+    -------
+    dict
+        FlexBubble.to_dict()と同じ形式のdict
+    """
+    return {
+        'type': 'bubble',
+        'direction': 'ltr',
+        'hero': {
+            'type': 'image',
+            'url': get_photo_url(item['photos'][0]['photo_reference']),
+            'size': 'full',
+            'aspectRatio': '3:2',
+            'aspectMode': 'cover',
+            'animated': False,
+        },
+        'body': {
+            'type': 'box',
+            'layout': 'vertical',
+            'contents': [
+                # title
+                {'type': 'text', 'text': item['name'], 'size': 'xl', 'weight': 'bold'},
+                # review
+                {'type': 'box', 'layout': 'baseline', 'contents': create_star_row(float(item['rating'])), 'margin': 'md'},
+                # info
+                {
+                    'type': 'box',
+                    'layout': 'vertical',
+                    'contents': [
+                        {
+                            'type': 'box',
+                            'layout': 'baseline',
+                            'contents': [
+                                {'type': 'text', 'flex': 2, 'text': 'レビュー数', 'size': 'sm', 'color': '#aaaaaa'},
+                                {'type': 'text', 'flex': 5, 'text': str(item['user_ratings_total']), 'size': 'sm', 'color': '#666666', 'wrap': True},
+                            ],
+                            'spacing': 'sm',
+                        },
+                    ],
+                    'spacing': 'sm',
+                    'margin': 'lg',
+                },
+            ],
+        },
+        'footer': {
+            'type': 'box',
+            'layout': 'vertical',
+            'contents': [
+                {
+                    'type': 'button',
+                    'style': 'link',
+                    'action': {
+                        'type': 'uri',
+                        'label': 'Google Map',
+                        'uri': f"https://www.google.com/maps/place/?q=place_id:{item['place_id']}",
+                    },
+                    'height': 'sm',
+                },
+            ],
+            'spacing': 'sm',
+        },
+    }
+
+
+def render_carousel(data: list) -> dict:
+    """
+    検索結果からFlexCarouselのdictを作成
+
+    Parameters
+    ----------
+    data : list
+        Places APIから取得した検索結果
+
+    Returns
+    -------
+    dict
+        FlexCarousel.to_dict()と同じ形式のdict
+    """
+    return {'type': 'carousel', 'contents': [render_bubble(item) for item in data]}
+
+
+def render_flex_message(data: list, alt_text: str) -> dict:
+    """
+    検索結果からカルーセルのFlexMessageのdictを作成
+
+    Parameters
+    ----------
+    data : list
+        Places APIから取得した検索結果
+    alt_text : str
+        通知等で表示される代替テキスト
+
+    Returns
+    -------
+    dict
+        FlexMessage.to_dict()と同じ形式のdict
+    """
+    return {'type': 'flex', 'altText': alt_text, 'contents': render_carousel(data)}
@@ -0,0 +1,48 @@
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode(latitude: float, longitude: float, precision: int = 7) -> str:
+    """
+    緯度経度をgeohash文字列に変換する
+
+    precisionが大きいほどセルは小さくなる(6で約1.2km x 0.6km、7で約150m x 150m)
+
+    Parameters
+    ----------
+    latitude : float
+        緯度
+    longitude : float
+        経度
+    precision : int
+        geohashの文字数
+
+    Returns
+    -------
+    str
+        緯度経度を含むセルのgeohash
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    is_lng = True
+
+    while len(geohash) < precision:
+        target, value = (lng_range, longitude) if is_lng else (lat_range, latitude)
+        mid = (target[0] + target[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            target[0] = mid
+        else:
+            target[1] = mid
+        is_lng = not is_lng
+
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(geohash)
@@ -1,7 +1,185 @@
+import base64
+import hashlib
+import hmac
 import os
+from datetime import (
+    datetime,
+    timezone
+)
+from functools import lru_cache
+from typing import Optional
+from dotenv import load_dotenv
 
-def get_keys_from_value(d: dict, val: any) -> any:
-    return [k for k, v in d.items() if v == val][0]
+from firebase_admin import firestore
+
+from api.utils.static_assets import STATIC_ASSETS
+
+load_dotenv()
+
+# 画像URLは検索結果の件数分作成するため、設定は読み込み時に一度だけ取得する
+# trueの場合、施設の画像は/photosで中継する。falseの場合はAPIキーを含むPlace PhotoのURLを直接使う
+places_photo_proxy_enabled = os.environ.get('PLACES_PHOTO_PROXY_ENABLED', 'false').lower() == 'true'
+base_url = os.environ.get('BASE_URL')
+# /photosのURLの署名には、会話の状態の署名と同じ秘密鍵を使う
+photo_url_hmac = hmac.new((os.environ.get('CONVERSATION_STATE_SECRET') or os.environ.get('CHANNEL_SECRET') or '').encode('utf-8'), digestmod=hashlib.sha256)
+PHOTO_SIGNATURE_LENGTH = 22
 
 def get_image_file_url(filename: str) -> str:
-    return f"{os.environ.get('BASE_URL')}/images/{filename}"
+    return STATIC_ASSETS.get_url(filename)
+
+def matches_etag(if_none_match: str, etag: str) -> bool:
+    """
+    If-None-Matchヘッダーにレスポンスのetagが含まれているか判定する
+
+    If-None-Matchは弱い比較のため、W/付きのETagも一致とみなす
+
+    Parameters
+    ----------
+    if_none_match : str
+        リクエストのIf-None-Matchヘッダー
+    etag : str
+        ダブルクォートで囲んだレスポンスのETag
+
+    Returns
+    -------
+    bool
+        一致するETagがある場合True(304を返却してよい)
+    """
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """
+    Accept-Encodingヘッダーがgzipを受け付けるか判定する
+
+    Parameters
+    ----------
+    accept_encoding : Optional[str]
+        リクエストのAccept-Encodingヘッダー
+
+    Returns
+    -------
+    bool
+        gzipを受け付ける場合True
+    """
+    if not accept_encoding:
+        return False
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            # q=0は受け付けないことを表す
+            return params.replace(' ', '').lower() not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+def apply_field_updates(data: dict, updates: dict) -> dict:
+    """
+    Firestoreのupdateと同じ規則で、ドット区切りのフィールドパスを含む更新内容をdictに反映する
+
+    'answer.radius'のようなキーはネストしたdictのanswer['radius']を更新する
+
+    Parameters
+    ----------
+    data : dict
+        更新対象のdict(直接書き換えられる)
+    updates : dict
+        更新内容。キーはフィールド名またはドット区切りのフィールドパス
+
+    Returns
+    -------
+    dict
+        更新後のdata
+    """
+    for path, value in updates.items():
+        *parents, field = path.split('.')
+        target = data
+        for parent in parents:
+            if not isinstance(target.get(parent), dict):
+                target[parent] = {}
+            target = target[parent]
+        target[field] = value
+    return data
+
+def resolve_server_timestamps(data: dict, now: Optional[datetime] = None) -> dict:
+    """
+    Firestore以外のDBに保存するため、firestore.SERVER_TIMESTAMPを現在時刻(UTC)に置き換える
+
+    Parameters
+    ----------
+    data : dict
+        保存・更新する内容。ネストしたdictも対象とする
+    now : Optional[datetime]
+        置き換える時刻。省略した場合は現在時刻
+
+    Returns
+    -------
+    dict
+        SERVER_TIMESTAMPを置き換えた新しいdict
+    """
+    now = now or datetime.now(timezone.utc)
+    return {
+        key: now if value is firestore.SERVER_TIMESTAMP else resolve_server_timestamps(value, now) if isinstance(value, dict) else value
+        for key, value in data.items()
+    }
+
+def get_photo_url(photo_reference: str) -> str:
+    """
+    photo_reference(Places APIから取得できるお店の画像に関する文字列情報)を元に画像linkを作成
+
+    PLACES_PHOTO_PROXY_ENABLEDがtrueの場合は画像を中継する署名付きの/photosのURLを返却し、
+    falseの場合はAPIキーを含むPlace PhotoのURLを直接返却する
+
+    Parameters
+    ----------
+    photo_reference : str
+        Places APIから取得できるお店の画像に関する文字列情報
+
+    Returns
+    -------
+    str
+        生成した画像リンクが返却される
+    """
+    if places_photo_proxy_enabled:
+        return f"{base_url}/photos/{photo_reference}?sig={sign_photo_reference(photo_reference)}"
+    return 'https://maps.googleapis.com/maps/api/place/photo?maxwidth=400&photoreference='+photo_reference+'&key='+os.environ.get('GOOGLE_MAP_API_KEY')
+
+# 同じ施設は検索やページ送りで繰り返し表示されるため、最近の署名を再利用する
+@lru_cache(maxsize=4096)
+def sign_photo_reference(photo_reference: str) -> str:
+    """
+    /photosのURLに付けるphoto_referenceの署名を作成する
+
+    署名のないURLで任意のphoto_referenceを取得させ、APIキーの利用料金を発生させられないようにする
+
+    Parameters
+    ----------
+    photo_reference : str
+        Places APIから取得できるお店の画像に関する文字列情報
+
+    Returns
+    -------
+    str
+        HMAC-SHA256の署名(URLセーフなbase64)
+    """
+    signer = photo_url_hmac.copy()
+    signer.update(photo_reference.encode('utf-8'))
+    return base64.urlsafe_b64encode(signer.digest()).decode('ascii')[:PHOTO_SIGNATURE_LENGTH]
+
+def verify_photo_signature(photo_reference: str, signature: Optional[str]) -> bool:
+    """
+    /photosのURLの署名がphoto_referenceに対して正しいか判定する
+
+    Parameters
+    ----------
+    photo_reference : str
+        Places APIから取得できるお店の画像に関する文字列情報
+    signature : Optional[str]
+        リクエストのURLに付いていた署名
+
+    Returns
+    -------
+    bool
+        署名が正しい場合True
+    """
+    if not signature:
+        return False
+    return hmac.compare_digest(signature.encode('utf-8'), sign_photo_reference(photo_reference).encode('ascii'))
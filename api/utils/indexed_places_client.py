@@ -0,0 +1,104 @@
+import asyncio
+
+from api.utils.places_client import PlacesClient
+from api.utils.places_index import PlacesIndex
+
+# インデックスに記録するPlaces APIのステータス。エラーのレスポンスは記録しない
+INDEXABLE_STATUSES = ('OK', 'ZERO_RESULTS')
+
+
+class IndexedPlacesClient():
+    """
+    Places APIの検索結果をローカルの空間インデックスに記録し、記録済みの範囲の検索に答えるクライアント
+
+    PlacesClientをラップし、同じtype・keywordで最近検索した円に含まれる検索には
+    Places APIへリクエストせずインデックスの施設を返却する
+    インデックスから返却するのは記録済みの施設だけのため、次のページ(next_page_token)は含まない
+    次のページがある検索は円の中の全ての施設ではないため、施設だけを記録しカバー範囲にはしない
+
+    Parameters
+    ----------
+    client : PlacesClient
+        実際にPlaces APIへリクエストするクライアント
+    index : PlacesIndex
+        検索結果を記録する空間インデックス
+    min_results : int
+        インデックスから返却するのに必要な最小の件数。満たない場合はPlaces APIへリクエストする
+
+    Attributes
+    ----------
+    hits : int
+        インデックスから返却した回数
+    misses : int
+        Places APIへリクエストした回数
+    """
+
+    def __init__(self, client: PlacesClient, index: PlacesIndex, min_results: int = 3):
+        self.client = client
+        self.index = index
+        self.min_results = min_results
+        self.hits = 0
+        self.misses = 0
+
+    async def nearby_search(self, location: str, type: str, **params) -> dict:
+        """
+        現在地周辺の営業中の施設を検索する。記録済みの範囲であればインデックスの施設を返却する
+
+        Parameters
+        ----------
+        location : str
+            '緯度,経度'形式の検索の中心地点
+        type : str
+            検索する施設のtype(restaurantなど)
+        params
+            keyword, radiusなどの追加の検索条件
+
+        Returns
+        -------
+        dict
+            Places APIのレスポンス(results, next_page_tokenなど)
+        """
+        # 次のページの取得や、半径を指定しない検索はインデックスの対象外
+        if 'pagetoken' in params or not params.get('radius'):
+            return await self.client.nearby_search(location, type, **params)
+
+        latitude, longitude = (float(value) for value in location.split(','))
+        keyword = params.get('keyword', '')
+        radius = float(params['radius'])
+        results = await asyncio.to_thread(self.index.search, type, keyword, latitude, longitude, radius)
+        if results is not None and len(results) >= self.min_results:
+            self.hits += 1
+            return {'status': 'OK', 'results': results}
+
+        self.misses += 1
+        data = await self.client.nearby_search(location, type, **params)
+        # サーキットブレーカーが返した古い結果は記録しない
+        if data.get('status') in INDEXABLE_STATUSES and not data.get('stale'):
+            # 次のページがある場合、resultsは円の中の一部の施設のため、カバー範囲としては記録しない
+            await asyncio.to_thread(
+                self.index.add, type, keyword, latitude, longitude, radius, data.get('results', []),
+                is_complete=not data.get('next_page_token'),
+            )
+        return data
+
+    async def close(self) -> None:
+        """
+        ラップしたクライアントのコネクションプールとインデックスのファイルを閉じる
+        """
+        await self.client.close()
+        self.index.close()
+
+    def get_stats(self) -> dict:
+        """
+        インデックスのヒット数・ミス数などを返却する
+
+        Returns
+        -------
+        dict
+            検索とインデックスの統計情報
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            **self.index.get_stats(),
+        }
@@ -0,0 +1,71 @@
+from typing import List
+
+from linebot.v3.messaging import AsyncApiClient
+
+
+class LineReplyClient():
+    """
+    シリアライズ済みのリクエストボディで返信・プッシュメッセージを送信するクライアント
+
+    AsyncMessagingApi.reply_messageは引数をReplyMessageRequestとして検証・変換するため、
+    ReplyTemplate等で事前にシリアライズしたdictをそのまま送信できるよう、
+    AsyncApiClientで同じエンドポイントを直接呼び出す
+
+    Parameters
+    ----------
+    api_client : AsyncApiClient
+        認証情報とコネクションを持つLINE Messaging APIのクライアント
+    """
+
+    def __init__(self, api_client: AsyncApiClient):
+        self.api_client = api_client
+
+    async def reply(self, payload: dict) -> None:
+        """
+        返信メッセージを送信する
+
+        Parameters
+        ----------
+        payload : dict
+            ReplyMessageRequestをシリアライズしたものと同じ形式のdict(replyToken, messages)
+        """
+        await self.api_client.call_api(
+            '/v2/bot/message/reply', 'POST',
+            header_params={
+                'Accept': 'application/json',
+                'Content-Type': 'application/json',
+            },
+            body=payload,
+            # 返信結果は使用しないため、レスポンスのモデルへの変換は行わない
+            response_types_map={},
+            auth_settings=['Bearer'],
+            _return_http_data_only=True,
+        )
+
+    async def push(self, user_id: str, messages: List[dict]) -> None:
+        """
+        プッシュメッセージを送信する
+
+        返信トークンを使用した後に、続きのメッセージを送る場合に使用する
+
+        Parameters
+        ----------
+        user_id : str
+            送信先のユーザーID
+        messages : List[dict]
+            シリアライズ済みのメッセージ(ReplyTemplate.messages等)
+        """
+        await self.api_client.call_api(
+            '/v2/bot/message/push', 'POST',
+            header_params={
+                'Accept': 'application/json',
+                'Content-Type': 'application/json',
+            },
+            body={
+                'to': user_id,
+                'messages': messages,
+            },
+            response_types_map={},
+            auth_settings=['Bearer'],
+            _return_http_data_only=True,
+        )
@@ -1,31 +1,106 @@
+import atexit
+import json
 import logging
 import os
+import queue
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler
+)
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# アプリケーション全体のロガー名。Loggerで取得するロガーはこの配下になる
+ROOT_LOGGER_NAME = 'api'
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    ログを1行1レコードのJSONとして出力するフォーマッター
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class _InProcessQueueHandler(QueueHandler):
+    """
+    レコードをそのままキューに積むQueueHandler
+
+    QueueHandler.prepareはプロセス間で受け渡せるよう呼び出し元でメッセージを整形するが、
+    キューは同じプロセス内のリスナースレッドが読むだけなので、整形もリスナー側に任せる
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
 class Logger:
-    def __init__(self, name=__name__):
+    """
+    アプリケーションのロガーを取得する
+
+    初回の生成時にだけハンドラーを設定し、以降は同じ設定を使い回す
+    ログは呼び出し元ではキューに積むだけで、コンソールとファイルへの出力はバックグラウンドの
+    リスナースレッドが行うため、イベントループ上でディスクI/Oが発生しない
+
+    環境変数
+    - ENV: localの場合はDEBUG、それ以外はINFO以上を出力
+    - LOG_FORMAT: jsonの場合はJSON形式で出力
+    - LOG_FILE: 出力先のファイル(デフォルトはapi/app.log)
+    - LOG_FILE_MAX_BYTES / LOG_FILE_BACKUP_COUNT: ファイルをローテーションするサイズと世代数
+    """
+    _listener = None
+
+    def __init__(self, name=ROOT_LOGGER_NAME):
+        if Logger._listener is None:
+            Logger._configure()
         self.logger = logging.getLogger(name)
 
+    @staticmethod
+    def _configure() -> None:
+        logger = logging.getLogger(ROOT_LOGGER_NAME)
+
         env = os.getenv("ENV", "production")
         if env == "local":
-            self.logger.setLevel(logging.DEBUG)
+            logger.setLevel(logging.DEBUG)
         else:
-            self.logger.setLevel(logging.INFO)
+            logger.setLevel(logging.INFO)
 
-        formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
+        if os.getenv('LOG_FORMAT', 'text') == 'json':
+            formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
 
         # ログをコンソールに表示するハンドラ
         ch = logging.StreamHandler()
         ch.setFormatter(formatter)
-        self.logger.addHandler(ch)
 
         # ログをファイルに出力するハンドラ
-        fh = logging.FileHandler('api/app.log')
+        fh = RotatingFileHandler(
+            os.getenv('LOG_FILE', 'api/app.log'),
+            maxBytes=int(os.getenv('LOG_FILE_MAX_BYTES', 10 * 1024 * 1024)),
+            backupCount=int(os.getenv('LOG_FILE_BACKUP_COUNT', 5)),
+            encoding='utf-8',
+        )
         fh.setFormatter(formatter)
-        self.logger.addHandler(fh)
+
+        log_queue = queue.SimpleQueue()
+        logger.addHandler(_InProcessQueueHandler(log_queue))
+        logger.propagate = False
+
+        Logger._listener = QueueListener(log_queue, ch, fh, respect_handler_level=True)
+        Logger._listener.start()
+        atexit.register(Logger._listener.stop)
 
     def get(self) -> logging.Logger:
         return self.logger
-
@@ -0,0 +1,227 @@
+"""
+Summary
+-------
+Prometheusのテキスト形式で出力できる軽量なメトリクス
+
+Description
+-----------
+処理の各段階のレイテンシをヒストグラムで、件数をカウンターで記録する。
+記録はイベントループ上からのみ行う前提で、ロックを使わずdictの更新だけで済ませているため、
+本番環境で常に有効にしておけるほどオーバーヘッドは小さい。
+キャッシュやキューが持つ統計情報のdictは、register_collectorで登録しておくと出力時に読み出される。
+"""
+import time
+from bisect import bisect_left
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple
+)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Counter():
+    """
+    単調増加するカウンター
+
+    Parameters
+    ----------
+    name : str
+        メトリクス名
+    documentation : str
+        メトリクスの説明
+    labelnames : Tuple[str, ...]
+        ラベル名
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, value: float = 1, **labels) -> None:
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for key, value in self._values.items():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram():
+    """
+    値の分布をバケットごとに数えるヒストグラム
+
+    Parameters
+    ----------
+    name : str
+        メトリクス名
+    documentation : str
+        メトリクスの説明
+    labelnames : Tuple[str, ...]
+        ラベル名
+    buckets : Tuple[float, ...]
+        バケットの上限値(昇順)
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # ラベルの値ごとに[各バケットの件数..., +Infの件数]と合計値を保持する
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = [0] * (len(self.buckets) + 1)
+            self._counts[key] = counts
+            self._sums[key] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            cumulative += counts[-1]
+            bucket_labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {self._sums[key]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+class StageTimer():
+    """
+    処理段階のレイテンシを計測するコンテキストマネージャー
+
+    ブロック内で会話のtypeが判明した場合は、conversation_typeを書き換えてからブロックを抜ける
+    ブロック内で例外が発生した場合はエラー数も記録する
+
+    Parameters
+    ----------
+    stage : str
+        処理段階の名前
+    conversation_type : str
+        検索のtype。不明な場合はnone
+    event_kind : str
+        イベントの種類(text, locationなど)
+    """
+
+    def __init__(self, stage: str, conversation_type: str = 'none', event_kind: str = 'none'):
+        self.stage = stage
+        self.conversation_type = conversation_type
+        self.event_kind = event_kind
+        self._started_at = 0.0
+
+    def __enter__(self) -> 'StageTimer':
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        labels = {
+            'stage': self.stage,
+            'conversation_type': self.conversation_type or 'none',
+            'event_kind': self.event_kind,
+        }
+        STAGE_LATENCY.observe(time.perf_counter() - self._started_at, **labels)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(**labels)
+
+
+class Registry():
+    """
+    メトリクスとコレクターをまとめてPrometheusのテキスト形式で出力する
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors: List[Tuple[str, str, Callable[[], dict]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, prefix: str, documentation: str, collect: Callable[[], Optional[dict]]) -> None:
+        """
+        統計情報のdictを返す関数を登録する
+
+        出力時に関数を呼び出し、数値の各項目を{prefix}_{キー}として出力する
+        キーが_totalで終わる項目はcounter、それ以外はgaugeとして扱う
+
+        Parameters
+        ----------
+        prefix : str
+            メトリクス名の接頭辞
+        documentation : str
+            メトリクスの説明
+        collect : Callable[[], Optional[dict]]
+            統計情報のdictを返す関数
+        """
+        self._collectors.append((prefix, documentation, collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+
+        for prefix, documentation, collect in self._collectors:
+            for key, value in (collect() or {}).items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f'{prefix}_{key}'
+                metric_type = 'counter' if key.endswith('_total') else 'gauge'
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                lines.append(f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    'linebot_stage_duration_seconds',
+    'Latency of each stage of webhook handling',
+    ('stage', 'conversation_type', 'event_kind'),
+))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    'linebot_stage_errors_total',
+    'Number of stages that raised an exception',
+    ('stage', 'conversation_type', 'event_kind'),
+))
+EVENTS = REGISTRY.register(Counter(
+    'linebot_events_total',
+    'Number of webhook events handled',
+    ('event_kind',),
+))
+DEFERRED_REPLIES = REGISTRY.register(Counter(
+    'linebot_deferred_replies_total',
+    'Number of results pushed after an interim reply because the reply deadline passed',
+    ('event_kind',),
+))
@@ -0,0 +1,213 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# キャッシュする画像のContent-Typeと、ファイルの拡張子。これ以外の形式はキャッシュしない
+PHOTO_SUFFIXES = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+}
+CONTENT_TYPES = {suffix: content_type for content_type, suffix in PHOTO_SUFFIXES.items()}
+
+
+class PhotoCache():
+    """
+    施設の画像をディレクトリ内のファイルとしてキャッシュする
+
+    ファイル名はphoto_referenceのSHA-256に画像の形式の拡張子を付けたものとし、ファイルの合計サイズがmax_bytesを超えた場合は
+    最も使われていないものから削除する(LRU)
+    使われた順番はファイルの更新時刻にも記録し、プロセスを再起動しても引き継ぐ
+    ファイルの読み書きはブロッキングのため、呼び出し側で別スレッドから実行する
+    管理情報はロックで排他するため、複数のスレッドから同時に呼び出してよい
+
+    同じディレクトリを複数のプロセスで共有した場合、他のプロセスが削除したファイルはキャッシュにないものとして扱う
+
+    Parameters
+    ----------
+    directory : str
+        画像を保存するディレクトリ
+    max_bytes : int
+        キャッシュする画像の合計サイズの上限
+
+    Attributes
+    ----------
+    evictions : int
+        上限を超えたため削除した回数
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 200 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # photo_referenceのSHA-256 -> (拡張子, サイズ, ETag)。ETagは最初に読み込んだ時に求める
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def get(self, photo_reference: str) -> Optional[Tuple[bytes, str, str]]:
+        """
+        キャッシュした画像を読み込み、最近使われたものとして記録する
+
+        Parameters
+        ----------
+        photo_reference : str
+            Places APIから取得できるお店の画像に関する文字列情報
+
+        Returns
+        -------
+        Optional[Tuple[bytes, str, str]]
+            画像のバイト列、ETag、Content-Type。キャッシュにない場合はNone
+        """
+        name = self._get_name(photo_reference)
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is None:
+            return None
+
+        suffix, size, etag = entry
+        path = os.path.join(self.directory, name + suffix)
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                if self._entries.get(name, (None,))[0] == suffix:
+                    self._remove(name)
+            return None
+
+        if size != len(content) or etag is None:
+            etag = self.create_etag(content)
+        with self._lock:
+            # 読み込み中に他のスレッドが削除・置き換えた場合は、管理情報に戻さない
+            if self._entries.get(name, (None,))[0] == suffix:
+                self._remove(name)
+                self._entries[name] = (suffix, len(content), etag)
+                self._bytes += len(content)
+        return content, etag, CONTENT_TYPES[suffix]
+
+    def put(self, photo_reference: str, content: bytes, content_type: str) -> str:
+        """
+        画像をキャッシュし、サイズの上限を超えた分を古いものから削除する
+
+        書き込み途中のファイルを読まないよう、一時ファイルに書き込んでから置き換える
+
+        Parameters
+        ----------
+        photo_reference : str
+            Places APIから取得できるお店の画像に関する文字列情報
+        content : bytes
+            画像のバイト列
+        content_type : str
+            画像のContent-Type。PHOTO_SUFFIXESにない形式はキャッシュしない
+
+        Returns
+        -------
+        str
+            画像のETag
+        """
+        etag = self.create_etag(content)
+        suffix = PHOTO_SUFFIXES.get(content_type)
+        if suffix is None or len(content) > self.max_bytes:
+            return etag
+
+        name = self._get_name(photo_reference)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(temp_path, os.path.join(self.directory, name + suffix))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        evicted = []
+        with self._lock:
+            if name in self._entries:
+                # 形式が変わった場合は、前の形式のファイルを削除する
+                if self._entries[name][0] != suffix:
+                    evicted.append((name, self._entries[name][0]))
+                self._remove(name)
+            self._entries[name] = (suffix, len(content), etag)
+            self._bytes += len(content)
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                evicted.append((oldest, self._entries[oldest][0]))
+                self._remove(oldest)
+                self.evictions += 1
+        for oldest, oldest_suffix in evicted:
+            self._delete_file(oldest + oldest_suffix)
+        return etag
+
+    def get_stats(self) -> dict:
+        """
+        キャッシュした画像の数・合計サイズなどを返却する
+
+        Returns
+        -------
+        dict
+            キャッシュの統計情報
+        """
+        return {
+            'files': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions,
+        }
+
+    @staticmethod
+    def create_etag(content: bytes) -> str:
+        """
+        画像の内容から強いETagを生成する
+
+        Parameters
+        ----------
+        content : bytes
+            画像のバイト列
+
+        Returns
+        -------
+        str
+            ダブルクォートで囲んだETag
+        """
+        return '"' + hashlib.sha256(content).hexdigest()[:32] + '"'
+
+    def _load(self) -> None:
+        """
+        ディレクトリにある画像を、更新時刻が古い順に使われていないものとして読み込む
+        """
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                # 書き込み中の一時ファイルは対象外
+                name, suffix = os.path.splitext(entry.name)
+                if suffix in CONTENT_TYPES and entry.is_file():
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, name, suffix, stat.st_size))
+        for _, name, suffix, size in sorted(files):
+            if name in self._entries:
+                # 形式の異なる同じ画像が残っている場合は、新しい方を使う
+                self._delete_file(name + self._entries[name][0])
+                self._remove(name)
+            self._entries[name] = (suffix, size, None)
+            self._bytes += size
+
+    def _get_name(self, photo_reference: str) -> str:
+        return hashlib.sha256(photo_reference.encode('utf-8')).hexdigest()
+
+    def _remove(self, name: str) -> None:
+        _, size, _ = self._entries.pop(name)
+        self._bytes -= size
+
+    def _delete_file(self, name: str) -> None:
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,396 @@
+import asyncio
+import os
+import random
+from typing import Optional, Tuple
+
+import aiohttp
+from dotenv import load_dotenv
+
+from api.utils.logger import Logger
+from api.utils.rate_limiter import (
+    RateLimitExceededError,
+    TokenBucket
+)
+
+log = Logger().get()
+load_dotenv()
+
+# リトライしても結果が変わらないPlaces APIのステータス
+FATAL_STATUSES = ('OVER_QUERY_LIMIT', 'REQUEST_DENIED', 'INVALID_REQUEST')
+# 時間を置いて再実行すれば成功する可能性のあるHTTPステータス
+RETRYABLE_HTTP_STATUSES = (429, 500, 502, 503, 504)
+DEFAULT_PHOTO_URL = 'https://maps.googleapis.com/maps/api/place/photo'
+# 1枚の画像として受け付けるレスポンスの最大バイト数
+MAX_PHOTO_BYTES = 5 * 1024 * 1024
+
+
+class PlacesApiError(Exception):
+    """
+    Places APIへのリクエストが失敗した場合に送出する例外
+    """
+
+
+class PlacesPhotoNotFoundError(PlacesApiError):
+    """
+    photo_referenceに対応する画像が存在しない場合に送出する例外
+    """
+
+
+class PlacesRateLimitError(PlacesApiError):
+    """
+    レート制限または1日の上限により、Places APIへリクエストしなかった場合に送出する例外
+    """
+
+
+class PlacesCircuitOpenError(PlacesApiError):
+    """
+    サーキットブレーカーが開いているため、Places APIへリクエストしなかった場合に送出する例外
+    """
+
+
+class PlacesClient():
+    """
+    Places API(Nearby Search)への非同期クライアント
+
+    主な役割
+    - コネクションプールを共有し、keep-aliveで接続を使い回す
+    - 1回の試行のタイムアウトと、同時実行数・レート制限の待ちやリトライを含めた呼び出し全体のデッドラインを設定する
+    - 一時的なエラーに対してジッター付きの指数バックオフでリトライする
+    - 同時リクエスト数を制限する
+    - rate_limiterを渡した場合、Nearby SearchとPlace Photoのリクエスト(リトライを含む)の1秒あたりの数と1日の数を制限する
+
+    Parameters
+    ----------
+    base_url : str
+        Nearby SearchのエンドポイントURL
+    photo_url : str
+        Place PhotoのエンドポイントURL
+    api_key : str
+        Google Maps PlatformのAPIキー
+    pool_size : int
+        コネクションプールの最大接続数
+    keepalive_timeout : float
+        使われていない接続を保持する秒数
+    timeout : float
+        1回のリクエストのタイムアウト秒数
+    deadline : float
+        リトライや待ち時間を含めた、1回の呼び出し全体の最大秒数
+    max_retries : int
+        失敗時にリトライする最大回数
+    retry_backoff : float
+        リトライ間隔の基準秒数。試行毎に倍になり、0からこの値までのジッターを加える
+    max_concurrency : int
+        同時にPlaces APIへ送るリクエストの最大数
+    rate_limiter : Optional[TokenBucket]
+        Nearby SearchとPlace Photoのリクエスト数を制限するトークンバケット。Noneの場合は制限しない
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        photo_url: str = DEFAULT_PHOTO_URL,
+        pool_size: int = 20,
+        keepalive_timeout: float = 30.0,
+        timeout: float = 5.0,
+        deadline: float = 8.0,
+        max_retries: int = 2,
+        retry_backoff: float = 0.2,
+        max_concurrency: int = 10,
+        rate_limiter: Optional[TokenBucket] = None,
+    ):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.photo_url = photo_url
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = rate_limiter
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @classmethod
+    def from_env(cls) -> 'PlacesClient':
+        """
+        環境変数の設定からクライアントを生成する
+
+        Returns
+        -------
+        PlacesClient
+            環境変数の値で初期化したクライアント
+        """
+        rate_limiter = None
+        rate = float(os.environ.get('PLACES_RATE_LIMIT_QPS', 0))
+        daily_quota = int(os.environ.get('PLACES_DAILY_QUOTA', 0))
+        if rate > 0 or daily_quota > 0:
+            rate_limiter = TokenBucket(
+                rate=rate,
+                burst=int(os.environ.get('PLACES_RATE_LIMIT_BURST', 10)),
+                daily_quota=daily_quota,
+                max_wait=float(os.environ.get('PLACES_RATE_LIMIT_MAX_WAIT', 2)),
+                # Google Maps Platformの1日の上限は太平洋時間の0時にリセットされる
+                utc_offset=float(os.environ.get('PLACES_DAILY_QUOTA_UTC_OFFSET', -8)),
+            )
+        return cls(
+            base_url=os.environ.get('GOOGLE_MAP_API_URL'),
+            api_key=os.environ.get('GOOGLE_MAP_API_KEY'),
+            photo_url=os.environ.get('GOOGLE_MAP_PHOTO_API_URL') or DEFAULT_PHOTO_URL,
+            pool_size=int(os.environ.get('PLACES_POOL_SIZE', 20)),
+            keepalive_timeout=float(os.environ.get('PLACES_KEEPALIVE_TIMEOUT', 30)),
+            timeout=float(os.environ.get('PLACES_TIMEOUT', 5)),
+            deadline=float(os.environ.get('PLACES_DEADLINE', 8)),
+            max_retries=int(os.environ.get('PLACES_MAX_RETRIES', 2)),
+            retry_backoff=float(os.environ.get('PLACES_RETRY_BACKOFF', 0.2)),
+            max_concurrency=int(os.environ.get('PLACES_MAX_CONCURRENCY', 10)),
+            rate_limiter=rate_limiter,
+        )
+
+    async def nearby_search(self, location: str, type: str, **params) -> dict:
+        """
+        現在地周辺の営業中の施設を検索する
+
+        Parameters
+        ----------
+        location : str
+            '緯度,経度'形式の検索の中心地点
+        type : str
+            検索する施設のtype(restaurantなど)
+        params
+            keyword, radiusなどの追加の検索条件
+
+        Returns
+        -------
+        dict
+            Places APIのレスポンス(results, next_page_tokenなど)
+
+        Raises
+        ------
+        PlacesRateLimitError
+            レート制限または1日の上限により、リクエストしなかった場合
+        PlacesApiError
+            リトライしても成功しなかった場合、またはリトライ不可能なエラーの場合
+        """
+        query = {
+            **params,
+            'location': location,
+            'type': type,
+            'opennow': 'true',
+            'key': self.api_key,
+        }
+        return await self._get_json(query)
+
+    async def get_photo(self, photo_reference: str, max_width: int) -> Tuple[bytes, str]:
+        """
+        Place Photoで施設の画像を取得する
+
+        画像はPlace Photo側でmax_width以下の幅に縮小されたものが返却される
+
+        Parameters
+        ----------
+        photo_reference : str
+            Places APIから取得できるお店の画像に関する文字列情報
+        max_width : int
+            画像の最大の幅(px)
+
+        Returns
+        -------
+        Tuple[bytes, str]
+            画像のバイト列とContent-Type
+
+        Raises
+        ------
+        PlacesPhotoNotFoundError
+            photo_referenceに対応する画像が存在しない場合
+        PlacesRateLimitError
+            レート制限または1日の上限により、リクエストしなかった場合
+        PlacesApiError
+            リトライしても成功しなかった場合、またはリトライ不可能なエラーの場合
+        """
+        try:
+            deadline_at = asyncio.get_running_loop().time() + self.deadline
+            return await asyncio.wait_for(self._get_photo(photo_reference, max_width, deadline_at), timeout=self.deadline)
+        except asyncio.TimeoutError:
+            raise PlacesApiError(f'Place Photoへのリクエストが{self.deadline}秒以内に完了しませんでした')
+
+    async def _get_photo(self, photo_reference: str, max_width: int, deadline_at: float) -> Tuple[bytes, str]:
+        query = {
+            'photoreference': photo_reference,
+            'maxwidth': max_width,
+            'key': self.api_key,
+        }
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self._get_retry_delay(attempt))
+            if self.rate_limiter is not None:
+                try:
+                    await self.rate_limiter.acquire()
+                except RateLimitExceededError as e:
+                    raise PlacesRateLimitError(str(e)) from e
+
+            try:
+                session = self._get_session()
+                async with self._semaphore:
+                    # Place Photoは画像の実体のURLへリダイレクトするため、リダイレクトをたどる
+                    async with session.get(self.photo_url, params=query, timeout=self._get_attempt_timeout(deadline_at)) as response:
+                        if response.status in RETRYABLE_HTTP_STATUSES:
+                            last_error = PlacesApiError(f'Place PhotoがHTTP {response.status}を返しました')
+                            continue
+                        if response.status in (400, 404):
+                            raise PlacesPhotoNotFoundError(f'Place PhotoがHTTP {response.status}を返しました')
+                        if response.status != 200:
+                            raise PlacesApiError(f'Place PhotoがHTTP {response.status}を返しました')
+                        content_type = response.content_type
+                        if not content_type.startswith('image/'):
+                            raise PlacesApiError(f'Place Photoが画像以外を返しました: {content_type}')
+                        content = await response.content.read(MAX_PHOTO_BYTES + 1)
+                        if len(content) > MAX_PHOTO_BYTES:
+                            raise PlacesApiError(f'Place Photoの画像が{MAX_PHOTO_BYTES}バイトを超えています')
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+                log.info(f'Place Photoへのリクエストに失敗しました({attempt + 1}回目): {repr(e)}')
+                if asyncio.get_running_loop().time() >= deadline_at:
+                    break
+                continue
+
+            return content, content_type
+
+        raise PlacesApiError(f'Place Photoへのリクエストが{attempt + 1}回失敗しました: {repr(last_error)}')
+
+    async def close(self) -> None:
+        """
+        コネクションプールを閉じる
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _get_session(self) -> 'aiohttp.ClientSession':
+        """
+        共有のセッションを取得する。未作成または閉じている場合は作成する
+
+        セッションと同時実行数を制限するセマフォはイベントループに紐づくため、初回のリクエスト時に作成する。
+
+        Returns
+        -------
+        aiohttp.ClientSession
+            コネクションプールを持つセッション
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    def _get_attempt_timeout(self, deadline_at: float) -> 'aiohttp.ClientTimeout':
+        """
+        1回の試行のタイムアウトを、呼び出し全体のデッドラインまでの残り時間で制限する
+
+        デッドラインでの打ち切りと試行のタイムアウトが重なっても、リトライせずに終わるようにする
+
+        Parameters
+        ----------
+        deadline_at : float
+            呼び出し全体のデッドライン(イベントループの時刻)
+
+        Returns
+        -------
+        aiohttp.ClientTimeout
+            この試行に使うタイムアウト
+        """
+        remaining = deadline_at - asyncio.get_running_loop().time()
+        return aiohttp.ClientTimeout(total=max(min(self.timeout, remaining), 0.001))
+
+    def _get_retry_delay(self, attempt: int) -> float:
+        """
+        ジッター付きの指数バックオフでリトライまでの待ち時間を求める
+
+        Parameters
+        ----------
+        attempt : int
+            何回目の試行か(0始まり)
+
+        Returns
+        -------
+        float
+            待つ秒数
+        """
+        return self.retry_backoff * (2 ** (attempt - 1)) + random.uniform(0, self.retry_backoff)
+
+    async def _get_json(self, query: dict) -> dict:
+        """
+        リトライ・同時実行数の制限付きでGETリクエストを送りJSONを返却する
+
+        同時実行数・レート制限の待ち、各試行、リトライまでの待ちを合わせてdeadline秒で打ち切る
+
+        Parameters
+        ----------
+        query : dict
+            クエリパラメータ
+
+        Returns
+        -------
+        dict
+            レスポンスのJSON
+
+        Raises
+        ------
+        PlacesRateLimitError
+            レート制限または1日の上限により、リクエストしなかった場合
+        PlacesApiError
+            deadline秒以内に成功しなかった場合、またはリトライ不可能なエラーの場合
+        """
+        try:
+            deadline_at = asyncio.get_running_loop().time() + self.deadline
+            return await asyncio.wait_for(self._request_json(query, deadline_at), timeout=self.deadline)
+        except asyncio.TimeoutError:
+            raise PlacesApiError(f'Places APIへのリクエストが{self.deadline}秒以内に完了しませんでした')
+
+    async def _request_json(self, query: dict, deadline_at: float) -> dict:
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self._get_retry_delay(attempt))
+            if self.rate_limiter is not None:
+                try:
+                    await self.rate_limiter.acquire()
+                except RateLimitExceededError as e:
+                    raise PlacesRateLimitError(str(e)) from e
+
+            try:
+                session = self._get_session()
+                async with self._semaphore:
+                    async with session.get(self.base_url, params=query, timeout=self._get_attempt_timeout(deadline_at)) as response:
+                        if response.status in RETRYABLE_HTTP_STATUSES:
+                            last_error = PlacesApiError(f'Places APIがHTTP {response.status}を返しました')
+                            continue
+                        if response.status != 200:
+                            raise PlacesApiError(f'Places APIがHTTP {response.status}を返しました')
+                        data = await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+                log.info(f'Places APIへのリクエストに失敗しました({attempt + 1}回目): {repr(e)}')
+                if asyncio.get_running_loop().time() >= deadline_at:
+                    break
+                continue
+
+            status = data.get('status')
+            if status in FATAL_STATUSES:
+                raise PlacesApiError(f'Places APIエラー: {status} {data.get("error_message", "")}')
+            if status == 'UNKNOWN_ERROR':
+                last_error = PlacesApiError('Places APIエラー: UNKNOWN_ERROR')
+                continue
+            return data
+
+        raise PlacesApiError(f'Places APIへのリクエストが{attempt + 1}回失敗しました: {repr(last_error)}')
@@ -0,0 +1,384 @@
+"""
+Summary
+-------
+Places APIの検索結果を位置で引けるように保持するローカルの空間インデックス
+
+Description
+-----------
+検索結果の施設と「どの範囲を検索したか(カバー範囲)」を記録し、記録済みの範囲に含まれる検索には
+Places APIを使わずに答えられるようにする。
+
+- 施設は(type, keyword)ごとに緯度経度の格子(約1km四方)のバケットに登録する
+- カバー範囲は検索の中心と半径で、検索した時刻から一定時間だけ有効とする
+- 記録はレコードを追記するだけのバイナリファイルに保存し、mmapで読み込む。
+  メモリには位置と時刻・ファイル内の位置だけを保持し、店名等の文字列は返却する時にファイルから読む
+
+ファイルの形式(リトルエンディアン)
+- 先頭: MAGIC(4バイト) + バージョン(2バイト)
+- レコード: 全体の長さ(4バイト) + 種類(1バイト) + 緯度・経度・記録時刻(8バイト x 3)
+  + 評価値または半径(4バイト浮動小数点) + レビュー数(4バイト、カバー範囲では0) + 文字列(長さ2バイト + UTF-8) x 種類ごとの個数
+  - 施設: place_id, name, photo_reference, type, keyword
+  - カバー範囲: type, keyword
+
+同じファイルを複数のプロセスで共有する構成には対応しない(プロセスごとに別のパスを指定する)
+"""
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from api.utils.result_ranker import get_distance
+
+MAGIC = b'PIDX'
+VERSION = 1
+FILE_HEADER = struct.Struct('<4sH')
+RECORD_HEADER = struct.Struct('<IBdddfI')
+STRING_LENGTH = struct.Struct('<H')
+
+KIND_PLACE = 1
+KIND_COVERAGE = 2
+
+# 格子の1辺の大きさ(度)。緯度方向で約1.1km
+CELL_SIZE = 0.01
+# 1度あたりの緯度方向の距離(m)
+METERS_PER_DEGREE = 111320.0
+# 評価値がない施設を記録する値
+NO_RATING = -1.0
+
+
+class PlacesIndex():
+    """
+    Places APIの検索結果を記録し、記録済みの範囲の検索に答える空間インデックス
+
+    ファイルの読み書きはブロッキングのため、呼び出し側で別スレッドから実行する
+    管理情報はロックで排他するため、複数のスレッドから同時に呼び出してよい
+
+    Parameters
+    ----------
+    path : str
+        記録を保存するファイルのパス
+    ttl : float
+        記録を新しいものとして扱う秒数
+    max_bytes : int
+        ファイルサイズの上限。超えた場合は古い記録を除き、上限の半分以下に書き直す
+
+    Attributes
+    ----------
+    compactions : int
+        ファイルを書き直した回数
+    """
+
+    def __init__(self, path: str, ttl: float = 1800.0, max_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.compactions = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._size = 0
+        # (type, keyword, place_id) -> (ファイル内の位置, 緯度, 経度, 記録時刻)
+        self._places: Dict[Tuple[str, str, str], Tuple[int, float, float, float]] = {}
+        # (type, keyword, 格子のx, 格子のy) -> place_idの集合
+        self._cells: Dict[Tuple[str, str, int, int], Set[str]] = {}
+        # (type, keyword) -> [(緯度, 経度, 半径, 記録時刻)]
+        self._coverages: Dict[Tuple[str, str], List[Tuple[float, float, float, float]]] = {}
+        self._open()
+
+    def search(self, type: str, keyword: str, latitude: float, longitude: float, radius: float) -> Optional[List[dict]]:
+        """
+        記録済みの範囲に含まれる検索であれば、範囲内の施設を返却する
+
+        検索の円全体が、同じtype・keywordの新しいカバー範囲のいずれかに含まれる場合だけ答える
+
+        Parameters
+        ----------
+        type : str
+            検索する施設のtype
+        keyword : str
+            検索のキーワード。ない場合は空文字
+        latitude : float
+            検索の中心の緯度
+        longitude : float
+            検索の中心の経度
+        radius : float
+            検索の半径(m)
+
+        Returns
+        -------
+        Optional[List[dict]]
+            Places APIの検索結果と同じ形式の施設のリスト。記録済みの範囲に含まれない場合はNone
+        """
+        fresh_after = time.time() - self.ttl
+        with self._lock:
+            coverages = self._coverages.get((type, keyword), [])
+            coverages[:] = [coverage for coverage in coverages if coverage[3] >= fresh_after]
+            covered = any(
+                get_distance(latitude, longitude, lat, lng) + radius <= coverage_radius
+                for lat, lng, coverage_radius, _ in coverages
+            )
+            if not covered:
+                return None
+
+            offsets = []
+            for cell in self._get_cells(latitude, longitude, radius):
+                for place_id in self._cells.get((type, keyword, *cell), ()):
+                    offset, lat, lng, fetched_at = self._places[(type, keyword, place_id)]
+                    if fetched_at >= fresh_after and get_distance(latitude, longitude, lat, lng) <= radius:
+                        offsets.append(offset)
+            return [self._to_result(self._read(offset)) for offset in sorted(offsets)]
+
+    def add(self, type: str, keyword: str, latitude: float, longitude: float, radius: float, results: List[dict], is_complete: bool = True) -> None:
+        """
+        検索結果とカバー範囲を記録する
+
+        is_completeがFalseの場合(次のページがある場合など)は、検索した円の全ての施設ではないため
+        施設だけを記録し、カバー範囲は記録しない
+
+        Parameters
+        ----------
+        type : str
+            検索した施設のtype
+        keyword : str
+            検索のキーワード。ない場合は空文字
+        latitude : float
+            検索の中心の緯度
+        longitude : float
+            検索の中心の経度
+        radius : float
+            検索の半径(m)
+        results : List[dict]
+            Places APIの検索結果
+        is_complete : bool
+            検索した円の全ての施設がresultsに含まれる場合True
+        """
+        now = time.time()
+        records = []
+        places = []
+        for item in results:
+            location = item.get('geometry', {}).get('location')
+            if not location or 'place_id' not in item:
+                continue
+            photos = item.get('photos') or [{}]
+            rating = item.get('rating')
+            records.append(self._pack(
+                KIND_PLACE, location['lat'], location['lng'], now,
+                NO_RATING if rating is None else float(rating), int(item.get('user_ratings_total', 0)),
+                item['place_id'], item.get('name', ''), photos[0].get('photo_reference', ''), type, keyword,
+            ))
+            places.append((item['place_id'], location['lat'], location['lng']))
+        if is_complete:
+            records.append(self._pack(KIND_COVERAGE, latitude, longitude, now, radius, 0, type, keyword))
+        if not records:
+            return
+
+        with self._lock:
+            offset = self._append(b''.join(records))
+            for record, (place_id, lat, lng) in zip(records, places):
+                self._register_place(type, keyword, place_id, offset, lat, lng, now)
+                offset += len(record)
+            if is_complete:
+                self._coverages.setdefault((type, keyword), []).append((latitude, longitude, radius, now))
+            if self._size > self.max_bytes:
+                self._compact()
+
+    def close(self) -> None:
+        """
+        ファイルを閉じる
+        """
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def get_stats(self) -> dict:
+        """
+        記録している施設の数・ファイルサイズなどを返却する
+
+        Returns
+        -------
+        dict
+            インデックスの統計情報
+        """
+        return {
+            'places': len(self._places),
+            'coverages': sum(len(coverages) for coverages in self._coverages.values()),
+            'bytes': self._size,
+            'max_bytes': self.max_bytes,
+            'compactions': self.compactions,
+        }
+
+    def _open(self) -> None:
+        """
+        ファイルを開き、新しい記録だけをメモリに読み込む。古い記録が半分以上の場合は書き直す
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, 'a+b')
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() < FILE_HEADER.size:
+            self._file.truncate(0)
+            self._file.write(FILE_HEADER.pack(MAGIC, VERSION))
+            self._file.flush()
+        self._remap()
+
+        magic, version = FILE_HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'Unsupported places index file: {self.path}')
+
+        fresh_after = time.time() - self.ttl
+        offset = FILE_HEADER.size
+        total = stale = 0
+        while offset + RECORD_HEADER.size <= self._size:
+            length, kind, lat, lng, fetched_at, value, _ = RECORD_HEADER.unpack_from(self._mmap, offset)
+            if length < RECORD_HEADER.size or offset + length > self._size:
+                # 書き込み途中で停止した場合の不完全なレコード以降は読まない
+                break
+            total += 1
+            if fetched_at < fresh_after:
+                stale += 1
+            elif kind == KIND_PLACE:
+                place_id, _, _, type, keyword = self._read_strings(offset, 5)
+                self._register_place(type, keyword, place_id, offset, lat, lng, fetched_at)
+            elif kind == KIND_COVERAGE:
+                type, keyword = self._read_strings(offset, 2)
+                self._coverages.setdefault((type, keyword), []).append((lat, lng, value, fetched_at))
+            offset += length
+
+        if offset < self._size or (total and stale * 2 >= total):
+            self._compact()
+
+    def _compact(self) -> None:
+        """
+        新しい記録だけを別のファイルに書き出して置き換える。それでも上限を超える場合は古い記録から除く
+        """
+        fresh_after = time.time() - self.ttl
+        records = []
+        for offset, _, _, fetched_at in self._places.values():
+            if fetched_at >= fresh_after:
+                length = RECORD_HEADER.unpack_from(self._mmap, offset)[0]
+                records.append(bytes(self._mmap[offset:offset + length]))
+        for (type, keyword), coverages in self._coverages.items():
+            for lat, lng, radius, fetched_at in coverages:
+                if fetched_at >= fresh_after:
+                    records.append(self._pack(KIND_COVERAGE, lat, lng, fetched_at, radius, 0, type, keyword))
+
+        # 記録時刻の古い順に並べ、上限の半分に収まるよう古いものから除く
+        # 1回の検索の施設とカバー範囲は同じ記録時刻のため、同じ時刻の記録はまとめて除く。
+        # 一部の施設だけを除くと、残ったカバー範囲の検索に欠けた結果で答えてしまう
+        records.sort(key=lambda record: RECORD_HEADER.unpack_from(record, 0)[4])
+        budget = self.max_bytes // 2
+        total = sum(len(record) for record in records)
+        dropped = 0
+        while dropped < len(records) and total > budget:
+            fetched_at = RECORD_HEADER.unpack_from(records[dropped], 0)[4]
+            while dropped < len(records) and RECORD_HEADER.unpack_from(records[dropped], 0)[4] == fetched_at:
+                total -= len(records[dropped])
+                dropped += 1
+        records = records[dropped:]
+
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(FILE_HEADER.pack(MAGIC, VERSION))
+            for record in records:
+                f.write(record)
+        self._mmap.close()
+        self._file.close()
+        os.replace(temp_path, self.path)
+
+        self._places.clear()
+        self._cells.clear()
+        self._coverages.clear()
+        self._file = open(self.path, 'a+b')
+        self._remap()
+        offset = FILE_HEADER.size
+        for record in records:
+            length, kind, lat, lng, fetched_at, value, _ = RECORD_HEADER.unpack_from(record, 0)
+            if kind == KIND_PLACE:
+                place_id, _, _, type, keyword = self._read_strings(offset, 5)
+                self._register_place(type, keyword, place_id, offset, lat, lng, fetched_at)
+            else:
+                type, keyword = self._read_strings(offset, 2)
+                self._coverages.setdefault((type, keyword), []).append((lat, lng, value, fetched_at))
+            offset += length
+        self.compactions += 1
+
+    def _append(self, data: bytes) -> int:
+        offset = self._size
+        self._file.write(data)
+        self._file.flush()
+        self._remap()
+        return offset
+
+    def _remap(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+        self._size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), self._size, access=mmap.ACCESS_READ)
+
+    def _register_place(self, type: str, keyword: str, place_id: str, offset: int, lat: float, lng: float, fetched_at: float) -> None:
+        key = (type, keyword, place_id)
+        previous = self._places.get(key)
+        if previous is not None:
+            self._cells[(type, keyword, *self._get_cell(previous[1], previous[2]))].discard(place_id)
+        self._places[key] = (offset, lat, lng, fetched_at)
+        self._cells.setdefault((type, keyword, *self._get_cell(lat, lng)), set()).add(place_id)
+
+    def _read(self, offset: int) -> tuple:
+        _, _, lat, lng, _, rating, reviews = RECORD_HEADER.unpack_from(self._mmap, offset)
+        place_id, name, photo_reference, type, _ = self._read_strings(offset, 5)
+        return place_id, name, photo_reference, type, lat, lng, rating, reviews
+
+    def _read_strings(self, offset: int, count: int) -> List[str]:
+        values = []
+        position = offset + RECORD_HEADER.size
+        for _ in range(count):
+            (length,) = STRING_LENGTH.unpack_from(self._mmap, position)
+            position += STRING_LENGTH.size
+            values.append(self._mmap[position:position + length].decode('utf-8'))
+            position += length
+        return values
+
+    @staticmethod
+    def _pack(kind: int, lat: float, lng: float, fetched_at: float, value: float, count: int, *strings: str) -> bytes:
+        encoded = [string.encode('utf-8')[:0xFFFF] for string in strings]
+        body = b''.join(STRING_LENGTH.pack(len(string)) + string for string in encoded)
+        return RECORD_HEADER.pack(RECORD_HEADER.size + len(body), kind, lat, lng, fetched_at, value, count) + body
+
+    @staticmethod
+    def _to_result(record: tuple) -> dict:
+        place_id, name, photo_reference, type, lat, lng, rating, reviews = record
+        result = {
+            'name': name,
+            'place_id': place_id,
+            'geometry': {'location': {'lat': lat, 'lng': lng}},
+            'types': [type],
+        }
+        if rating != NO_RATING:
+            # 4バイトの浮動小数点で保存しているため、評価値の桁(小数1桁)に丸める
+            result['rating'] = round(rating, 1)
+            result['user_ratings_total'] = reviews
+        if photo_reference:
+            result['photos'] = [{'photo_reference': photo_reference}]
+        return result
+
+    @staticmethod
+    def _get_cell(latitude: float, longitude: float) -> Tuple[int, int]:
+        return math.floor(latitude / CELL_SIZE), math.floor(longitude / CELL_SIZE)
+
+    def _get_cells(self, latitude: float, longitude: float, radius: float) -> List[Tuple[int, int]]:
+        """
+        中心から半径radiusの円と重なりうる格子を列挙する
+        """
+        lat_delta = radius / METERS_PER_DEGREE
+        lng_delta = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(latitude)), 1e-6))
+        min_x, min_y = self._get_cell(latitude - lat_delta, longitude - lng_delta)
+        max_x, max_y = self._get_cell(latitude + lat_delta, longitude + lng_delta)
+        return [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
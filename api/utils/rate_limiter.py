@@ -0,0 +1,107 @@
+import asyncio
+import time
+from datetime import (
+    datetime,
+    timedelta,
+    timezone
+)
+from typing import Optional
+
+
+class RateLimitExceededError(Exception):
+    """
+    レート制限または1日の上限により、リクエストを送れない場合に送出する例外
+    """
+
+
+class TokenBucket():
+    """
+    1秒あたりのリクエスト数と1日のリクエスト数を制限するトークンバケット
+
+    トークンはrate個/秒で補充され、最大burst個まで貯まる
+    トークンがない場合は補充されるまで待つが、max_wait秒より長く待つ必要がある場合は待たずに例外を送出する
+    待つ場合も先にトークンを予約するため、同時に呼び出されても制限を超えない
+
+    Parameters
+    ----------
+    rate : float
+        1秒あたりに許可するリクエスト数。0以下の場合は制限しない
+    burst : int
+        連続して許可するリクエストの最大数
+    daily_quota : int
+        1日に許可するリクエスト数。0以下の場合は制限しない
+    max_wait : float
+        トークンの補充を待つ最大秒数
+    utc_offset : float
+        1日の区切りのタイムゾーン(UTCからの時間)
+
+    Attributes
+    ----------
+    allowed : int
+        許可したリクエスト数
+    rejected : int
+        制限により拒否したリクエスト数
+    """
+
+    def __init__(self, rate: float, burst: int = 1, daily_quota: int = 0, max_wait: float = 2.0, utc_offset: float = 0.0):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.daily_quota = daily_quota
+        self.max_wait = max_wait
+        self.timezone = timezone(timedelta(hours=utc_offset))
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._day: Optional[str] = None
+        self._daily_used = 0
+        self.allowed = 0
+        self.rejected = 0
+
+    async def acquire(self) -> None:
+        """
+        リクエストを1件送る許可を得る。必要であればトークンが補充されるまで待つ
+
+        Raises
+        ------
+        RateLimitExceededError
+            1日の上限に達した場合、またはmax_wait秒以内にトークンが補充されない場合
+        """
+        day = datetime.now(self.timezone).strftime('%Y-%m-%d')
+        if day != self._day:
+            self._day = day
+            self._daily_used = 0
+        if 0 < self.daily_quota <= self._daily_used:
+            self.rejected += 1
+            raise RateLimitExceededError(f'1日のリクエスト数の上限({self.daily_quota})に達しました')
+
+        wait = 0.0
+        if self.rate > 0:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens < 1:
+                wait = (1 - self._tokens) / self.rate
+                if wait > self.max_wait:
+                    self.rejected += 1
+                    raise RateLimitExceededError(f'リクエストが{self.rate}件/秒の制限を超えています')
+            self._tokens -= 1
+
+        self._daily_used += 1
+        self.allowed += 1
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def get_stats(self) -> dict:
+        """
+        許可・拒否したリクエスト数などを返却する
+
+        Returns
+        -------
+        dict
+            レート制限の統計情報
+        """
+        return {
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+            'daily_used': self._daily_used,
+            'daily_quota': self.daily_quota,
+        }
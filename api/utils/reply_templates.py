@@ -0,0 +1,239 @@
+from typing import Dict, List, Tuple
+
+from linebot.v3.messaging import (
+    Message,
+    MessageAction,
+    PostbackAction,
+    TextMessage
+)
+from linebot.v3.messaging.models import (
+    LocationAction,
+    QuickReply,
+    QuickReplyItem
+)
+
+from api.const import (
+    ASK_LOCATION_QUESTION,
+    ERROR_TEXT,
+    INFORM_TEXT,
+    MORE_RESULTS_TEXT
+)
+from api.utils.conversation_state_machine import (
+    CONVERSATION_STATE_MACHINE,
+    ConversationStateMachine
+)
+
+
+class ReplyTemplate():
+    """
+    返信メッセージをシリアライズ済みの状態で保持するテンプレート
+
+    メッセージのpydanticモデルの構築・検証・dict化は生成時に一度だけ行い、
+    送信時はreply_tokenを差し込むだけでリクエストボディを作成する
+
+    Parameters
+    ----------
+    messages : List[Message]
+        返信するメッセージ
+
+    Attributes
+    ----------
+    messages : List[dict]
+        LINE Messaging APIのリクエスト形式(camelCase)にシリアライズしたメッセージ
+    """
+
+    def __init__(self, messages: List['Message']):
+        self.messages = [message.to_dict() for message in messages]
+
+    def render(self, reply_token: str) -> dict:
+        """
+        reply_tokenを差し込んだ返信リクエストのボディを返却する
+
+        messagesはテンプレートと共有しているため、返却値を書き換えないこと。
+
+        Parameters
+        ----------
+        reply_token : str
+            メッセージに返答を行うために必要なtoken
+
+        Returns
+        -------
+        dict
+            ReplyMessageRequestをシリアライズしたものと同じ形式のdict
+        """
+        return {
+            'replyToken': reply_token,
+            'messages': self.messages,
+        }
+
+    def render_postback(self, reply_token: str, data: List[str]) -> dict:
+        """
+        最後のメッセージのクイックリプライのポストバックにデータを差し込んだ返信リクエストのボディを返却する
+
+        書き換える部分だけを複製し、それ以外はテンプレートと共有する
+
+        Parameters
+        ----------
+        reply_token : str
+            メッセージに返答を行うために必要なtoken
+        data : List[str]
+            クイックリプライの項目の順に並べたポストバックのデータ
+
+        Returns
+        -------
+        dict
+            ReplyMessageRequestをシリアライズしたものと同じ形式のdict
+        """
+        *messages, last = self.messages
+        items = [
+            {**item, 'action': {**item['action'], 'data': value}}
+            for item, value in zip(last['quickReply']['items'], data)
+        ]
+        return {
+            'replyToken': reply_token,
+            'messages': [*messages, {**last, 'quickReply': {**last['quickReply'], 'items': items}}],
+        }
+
+
+class ReplyTemplates():
+    """
+    質問・固定文言の返信テンプレートの集合
+
+    全ての(type, status)の質問と、ERROR_TEXT / INFORM_TEXTの文言、位置情報の質問、
+    検索結果の続きを表示するクイックリプライを起動時に構築する
+    それ以外の文言はtext()の初回呼び出し時に構築して保持する
+
+    Parameters
+    ----------
+    state_machine : ConversationStateMachine
+        質問内容を取得する状態遷移
+    """
+
+    def __init__(self, state_machine: ConversationStateMachine):
+        self._questions: Dict[Tuple[str, int], ReplyTemplate] = {}
+        self._postback_questions: Dict[Tuple[str, int], ReplyTemplate] = {}
+        for (type, status), question in state_machine.questions.items():
+            items = [QuickReplyItem(action=MessageAction(label=option, text=option)) for option in question.options]
+            self._questions[(type, status)] = ReplyTemplate([
+                TextMessage(text=question.text, quick_reply=QuickReply(items=items))
+            ])
+            # ポストバックのデータはユーザーと回答ごとに異なるため、render_postbackで差し込む
+            postback_items = [
+                QuickReplyItem(action=PostbackAction(label=option, data=option, display_text=option))
+                for option in question.options
+            ]
+            self._postback_questions[(type, status)] = ReplyTemplate([
+                TextMessage(text=question.text, quick_reply=QuickReply(items=postback_items))
+            ])
+
+        self._texts: Dict[str, ReplyTemplate] = {}
+        for text in [*ERROR_TEXT.values(), *INFORM_TEXT.values()]:
+            self.text(text)
+
+        self._locations: Dict[str, ReplyTemplate] = {}
+        self.location(ASK_LOCATION_QUESTION)
+
+        self._more_results = QuickReply(
+            items=[QuickReplyItem(action=MessageAction(label=MORE_RESULTS_TEXT, text=MORE_RESULTS_TEXT))]
+        ).to_dict()
+
+    def question(self, type: str, status: int) -> 'ReplyTemplate':
+        """
+        質問文と選択肢のクイックリプライのテンプレートを取得
+
+        Parameters
+        ----------
+        type : str
+            検索のtype
+        status : int
+            検索における何問目の質問かという情報
+
+        Returns
+        -------
+        ReplyTemplate
+            質問のテンプレート
+        """
+        return self._questions[(type, status)]
+
+    def postback_question(self, type: str, status: int) -> 'ReplyTemplate':
+        """
+        質問文と、選択肢をポストバックで返すクイックリプライのテンプレートを取得
+
+        ステートレスモードで使用し、ReplyTemplate.render_postbackで各選択肢のデータを差し込んで返信する
+
+        Parameters
+        ----------
+        type : str
+            検索のtype
+        status : int
+            検索における何問目の質問かという情報
+
+        Returns
+        -------
+        ReplyTemplate
+            質問のテンプレート
+        """
+        return self._postback_questions[(type, status)]
+
+    def text(self, text: str) -> 'ReplyTemplate':
+        """
+        テキストのみの返信テンプレートを取得
+
+        Parameters
+        ----------
+        text : str
+            返信で使用するメッセージ内容
+
+        Returns
+        -------
+        ReplyTemplate
+            テキストのテンプレート
+        """
+        template = self._texts.get(text)
+        if template is None:
+            template = ReplyTemplate([TextMessage(text=text)])
+            self._texts[text] = template
+        return template
+
+    def location(self, text: str) -> 'ReplyTemplate':
+        """
+        位置情報を選択してもらうクイックリプライ付きの返信テンプレートを取得
+
+        Parameters
+        ----------
+        text : str
+            返信で使用するメッセージ内容
+
+        Returns
+        -------
+        ReplyTemplate
+            位置情報の質問のテンプレート
+        """
+        template = self._locations.get(text)
+        if template is None:
+            template = ReplyTemplate([
+                TextMessage(
+                    text=text,
+                    quick_reply=QuickReply(
+                        items=[QuickReplyItem(action=LocationAction(label="location", text="location"))]
+                    )
+                )
+            ])
+            self._locations[text] = template
+        return template
+
+    def more_results(self) -> dict:
+        """
+        検索結果の続きを表示するクイックリプライを取得
+
+        テンプレートと共有しているため、返却値を書き換えないこと。
+
+        Returns
+        -------
+        dict
+            QuickReplyをシリアライズしたもの。メッセージのquickReplyに設定する
+        """
+        return self._more_results
+
+
+REPLY_TEMPLATES = ReplyTemplates(CONVERSATION_STATE_MACHINE)
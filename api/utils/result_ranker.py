@@ -0,0 +1,175 @@
+"""
+Summary
+-------
+Places APIの検索結果の並び替え
+
+Description
+-----------
+検索結果ごとに評価値・レビュー数・送信された位置からの距離を0〜1に正規化し、重み付きで合計したスコアを付ける。
+- 評価値: rating / 5
+- レビュー数: log(1 + user_ratings_total) / log(1 + reviews_saturation)。reviews_saturation件以上は1
+- 距離: 1 - 距離 / 検索半径。検索半径より遠い場合は0
+表示する件数だけをヒープで選び、残りはスコアを付けたまま次のページの候補として保持する。
+"""
+import heapq
+import math
+import os
+from typing import List, Optional, Tuple
+
+# 地球の半径(m)
+EARTH_RADIUS = 6371000.0
+# 表示に必要なフィールド。これらを持たない検索結果は候補から除外する
+REQUIRED_FIELDS = ('name', 'place_id', 'rating', 'user_ratings_total', 'photos')
+
+
+def get_distance(latitude: float, longitude: float, other_latitude: float, other_longitude: float) -> float:
+    """
+    2地点間の距離を求める(ハバーサイン公式)
+
+    Parameters
+    ----------
+    latitude : float
+        1地点目の緯度
+    longitude : float
+        1地点目の経度
+    other_latitude : float
+        2地点目の緯度
+    other_longitude : float
+        2地点目の経度
+
+    Returns
+    -------
+    float
+        距離(m)
+    """
+    phi1 = math.radians(latitude)
+    phi2 = math.radians(other_latitude)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(other_longitude - longitude)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+class ResultRanker():
+    """
+    検索結果にスコアを付け、スコアの高い順にページ単位で取り出す
+
+    候補は表示に必要なフィールドとスコアだけを持つdictで、会話記録に保存してページ送りに使用する
+
+    Parameters
+    ----------
+    rating_weight : float
+        評価値の重み
+    reviews_weight : float
+        レビュー数の重み
+    distance_weight : float
+        距離の近さの重み
+    reviews_saturation : int
+        レビュー数のスコアが1になる件数
+    page_size : int
+        1ページに表示する件数
+    """
+
+    def __init__(
+        self,
+        rating_weight: float = 0.5,
+        reviews_weight: float = 0.3,
+        distance_weight: float = 0.2,
+        reviews_saturation: int = 1000,
+        page_size: int = 3,
+    ):
+        self.rating_weight = rating_weight
+        self.reviews_weight = reviews_weight
+        self.distance_weight = distance_weight
+        self.reviews_saturation = reviews_saturation
+        self.page_size = page_size
+
+    @classmethod
+    def from_env(cls) -> 'ResultRanker':
+        """
+        環境変数の設定から生成する
+
+        Returns
+        -------
+        ResultRanker
+            環境変数の値で初期化したインスタンス
+        """
+        return cls(
+            rating_weight=float(os.environ.get('RESULT_RATING_WEIGHT', 0.5)),
+            reviews_weight=float(os.environ.get('RESULT_REVIEWS_WEIGHT', 0.3)),
+            distance_weight=float(os.environ.get('RESULT_DISTANCE_WEIGHT', 0.2)),
+            reviews_saturation=int(os.environ.get('RESULT_REVIEWS_SATURATION', 1000)),
+            page_size=int(os.environ.get('RESULT_PAGE_SIZE', 3)),
+        )
+
+    def score(self, results: List[dict], latitude: float, longitude: float, radius: Optional[float] = None) -> List[dict]:
+        """
+        検索結果にスコアを付けた候補を作成する
+
+        Parameters
+        ----------
+        results : List[dict]
+            Places APIの検索結果
+        latitude : float
+            送信された位置の緯度
+        longitude : float
+            送信された位置の経度
+        radius : Optional[float]
+            検索半径(m)。Noneの場合は最も遠い検索結果までの距離を使用する
+
+        Returns
+        -------
+        List[dict]
+            表示に必要なフィールドとscoreを持つ候補。検索結果の順番のまま
+        """
+        usable = [item for item in results if all(field in item for field in REQUIRED_FIELDS) and item['photos']]
+        distances = [self._get_distance(item, latitude, longitude) for item in usable]
+        if not radius:
+            radius = max((distance for distance in distances if distance is not None), default=0.0)
+        reviews_scale = math.log1p(self.reviews_saturation)
+
+        candidates = []
+        for item, distance in zip(usable, distances):
+            rating_score = min(float(item['rating']) / 5.0, 1.0)
+            reviews_score = min(math.log1p(int(item['user_ratings_total'])) / reviews_scale, 1.0)
+            # 位置が不明な場合は検索半径の端にあるものとして扱う
+            distance_score = max(0.0, 1.0 - distance / radius) if distance is not None and radius > 0 else 0.0
+            candidates.append({
+                'score': self.rating_weight * rating_score + self.reviews_weight * reviews_score + self.distance_weight * distance_score,
+                'name': item['name'],
+                'place_id': item['place_id'],
+                'rating': item['rating'],
+                'user_ratings_total': item['user_ratings_total'],
+                'photos': [{'photo_reference': item['photos'][0]['photo_reference']}],
+            })
+        return candidates
+
+    def take_page(self, candidates: List[dict]) -> Tuple[List[dict], List[dict]]:
+        """
+        スコアの高い候補をpage_size件取り出す
+
+        全体を並び替えず、ヒープで上位page_size件だけを選ぶ。スコアが同じ場合は先の候補を優先する
+
+        Parameters
+        ----------
+        candidates : List[dict]
+            scoreで作成した候補
+
+        Returns
+        -------
+        Tuple[List[dict], List[dict]]
+            スコアの高い順に並べた表示する候補と、残りの候補(元の順番のまま)
+        """
+        if len(candidates) <= self.page_size:
+            return sorted(candidates, key=lambda candidate: -candidate['score']), []
+
+        top = heapq.nlargest(self.page_size, range(len(candidates)), key=lambda i: (candidates[i]['score'], -i))
+        selected = set(top)
+        return [candidates[i] for i in top], [candidate for i, candidate in enumerate(candidates) if i not in selected]
+
+    @staticmethod
+    def _get_distance(item: dict, latitude: float, longitude: float) -> Optional[float]:
+        location = item.get('geometry', {}).get('location')
+        if not location:
+            return None
+        return get_distance(latitude, longitude, location['lat'], location['lng'])
@@ -0,0 +1,148 @@
+"""
+Summary
+-------
+画像などの静的ファイルを内容のハッシュ付きのURLで配信するための管理
+
+Description
+-----------
+起動時にディレクトリ内のファイルを全て読み込み、内容のSHA-256から「{名前}.{ハッシュ}.{拡張子}」のファイル名を付ける。
+内容が変わればURLも変わるため、ハッシュ付きのURLはクライアントやCDNに永続的にキャッシュさせてよい。
+圧縮で小さくなるファイルは、gzipで圧縮したものも事前に作成しておく。
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+# ファイル名に付けるハッシュの文字数
+HASH_LENGTH = 12
+# 圧縮後のサイズがこの割合以下になる場合だけ、圧縮したものを配信する
+MIN_COMPRESSION_RATIO = 0.9
+
+
+@dataclass(frozen=True)
+class StaticAsset:
+    """
+    メモリに読み込んだ静的ファイル
+
+    Attributes
+    ----------
+    filename : str
+        元のファイル名
+    hashed_filename : str
+        内容のハッシュを付けたファイル名
+    content : bytes
+        ファイルの内容
+    gzip_content : Optional[bytes]
+        gzipで圧縮した内容。圧縮しても小さくならない場合はNone
+    media_type : str
+        Content-Type
+    etag : str
+        ダブルクォートで囲んだ強いETag
+    """
+    filename: str
+    hashed_filename: str
+    content: bytes
+    gzip_content: Optional[bytes]
+    media_type: str
+    etag: str
+
+
+class StaticAssets():
+    """
+    ディレクトリ内の静的ファイルをメモリに読み込み、ハッシュ付きのファイル名で管理する
+
+    Parameters
+    ----------
+    directory : str
+        静的ファイルのディレクトリ
+    prefix : str
+        配信するURLのパス
+    """
+
+    def __init__(self, directory: str, prefix: str = '/images'):
+        self.directory = directory
+        self.prefix = prefix
+        self._assets: Dict[str, StaticAsset] = {}
+        self._hashed_filenames: Dict[str, str] = {}
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            if os.path.isfile(path):
+                asset = self._load(filename, path)
+                self._assets[asset.hashed_filename] = asset
+                self._assets[filename] = asset
+                self._hashed_filenames[filename] = asset.hashed_filename
+
+    def get(self, filename: str) -> Optional[StaticAsset]:
+        """
+        ファイル名から静的ファイルを取得する
+
+        Parameters
+        ----------
+        filename : str
+            ハッシュを付けたファイル名、または元のファイル名
+
+        Returns
+        -------
+        Optional[StaticAsset]
+            静的ファイル。存在しない場合はNone
+        """
+        return self._assets.get(filename)
+
+    def get_url(self, filename: str) -> str:
+        """
+        静的ファイルのハッシュ付きのURLを作成する
+
+        Parameters
+        ----------
+        filename : str
+            元のファイル名
+
+        Returns
+        -------
+        str
+            ハッシュ付きのURL。ファイルが存在しない場合はハッシュなしのURL
+        """
+        return f"{os.environ.get('BASE_URL')}{self.prefix}/{self._hashed_filenames.get(filename, filename)}"
+
+    def is_hashed(self, filename: str) -> bool:
+        """
+        ハッシュを付けたファイル名かどうかを判定する
+
+        Parameters
+        ----------
+        filename : str
+            ファイル名
+
+        Returns
+        -------
+        bool
+            ハッシュを付けたファイル名の場合True
+        """
+        asset = self._assets.get(filename)
+        return asset is not None and asset.hashed_filename == filename
+
+    @staticmethod
+    def _load(filename: str, path: str) -> StaticAsset:
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+        name, ext = os.path.splitext(filename)
+
+        # mtimeを固定し、同じ内容からは常に同じ圧縮結果になるようにする
+        compressed = gzip.compress(content, compresslevel=9, mtime=0)
+        gzip_content = compressed if len(compressed) <= len(content) * MIN_COMPRESSION_RATIO else None
+
+        return StaticAsset(
+            filename=filename,
+            hashed_filename=f'{name}.{digest[:HASH_LENGTH]}{ext}',
+            content=content,
+            gzip_content=gzip_content,
+            media_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+            etag=f'"{digest[:32]}"',
+        )
+
+
+STATIC_ASSETS = StaticAssets(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'images'))
@@ -0,0 +1,271 @@
+"""
+Summary
+-------
+ConversationManagerServiceの主要な処理のマイクロベンチマーク
+
+Description
+-----------
+外部サービスを使わずにCPUで完結する処理を計測し、ベースラインと比較する。
+リポジトリはプロセス内で完結するMemoryConversationRepositoryを使用する。
+
+計測する処理
+- dispatch_start: 会話記録がない状態でのhandle_recive_text(会話開始)
+- dispatch_answer: 会話記録がある状態でのhandle_recive_text(回答)
+- dispatch_error: 会話記録がない状態での不正なメッセージ
+- handle_answer_next / handle_answer_last: 途中・最後の質問へのhandle_answer
+- next_question_content: _get_next_question_content
+- create_stars: _create_stars(0.0〜5.0の評価値を順に使用)
+- flex_message_models_N / flex_message_skeleton_N: N件の結果に対する_get_flex_messageとrender_flex_message
+- rank_results: Places APIの1ページ分(20件)の結果のスコア付けと上位1ページ分の選択
+- serialize_question_reply / serialize_carousel_reply: 返信のボディをAPIクライアントと同じ手順でJSONにする処理
+
+各処理は1回の計測が(--min-time)秒以上になる回数だけ実行し、それを(--repeat)回計測した最小値から
+1回あたりのマイクロ秒を求める。
+状態を書き換える処理は、1回ごとに会話記録を元に戻す処理も計測値に含む。
+
+ベースラインはbenchmarks/conversation_manager_baseline.jsonに保存し、
+いずれかの処理がベースラインから(--threshold)の割合を超えて遅くなった場合は終了コード1で終了する。
+閾値を超えた処理は(--retries)回まで計測し直し、それでも超えている場合だけ遅くなったと判定する。
+計測値はマシンに依存するため、ベースラインは比較を行うのと同じ環境で保存すること。
+
+実行方法
+    python -m benchmarks.conversation_manager_benchmark [--save-baseline] [--threshold 0.25]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+from typing import (
+    Awaitable,
+    Callable,
+    Dict
+)
+
+os.environ.setdefault('BASE_URL', 'https://example.com')
+os.environ.setdefault('GOOGLE_MAP_API_KEY', 'benchmark-key')
+
+from linebot.v3.messaging import (
+    ApiClient,
+    Configuration,
+    FlexMessage
+)
+
+from api.const import (
+    TEXT_TO_START_CONVERSATION
+)
+from api.repository.memory_conversation_repository import MemoryConversationRepository
+from api.services.conversation_manager_service import ConversationManagerService
+from api.utils.conversation_state_machine import CONVERSATION_STATE_MACHINE
+from api.utils.flex_renderer import render_flex_message
+from api.utils.result_ranker import ResultRanker
+from benchmarks.flex_renderer_benchmark import (
+    RATINGS,
+    create_results
+)
+from benchmarks.standins import create_places_response
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'conversation_manager_baseline.json')
+USER_ID = 'benchmark-user'
+ALT_TEXT = '出力結果一覧'
+FLEX_SIZES = (3, 5, 10)
+
+
+def measure(run: Callable[[int], float], min_time: float, repeat: int) -> float:
+    """
+    1回あたりの実行時間(マイクロ秒)を計測する
+
+    1回の計測がmin_time秒以上になるよう実行回数を倍々に増やして決めてから、計測をrepeat回繰り返す
+
+    Parameters
+    ----------
+    run : Callable[[int], float]
+        実行回数を受け取り、その回数の実行にかかった秒数を返す関数
+    min_time : float
+        1回の計測にかける最小の秒数
+    repeat : int
+        計測を繰り返す回数
+
+    Returns
+    -------
+    float
+        最も速かった計測での1回あたりのマイクロ秒
+    """
+    number = 1
+    while run(number) < min_time:
+        number *= 2
+    return min(run(number) for _ in range(repeat)) / number * 1e6
+
+
+def sync_runner(fn: Callable[[int], object]) -> Callable[[int], float]:
+    def run(number: int) -> float:
+        started_at = time.perf_counter()
+        for i in range(number):
+            fn(i)
+        return time.perf_counter() - started_at
+    return run
+
+
+def async_runner(loop: asyncio.AbstractEventLoop, fn: Callable[[int], Awaitable[object]]) -> Callable[[int], float]:
+    async def run_all(number: int) -> float:
+        started_at = time.perf_counter()
+        for i in range(number):
+            await fn(i)
+        return time.perf_counter() - started_at
+
+    return lambda number: loop.run_until_complete(run_all(number))
+
+
+def create_cases(loop: asyncio.AbstractEventLoop) -> Dict[str, Callable[[int], float]]:
+    """
+    計測する処理の一覧を作成する
+
+    Returns
+    -------
+    Dict[str, Callable[[int], float]]
+        処理名と、実行回数を受け取り実行にかかった秒数を返す関数
+    """
+    repository = MemoryConversationRepository()
+    service = ConversationManagerService(USER_ID, 'benchmark-token', repository, None)
+    api_client = ApiClient(Configuration(access_token='benchmark-token'))
+
+    start_text = TEXT_TO_START_CONVERSATION['restaurant']
+    first_status = CONVERSATION_STATE_MACHINE.get_first_status('restaurant')
+    first_question = CONVERSATION_STATE_MACHINE.get_question('restaurant', first_status)
+    last_question = CONVERSATION_STATE_MACHINE.get_question('restaurant', first_question.next_status)
+    in_progress = {'user_id': USER_ID, 'type': 'restaurant', 'current_status': first_status}
+    last_step = {'user_id': USER_ID, 'type': 'restaurant', 'current_status': last_question.id}
+
+    async def dispatch_start(i):
+        await repository.delete(USER_ID)
+        return await service.handle_recive_text(start_text)
+
+    async def dispatch_answer(i):
+        await repository.store(in_progress)
+        return await service.handle_recive_text(first_question.options[i % len(first_question.options)])
+
+    async def dispatch_error(i):
+        return await service.handle_recive_text('こんにちは')
+
+    async def handle_answer_next(i):
+        await repository.store(in_progress)
+        return await service.handle_answer(first_question.options[i % len(first_question.options)], in_progress)
+
+    async def handle_answer_last(i):
+        await repository.store(last_step)
+        return await service.handle_answer(last_question.options[i % len(last_question.options)], last_step)
+
+    cases = {
+        'dispatch_start': async_runner(loop, dispatch_start),
+        'dispatch_answer': async_runner(loop, dispatch_answer),
+        'dispatch_error': async_runner(loop, dispatch_error),
+        'handle_answer_next': async_runner(loop, handle_answer_next),
+        'handle_answer_last': async_runner(loop, handle_answer_last),
+        'next_question_content': sync_runner(lambda i: service._get_next_question_content('restaurant', first_status)),
+        'create_stars': sync_runner(lambda i: service._create_stars(RATINGS[i % len(RATINGS)])),
+    }
+
+    for size in FLEX_SIZES:
+        data = create_results(size)
+        cases[f'flex_message_models_{size}'] = sync_runner(
+            lambda i, data=data: FlexMessage(alt_text=ALT_TEXT, contents=service._get_flex_message(data)).to_dict()
+        )
+        cases[f'flex_message_skeleton_{size}'] = sync_runner(lambda i, data=data: render_flex_message(data, ALT_TEXT))
+
+    ranker = ResultRanker()
+    places_results = create_places_response(20, seed=0)['results']
+    cases['rank_results'] = sync_runner(
+        lambda i: ranker.take_page(ranker.score(places_results, 35.68, 139.76, 1000.0))
+    )
+
+    question_reply = service._get_next_question_content('restaurant', first_status)
+    carousel_reply = {'replyToken': 'benchmark-token', 'messages': [render_flex_message(create_results(3), ALT_TEXT)]}
+    cases['serialize_question_reply'] = sync_runner(
+        lambda i: json.dumps(api_client.sanitize_for_serialization(question_reply))
+    )
+    cases['serialize_carousel_reply'] = sync_runner(
+        lambda i: json.dumps(api_client.sanitize_for_serialization(carousel_reply))
+    )
+    return cases
+
+
+def load_baseline(path: str) -> Dict[str, float]:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['results']
+
+
+def save_baseline(path: str, results: Dict[str, float], args: argparse.Namespace) -> None:
+    data = {
+        'environment': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'system': platform.system(),
+        },
+        'min_time': args.min_time,
+        'repeat': args.repeat,
+        'unit': 'us',
+        'results': {name: round(value, 3) for name, value in results.items()},
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--min-time', type=float, default=0.1, help='1回の計測にかける最小の秒数')
+    parser.add_argument('--repeat', type=int, default=7, help='計測を繰り返す回数(最小値を採用)')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='ベースラインのファイル')
+    parser.add_argument('--save-baseline', action='store_true', help='計測結果をベースラインとして保存する')
+    parser.add_argument('--threshold', type=float, default=0.25, help='遅くなったと判定するベースラインからの増加の割合')
+    parser.add_argument('--retries', type=int, default=2, help='閾値を超えた処理を計測し直す回数')
+    parser.add_argument('--only', nargs='+', help='計測する処理名')
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    try:
+        cases = create_cases(loop)
+        if args.only:
+            cases = {name: run for name, run in cases.items() if name in args.only}
+        results = {name: measure(run, args.min_time, args.repeat) for name, run in cases.items()}
+
+        if args.save_baseline:
+            save_baseline(args.baseline, results, args)
+            for name, value in results.items():
+                print(f'{name:<28} {value:>10.1f}us')
+            print(f'ベースラインを保存しました: {args.baseline}')
+            return 0
+
+        baseline = load_baseline(args.baseline) if os.path.exists(args.baseline) else {}
+        threshold = {name: base * (1 + args.threshold) for name, base in baseline.items()}
+        # 一時的な負荷による誤検知を避けるため、閾値を超えた処理は計測し直して速い方を採用する
+        for _ in range(args.retries):
+            slow = [name for name, value in results.items() if name in threshold and value > threshold[name]]
+            for name in slow:
+                results[name] = min(results[name], measure(cases[name], args.min_time, args.repeat))
+    finally:
+        loop.close()
+
+    regressions = []
+    print(f'{"name":<28} {"current(us)":>12} {"baseline(us)":>13} {"change":>8}')
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f'{name:<28} {value:>12.1f} {"-":>13} {"-":>8}')
+            continue
+        change = value / base - 1
+        mark = ' !' if value > threshold[name] else ''
+        print(f'{name:<28} {value:>12.1f} {base:>13.1f} {change:>+7.0%}{mark}')
+        if value > threshold[name]:
+            regressions.append(name)
+
+    if regressions:
+        print(f'ベースラインから{args.threshold:.0%}を超えて遅くなった処理があります: {", ".join(regressions)}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Summary
+-------
+検索結果カルーセルの生成処理のベンチマーク
+
+Description
+-----------
+pydanticモデルを組み立てるConversationManagerService._get_flex_messageと、
+dictを直接組み立てるapi.utils.flex_renderer.render_flex_messageを比較する。
+計測前に、全ての星の形(0.0〜5.0)と結果件数について両者のJSONがバイト単位で一致することを確認し、
+一致しない場合は終了コード1で終了する。
+
+実行方法
+    python -m benchmarks.flex_renderer_benchmark [--number 200] [--sizes 3 5 10]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+os.environ.setdefault('BASE_URL', 'https://example.com')
+os.environ.setdefault('GOOGLE_MAP_API_KEY', 'benchmark-key')
+
+from linebot.v3.messaging import FlexMessage
+
+from api.services.conversation_manager_service import ConversationManagerService
+from api.utils.flex_renderer import render_flex_message
+
+ALT_TEXT = '出力結果一覧'
+RATINGS = [round(i * 0.1, 1) for i in range(51)]
+
+
+def create_results(size: int, offset: int = 0) -> list:
+    """
+    Places APIの検索結果と同じ形式のダミーデータを作成
+
+    Parameters
+    ----------
+    size : int
+        結果の件数
+    offset : int
+        評価値の選び始める位置
+
+    Returns
+    -------
+    list
+        検索結果のリスト
+    """
+    return [
+        {
+            'name': f'テスト店舗{i}',
+            'rating': RATINGS[(offset + i * 7) % len(RATINGS)],
+            'user_ratings_total': 100 + i,
+            'place_id': f'place-{i}',
+            'photos': [{'photo_reference': f'photo-{i}'}],
+        }
+        for i in range(size)
+    ]
+
+
+def render_with_models(service: ConversationManagerService, data: list) -> str:
+    message = FlexMessage(alt_text=ALT_TEXT, contents=service._get_flex_message(data))
+    return json.dumps(message.to_dict(), ensure_ascii=False)
+
+
+def render_with_skeleton(data: list) -> str:
+    return json.dumps(render_flex_message(data, ALT_TEXT), ensure_ascii=False)
+
+
+def check_equivalence(service: ConversationManagerService, sizes: list) -> bool:
+    """
+    2つの実装の出力がバイト単位で一致するかを確認する
+
+    Returns
+    -------
+    bool
+        全てのケースで一致した場合True
+    """
+    cases = [create_results(1, offset) for offset in range(len(RATINGS))]
+    cases += [create_results(size, offset) for size in sizes for offset in range(7)]
+    for data in cases:
+        expected = render_with_models(service, data).encode('utf-8')
+        actual = render_with_skeleton(data).encode('utf-8')
+        if expected != actual:
+            print(f'出力が一致しません: {data}', file=sys.stderr)
+            return False
+    print(f'{len(cases)}ケースで出力が一致しました')
+    return True
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=200, help='1回の計測で実行する回数')
+    parser.add_argument('--repeat', type=int, default=5, help='計測を繰り返す回数(最小値を採用)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[3, 5, 10], help='結果の件数')
+    args = parser.parse_args()
+
+    service = ConversationManagerService('benchmark-user', 'benchmark-token', None, None)
+    if not check_equivalence(service, args.sizes):
+        return 1
+
+    print(f'{"件数":>4} {"models(us)":>12} {"skeleton(us)":>14} {"speedup":>8}')
+    for size in args.sizes:
+        data = create_results(size)
+        models = min(timeit.repeat(lambda: render_with_models(service, data), number=args.number, repeat=args.repeat))
+        skeleton = min(timeit.repeat(lambda: render_with_skeleton(data), number=args.number, repeat=args.repeat))
+        models_us = models / args.number * 1e6
+        skeleton_us = skeleton / args.number * 1e6
+        print(f'{size:>4} {models_us:>12.1f} {skeleton_us:>14.1f} {models_us / skeleton_us:>7.1f}x')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
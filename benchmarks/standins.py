@@ -0,0 +1,129 @@
+"""
+Summary
+-------
+ベンチマーク用の外部サービスの代替実装
+
+Description
+-----------
+会話記録のDB・Places API・LINE Messaging APIの代わりにローカルで動作し、
+指定した遅延を挟んで応答する。ベンチマークを実サービスに依存させないために使用する。
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import random
+from typing import Optional
+
+from api.repository.async_conversation_repository import AsyncConversationRepository
+
+
+def sign(body: str, channel_secret: str) -> str:
+    """
+    WebhookのリクエストボディからX-Line-Signatureの値を生成する
+
+    Parameters
+    ----------
+    body : str
+        Webhookのリクエストボディ
+    channel_secret : str
+        チャネルシークレット
+
+    Returns
+    -------
+    str
+        署名
+    """
+    digest = hmac.new(channel_secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+def create_places_response(count: int = 20, seed: Optional[int] = None) -> dict:
+    """
+    Places API(Nearby Search)と同じ形式のレスポンスを生成する
+
+    Parameters
+    ----------
+    count : int
+        結果の件数
+    seed : Optional[int]
+        評価値等を決める乱数のシード
+
+    Returns
+    -------
+    dict
+        Places APIのレスポンス
+    """
+    rand = random.Random(seed)
+    return {
+        'status': 'OK',
+        'results': [
+            {
+                'name': f'テスト店舗{i}',
+                'place_id': f'place-{seed}-{i}',
+                'rating': round(rand.uniform(1.0, 5.0), 1),
+                'user_ratings_total': rand.randint(0, 3000),
+                'geometry': {'location': {'lat': 35.68 + rand.uniform(-0.01, 0.01), 'lng': 139.76 + rand.uniform(-0.01, 0.01)}},
+                'photos': [{'photo_reference': f'photo-{seed}-{i}'}],
+                'types': ['restaurant', 'food'],
+            }
+            for i in range(count)
+        ],
+    }
+
+
+class StandInConversationRepository(AsyncConversationRepository):
+    """
+    リポジトリの各操作の前に指定した秒数だけ待機し、DBへの往復の遅延を再現する
+
+    Parameters
+    ----------
+    repository : AsyncConversationRepository
+        実際に読み書きを行うリポジトリ
+    latency : float
+        各操作で待機する秒数
+    """
+
+    def __init__(self, repository: AsyncConversationRepository, latency: float = 0.0):
+        self.repository = repository
+        self.latency = latency
+
+    async def store(self, data):
+        await self._wait()
+        await self.repository.store(data)
+
+    async def update(self, user_id, data):
+        await self._wait()
+        await self.repository.update(user_id, data)
+
+    async def delete(self, user_id):
+        await self._wait()
+        await self.repository.delete(user_id)
+
+    async def get_conversation_info_by_user_id(self, user_id):
+        await self._wait()
+        return await self.repository.get_conversation_info_by_user_id(user_id)
+
+    async def get_result_candidates(self, user_id):
+        await self._wait()
+        return await self.repository.get_result_candidates(user_id)
+
+    async def record_answer(self, user_id, expected_status, property, value, next_status):
+        await self._wait()
+        return await self.repository.record_answer(user_id, expected_status, property, value, next_status)
+
+    async def fetch_answers_and_delete(self, user_id, is_complete):
+        await self._wait()
+        return await self.repository.fetch_answers_and_delete(user_id, is_complete)
+
+    async def find_idle(self, updated_before, limit):
+        await self._wait()
+        return await self.repository.find_idle(updated_before, limit)
+
+    async def delete_idle(self, user_ids, updated_before):
+        await self._wait()
+        return await self.repository.delete_idle(user_ids, updated_before)
+
+    async def _wait(self) -> None:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
@@ -0,0 +1,356 @@
+"""
+Summary
+-------
+/api/callbackに対するエンドツーエンドの負荷試験
+
+Description
+-----------
+署名付きのWebhookを指定したレートで送信し、スループットとレイテンシ(p50/p95/p99)を計測する。
+各ユーザーはQUESTION_SETTINGSに沿って「会話開始 → 質問への回答 → 位置情報の送信」を繰り返し、
+返信を受け取ってから次のメッセージを送る。
+返信の選択肢がポストバックの場合(CONVERSATION_STATELESS_MODE=true)は、選んだ選択肢のポストバックイベントを送る。
+
+会話記録のDB・Places API・LINEの返信APIはbenchmarks/standins.pyの代替実装に置き換え、
+それぞれ指定した遅延を挟んで応答する。会話記録はCONVERSATION_REPOSITORY_BACKENDで指定したリポジトリ
+(デフォルトはmemory)に保存し、各操作の前に--db-latencyの遅延を挟む。アプリケーションは別プロセスのuvicornで起動するため、
+負荷の生成がアプリケーションの計測結果に影響しない。
+WEBHOOK_ASYNC_MODE等のアプリケーションの設定は、このスクリプトの環境変数がそのまま引き継がれる。
+
+計測する値
+- ack: Webhookを送信してからHTTPレスポンスが返るまで
+- reply: Webhookを送信してからLINEの返信APIの代替実装に返信が届くまで
+- push: REPLY_DEADLINE_ENABLED=trueで「検索中…」の後にプッシュメッセージで送られた検索結果の件数
+
+実行方法
+    python -m benchmarks.webhook_load_test --rate 50 --duration 30 --users 200 \\
+        --db-latency 20 --places-latency 300 --reply-latency 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.standins import (
+    create_places_response,
+    sign
+)
+
+CHANNEL_SECRET = 'load-test-secret'
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class ConversationFlow():
+    """
+    1人のユーザーの会話の進行を管理し、次に送るメッセージを生成する
+    """
+
+    def __init__(self, user_id: str, rand: random.Random):
+        from api.utils.conversation_state_machine import CONVERSATION_STATE_MACHINE
+        from api.const import TEXT_TO_START_CONVERSATION
+
+        self.user_id = user_id
+        self.rand = rand
+        self.state_machine = CONVERSATION_STATE_MACHINE
+        self.start_texts = TEXT_TO_START_CONVERSATION
+        self.type = None
+        self.status = None
+        self.waiting_location = False
+        self.postback_data = None
+
+    def observe_reply(self, reply: dict) -> None:
+        """
+        返信のクイックリプライがポストバックの場合、次に送る選択肢のデータを選んでおく
+        """
+        items = reply['messages'][-1].get('quickReply', {}).get('items', [])
+        postbacks = [item['action']['data'] for item in items if item['action']['type'] == 'postback']
+        self.postback_data = self.rand.choice(postbacks) if postbacks else None
+
+    def next_event(self) -> dict:
+        """
+        次に送るイベントのうち、イベントの種類ごとに異なる項目を返す
+        """
+        if self.postback_data is not None and self.type is not None and not self.waiting_location:
+            question = self.state_machine.get_question(self.type, self.status)
+            if question.is_last:
+                self.waiting_location = True
+            else:
+                self.status = question.next_status
+            return {'type': 'postback', 'postback': {'data': self.postback_data}}
+        return {'type': 'message', 'message': {'id': '1', 'quoteToken': 'q', **self.next_message()}}
+
+    def next_message(self) -> dict:
+        if self.type is None:
+            self.type = self.rand.choice(list(self.start_texts))
+            self.status = self.state_machine.get_first_status(self.type)
+            return {'type': 'text', 'text': self.start_texts[self.type]}
+
+        if self.waiting_location:
+            self.type = None
+            self.waiting_location = False
+            return {
+                'type': 'location',
+                'latitude': 35.68 + self.rand.uniform(-0.02, 0.02),
+                'longitude': 139.76 + self.rand.uniform(-0.02, 0.02),
+            }
+
+        question = self.state_machine.get_question(self.type, self.status)
+        if question.is_last:
+            self.waiting_location = True
+        else:
+            self.status = question.next_status
+        return {'type': 'text', 'text': self.rand.choice(question.options)}
+
+
+class LoadTest():
+    """
+    代替サービスの起動・負荷の生成・結果の集計を行う
+    """
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rand = random.Random(args.seed)
+        self.sent_at: Dict[str, float] = {}
+        self.reply_waiters: Dict[str, asyncio.Future] = {}
+        self.ack_latencies: List[float] = []
+        self.reply_latencies: List[float] = []
+        self.statuses: Dict[int, int] = {}
+        self.errors = 0
+        self.sent = 0
+        self.skipped = 0
+        self.pushes = 0
+        self.event_seq = 0
+
+    async def handle_places(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.args.places_latency / 1000)
+        return web.json_response(create_places_response(self.args.places_results, seed=self.rand.randint(0, 10 ** 6)))
+
+    async def handle_reply(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        await asyncio.sleep(self.args.reply_latency / 1000)
+        token = body.get('replyToken')
+        sent_at = self.sent_at.pop(token, None)
+        if sent_at is not None:
+            self.reply_latencies.append(time.perf_counter() - sent_at)
+        waiter = self.reply_waiters.pop(token, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(body)
+        return web.json_response({'sentMessages': [{'id': '1', 'quoteToken': 'q'}]})
+
+    async def handle_push(self, request: web.Request) -> web.Response:
+        await request.json()
+        await asyncio.sleep(self.args.reply_latency / 1000)
+        self.pushes += 1
+        return web.json_response({'sentMessages': [{'id': '1', 'quoteToken': 'q'}]})
+
+    async def start_standins(self) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_get('/maps/api/place/nearbysearch/json', self.handle_places)
+        app.router.add_post('/v2/bot/message/reply', self.handle_reply)
+        app.router.add_post('/v2/bot/message/push', self.handle_push)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', self.args.standin_port).start()
+        return runner
+
+    def start_server(self) -> subprocess.Popen:
+        standin_url = f'http://127.0.0.1:{self.args.standin_port}'
+        env = {
+            **os.environ,
+            'CHANNEL_SECRET': CHANNEL_SECRET,
+            'CHANNEL_ACCESS_TOKEN': 'load-test-token',
+            'BASE_URL': f'http://127.0.0.1:{self.args.port}',
+            'GOOGLE_MAP_API_KEY': 'load-test-key',
+            'GOOGLE_MAP_API_URL': f'{standin_url}/maps/api/place/nearbysearch/json',
+            'LOAD_TEST_LINE_API_HOST': standin_url,
+            'LOAD_TEST_DB_LATENCY': str(self.args.db_latency / 1000),
+            'CONVERSATION_REPOSITORY_BACKEND': os.environ.get('CONVERSATION_REPOSITORY_BACKEND', 'memory'),
+            'LOG_FILE': os.environ.get('LOG_FILE', os.devnull),
+        }
+        return subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.webhook_load_test', '--serve', '--port', str(self.args.port)],
+            env=env,
+        )
+
+    async def wait_for_server(self, session: aiohttp.ClientSession, server: subprocess.Popen) -> None:
+        for _ in range(100):
+            if server.poll() is not None:
+                break
+            try:
+                async with session.get(f'http://127.0.0.1:{self.args.port}/hello') as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+        raise RuntimeError('アプリケーションが起動しませんでした')
+
+    async def send(self, session: aiohttp.ClientSession, flow: ConversationFlow) -> None:
+        self.event_seq += 1
+        token = f'reply-{self.event_seq}'
+        event = {
+            **flow.next_event(),
+            'mode': 'active',
+            'timestamp': int(time.time() * 1000),
+            'source': {'type': 'user', 'userId': flow.user_id},
+            'webhookEventId': f'event-{self.event_seq}',
+            'deliveryContext': {'isRedelivery': False},
+            'replyToken': token,
+        }
+        body = json.dumps({'destination': 'load-test', 'events': [event]}, ensure_ascii=False)
+        waiter = asyncio.get_running_loop().create_future()
+        self.reply_waiters[token] = waiter
+
+        sent_at = time.perf_counter()
+        self.sent_at[token] = sent_at
+        self.sent += 1
+        try:
+            async with session.post(
+                f'http://127.0.0.1:{self.args.port}/api/callback',
+                data=body.encode('utf-8'),
+                headers={'X-Line-Signature': sign(body, CHANNEL_SECRET), 'Content-Type': 'application/json'},
+            ) as response:
+                await response.read()
+                self.ack_latencies.append(time.perf_counter() - sent_at)
+                self.statuses[response.status] = self.statuses.get(response.status, 0) + 1
+            flow.observe_reply(await asyncio.wait_for(waiter, timeout=self.args.reply_timeout))
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.errors += 1
+            self.sent_at.pop(token, None)
+            self.reply_waiters.pop(token, None)
+
+    async def generate(self, session: aiohttp.ClientSession) -> float:
+        flows = [ConversationFlow(f'U{i:08d}', random.Random(self.rand.random())) for i in range(self.args.users)]
+        idle = list(flows)
+        tasks = set()
+
+        def release(flow):
+            return lambda task: idle.append(flow)
+
+        interval = 1 / self.args.rate
+        started_at = time.perf_counter()
+        next_at = started_at
+        while time.perf_counter() - started_at < self.args.duration:
+            if idle:
+                flow = idle.pop(self.rand.randrange(len(idle)))
+                task = asyncio.create_task(self.send(session, flow))
+                task.add_done_callback(release(flow))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            else:
+                self.skipped += 1
+            next_at += interval
+            await asyncio.sleep(max(0, next_at - time.perf_counter()))
+
+        if tasks:
+            await asyncio.wait(tasks)
+        return time.perf_counter() - started_at
+
+    async def run(self) -> dict:
+        runner = await self.start_standins()
+        server = self.start_server()
+        try:
+            connector = aiohttp.TCPConnector(limit=self.args.connections)
+            async with aiohttp.ClientSession(connector=connector) as session:
+                await self.wait_for_server(session, server)
+                elapsed = await self.generate(session)
+        finally:
+            server.terminate()
+            # 終了時にアプリケーションが処理しきるイベント(プッシュメッセージ等)にも応答できるよう、代替サービスは止めずに待つ
+            await asyncio.to_thread(server.wait)
+            await runner.cleanup()
+
+        return {
+            'elapsed_seconds': elapsed,
+            'webhooks_sent': self.sent,
+            'replies_received': len(self.reply_latencies),
+            'pushes_received': self.pushes,
+            'errors': self.errors,
+            'skipped_no_idle_user': self.skipped,
+            'http_statuses': self.statuses,
+            'throughput_rps': len(self.reply_latencies) / elapsed if elapsed else 0,
+            'ack_ms': {f'p{q}': percentile(self.ack_latencies, q) * 1000 for q in (50, 95, 99)},
+            'reply_ms': {f'p{q}': percentile(self.reply_latencies, q) * 1000 for q in (50, 95, 99)},
+        }
+
+
+def create_app():
+    """
+    代替サービスを向くように設定したアプリケーションを生成する
+
+    会話記録のリポジトリはDBへの往復の遅延を挟む代替実装でラップし、
+    LINEの返信APIの送信先は負荷試験側の代替実装に置き換える
+    LINEのAPIクライアントは生成時のイベントループに紐づくため、uvicornのイベントループ上で呼び出す
+    """
+    from api.main import app
+    from api.repository.cached_conversation_repository import CachedConversationRepository
+    from api.routers import line
+    from benchmarks.standins import StandInConversationRepository
+
+    latency = float(os.environ.get('LOAD_TEST_DB_LATENCY', 0))
+    if isinstance(line.conversation_repository, CachedConversationRepository):
+        line.conversation_repository.repository = StandInConversationRepository(line.conversation_repository.repository, latency)
+    else:
+        line.conversation_repository = StandInConversationRepository(line.conversation_repository, latency)
+    line.async_api_client.configuration.host = os.environ['LOAD_TEST_LINE_API_HOST']
+    return app
+
+
+def serve(port: int) -> None:
+    import uvicorn
+
+    uvicorn.run('benchmarks.webhook_load_test:create_app', factory=True, host='127.0.0.1', port=port, log_level='warning')
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, default=50, help='1秒あたりに送信するWebhookの数')
+    parser.add_argument('--duration', type=float, default=30, help='負荷をかける秒数')
+    parser.add_argument('--users', type=int, default=200, help='会話するユーザーの数')
+    parser.add_argument('--connections', type=int, default=100, help='アプリケーションへの同時接続数の上限')
+    parser.add_argument('--db-latency', type=float, default=20, help='会話記録のDBの各操作の遅延(ms)')
+    parser.add_argument('--places-latency', type=float, default=300, help='Places APIの遅延(ms)')
+    parser.add_argument('--reply-latency', type=float, default=30, help='LINEの返信APIの遅延(ms)')
+    parser.add_argument('--places-results', type=int, default=20, help='Places APIが返す結果の件数')
+    parser.add_argument('--reply-timeout', type=float, default=30, help='返信を待つ最大秒数')
+    parser.add_argument('--port', type=int, default=18000, help='アプリケーションのポート')
+    parser.add_argument('--standin-port', type=int, default=18001, help='代替サービスのポート')
+    parser.add_argument('--seed', type=int, default=0, help='乱数のシード')
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力する')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port)
+        return 0
+
+    result = asyncio.run(LoadTest(args).run())
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print(f'送信: {result["webhooks_sent"]} / 返信: {result["replies_received"]} / プッシュ: {result["pushes_received"]}'
+              f' / エラー: {result["errors"]}'
+              f' / 空きユーザーなし: {result["skipped_no_idle_user"]} / HTTP: {result["http_statuses"]}')
+        print(f'スループット: {result["throughput_rps"]:.1f} replies/s ({result["elapsed_seconds"]:.1f}s)')
+        for name in ('ack_ms', 'reply_ms'):
+            values = result[name]
+            print(f'{name:>8}: p50 {values["p50"]:.1f}  p95 {values["p95"]:.1f}  p99 {values["p99"]:.1f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())